@@ -1,17 +1,59 @@
 from flask import Flask, request, Response
-from megago.megago import run_comparison, get_default_go_dag, find_non_existing_terms
+from megago.constants import GO_DOMAINS
+from megago.megago import find_non_existing_terms
+from megago.execution import NUMPY, PYTHON
+from megago.jobs import CANCELLED, DEFAULT_FINISHED_TTL, DEFAULT_MAX_RUNNING, FAILED, FINISHED, JobQueue
+from megago.monitoring import CONTENT_TYPE, render_metrics
+from megago.pair_cache import shared_pair_cache
+from megago.partitions import parse_domains
+from megago.releases import Release, ReleaseRegistry
 from flask_cors import CORS, cross_origin
-from threading import Thread
 
-import uuid
+import hmac
+import os
 
 
 app = Flask(__name__)
 
-# Load the GO_DAG only once for the complete application to speed up computation of comparisons
-GO_DAG = get_default_go_dag()
-# Maps analysis ID to current progress and results once they are available.
-RESULTS = dict()
+# Directory with one subdirectory per GO release that can be loaded while the application is running (see
+# megago.releases). Releases can only be managed if an admin token has been configured.
+RELEASES_DIR = os.environ.get("MEGAGO_RELEASES_DIR")
+ADMIN_TOKEN = os.environ.get("MEGAGO_ADMIN_TOKEN")
+# The application runs inside a WSGI server, in which forking worker processes from request threads is fragile. The numpy
+# backend computes similarities on threads instead (see megago.execution.BACKENDS).
+BACKEND = os.environ.get("MEGAGO_BACKEND", NUMPY)
+
+# The similarities of pairs of GO-terms that are computed by the Python backend are cached for all jobs and releases,
+# since successive analyses share most of their terms (the numpy backend computes a pair faster than it can be looked
+# up). The size of the cache (in MiB) can be changed with MEGAGO_PAIR_CACHE_SIZE, 0 disables it.
+PAIR_CACHE = shared_pair_cache(default=256 if BACKEND == PYTHON else 0)
+
+# The GO-domains that can be analysed (e.g. MEGAGO_DOMAINS=bp), all domains if not set. Releases then only load the
+# slice of their ontology and corpus tables with these domains (see megago.partitions). Terms of the other domains are
+# unknown to such a deployment, and are reported as invalid.
+DOMAINS = parse_domains(os.environ["MEGAGO_DOMAINS"]) if os.environ.get("MEGAGO_DOMAINS") else None
+
+# All GO releases that are loaded. The release that's bundled with MegaGO is loaded only once for the complete
+# application to speed up computation of comparisons.
+RELEASES = ReleaseRegistry()
+RELEASES.register(Release.load(os.environ.get("MEGAGO_DEFAULT_RELEASE", "bundled"), domains=DOMAINS))
+# All analyses, by their ID. Analyses that are not polled for MEGAGO_JOB_IDLE_TIMEOUT seconds (e.g. because the user
+# closed the browser tab) are cancelled, such that their workers become available for the analyses that are waiting.
+# Results that are never fetched are dropped after MEGAGO_JOB_RESULT_TTL seconds (see megago.jobs).
+JOBS = JobQueue(int(os.environ.get("MEGAGO_MAX_JOBS", DEFAULT_MAX_RUNNING)),
+                float(os.environ.get("MEGAGO_JOB_IDLE_TIMEOUT", 120)),
+                float(os.environ.get("MEGAGO_JOB_RESULT_TTL", DEFAULT_FINISHED_TTL)))
+
+
+def is_admin():
+    token = request.headers.get("X-Admin-Token")
+    return ADMIN_TOKEN is not None and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def requested_release(data):
+    """Returns the name of the release that is requested, or None if it does not exist."""
+    name = data.get("go_release") or RELEASES.default
+    return name if name in RELEASES else None
 
 
 @app.route('/analyze', methods=['POST'])
@@ -23,25 +65,40 @@ def analyze():
     if not data or "sample1" not in data or "sample2" not in data:
         return Response(status=422)
 
+    release = requested_release(data)
+    if release is None:
+        return Response(status=422)
+
+    # Only the given GO-domains are compared if the analysis is limited to some of them.
+    domains = DOMAINS or GO_DOMAINS
+    if data.get("domains"):
+        try:
+            domains = parse_domains(data["domains"])
+        except (ValueError, AttributeError, TypeError):
+            return Response(status=422)
+        if not set(domains) <= set(DOMAINS or GO_DOMAINS):
+            return Response(status=422)
+
     go_list1 = data["sample1"]
     go_list2 = data["sample2"]
 
-    id = str(uuid.uuid4())
-
-    thread = Compute(go_list1, go_list2, id)
-    thread.start()
+    job = JOBS.submit(lambda job: compare(job, go_list1, go_list2), {"go_release": release, "domains": domains})
 
     return {
-        "analysis_id": id
+        "analysis_id": job.id,
+        "go_release": release
     }
 
 
 @app.route('/progress/<id>', methods=["POST"])
 @cross_origin()
 def progress(id):
-    if id in RESULTS:
+    job = JOBS.get(id)
+    if job is not None:
         return {
-            "progress": RESULTS[id]["progress"]
+            "progress": job.progress,
+            "eta": job.eta,
+            "state": job.state
         }
     else:
         return Response(status=404)
@@ -50,17 +107,22 @@ def progress(id):
 @app.route('/result/<id>', methods=["POST"])
 @cross_origin()
 def result(id):
-    if id in RESULTS:
-        result = RESULTS[id]["result"]
-        not_present = RESULTS[id]["not_present"]
-        if result:
+    job = JOBS.get(id)
+    if job is not None:
+        if job.done:
+            # The job is dropped shortly after its result has been delivered.
+            JOBS.fetched(id)
+        if job.state == FINISHED:
+            result = job.result
+            return {
+                "similarity": {domain: value for domain, value in zip(GO_DOMAINS, result)
+                               if domain in job.metadata["domains"]},
+                "invalid": list(job.metadata["not_present"]),
+                "go_release": job.metadata["go_release"]
+            }
+        elif job.state in (CANCELLED, FAILED):
             return {
-                "similarity": {
-                    "biological_process": result[0],
-                    "cellular_component": result[1],
-                    "molecular_function": result[2]
-                },
-                "invalid": list(not_present)
+                "error": f"This analysis has been {job.state}."
             }
         else:
             return {
@@ -70,6 +132,16 @@ def result(id):
         return Response(status=404)
 
 
+@app.route('/cancel/<id>', methods=["POST"])
+@cross_origin()
+def cancel(id):
+    if JOBS.get(id, touch=False) is None:
+        return Response(status=404)
+    return {
+        "cancelled": JOBS.cancel(id)
+    }
+
+
 @app.route('/goterms', methods=["POST"])
 @cross_origin()
 def goterms():
@@ -78,43 +150,85 @@ def goterms():
     if not data or "goterms" not in data:
         return Response(status=422)
 
+    name = requested_release(data)
+    if name is None:
+        return Response(status=422)
+
     processed_terms = []
-    for term in data["goterms"]:
-        if term in GO_DAG:
-            current_term = GO_DAG[term]
-            processed_terms.append({
-                "code": term,
-                "namespace": current_term.namespace,
-                "name": current_term.name
-            })
+    with RELEASES.acquire(name) as release:
+        for term in data["goterms"]:
+            if term in release.go_dag:
+                current_term = release.go_dag[term]
+                processed_terms.append({
+                    "code": term,
+                    "namespace": current_term.namespace,
+                    "name": current_term.name
+                })
+
+    return {
+        "goterms": processed_terms,
+        "go_release": name
+    }
 
+
+@app.route('/releases', methods=["GET", "POST"])
+@cross_origin()
+def releases():
     return {
-        "goterms": processed_terms
+        "releases": RELEASES.names(),
+        "default": RELEASES.default
     }
 
 
-class Compute(Thread):
-    def __init__(self, go_list1, go_list2, id):
-        Thread.__init__(self)
-        self.go_list1 = go_list1
-        self.go_list2 = go_list2
-        self.id = id
+@app.route('/releases/<name>', methods=["PUT", "DELETE"])
+def manage_release(name):
+    """Load (or reload) a release from MEGAGO_RELEASES_DIR, or remove it. Jobs that are running keep using the release
+    they started with."""
+    if not is_admin():
+        return Response(status=403)
 
-    def run(self):
-        metadata = {
-            "progress": 0,
-            "result": None,
-            "not_present": None
-        }
-        RESULTS[self.id] = metadata
+    if request.method == "DELETE":
+        try:
+            RELEASES.unregister(name)
+        except KeyError:
+            return Response(status=404)
+        except ValueError:
+            return Response(status=409)
+        return Response(status=204)
+
+    if RELEASES_DIR is None or os.path.basename(name) != name or not os.path.isdir(os.path.join(RELEASES_DIR, name)):
+        return Response(status=404)
+    data = request.get_json(silent=True) or {}
+    RELEASES.register(Release.load(name, os.path.join(RELEASES_DIR, name), domains=DOMAINS),
+                      default=bool(data.get("default")))
+    return releases()
+
+
+@app.route('/releases/<name>/default', methods=["POST"])
+def default_release(name):
+    if not is_admin():
+        return Response(status=403)
+    try:
+        RELEASES.set_default(name)
+    except KeyError:
+        return Response(status=404)
+    return releases()
+
+
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    """Operational metrics in the Prometheus text format (see megago.monitoring)."""
+    return Response(render_metrics(JOBS, RELEASES.sessions()), content_type=CONTENT_TYPE)
 
-        def update_progress(prog):
-            metadata["progress"] = prog
 
-        result = run_comparison(self.go_list1, self.go_list2, GO_DAG, update_progress)
+def compare(job, go_list1, go_list2):
+    # The release stays loaded until this analysis has finished, even if it's replaced in the meantime.
+    with RELEASES.acquire(job.metadata["go_release"]) as release:
+        result = release.session.compare(go_list1, go_list2, job.update_progress, cancel_event=job.cancel_event,
+                                         backend=BACKEND, domains=job.metadata["domains"])
 
-        not_present = find_non_existing_terms(self.go_list1, GO_DAG)
-        not_present.update(find_non_existing_terms(self.go_list2, GO_DAG))
+        not_present = find_non_existing_terms(go_list1, release.go_dag)
+        not_present.update(find_non_existing_terms(go_list2, release.go_dag))
 
-        metadata["not_present"] = not_present
-        metadata["result"] = result
+    job.metadata["not_present"] = not_present
+    return result
@@ -1 +1,10 @@
+def __getattr__(name):
+    # Session is imported on first use, such that importing a submodule (e.g. by the command line interface) does not
+    # load the complete comparison engine.
+    if name == "Session":
+        from .session import Session
+        return Session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+
+__all__ = ["Session"]
@@ -0,0 +1,103 @@
+"""Durable storage of partial results, such that long runs can be resumed after they have been interrupted.
+
+Results are stored in an SQLite database. Every write is a separate transaction, so a result is either stored completely
+or not at all, even if the process is killed while writing. Results that have been stored are never lost.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+def checkpoint_key(*parts):
+    """Returns a key that identifies a unit of work by its input (e.g. the settings and the GO-terms of both samples).
+
+    Parameters
+    ----------
+    parts
+        JSON serialisable values. Lists of GO-terms should be sorted by the caller if their order does not matter.
+
+    Returns
+    -------
+    str
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Checkpoint(object):
+    """Key-value store of completed results, backed by an SQLite database.
+
+    Parameters
+    ----------
+    path : str
+        the database file, which is created if it does not exist yet.
+    fingerprint : str, optional
+        identifies the inputs of the run that's being checkpointed. Resuming from a checkpoint with another fingerprint
+        is refused, since its results would be invalid.
+    resume : bool
+        if True, the results that are already present are kept. Otherwise, the checkpoint is cleared.
+    """
+
+    def __init__(self, path, fingerprint=None, resume=True):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=FULL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
+
+        stored = self._connection.execute("SELECT value FROM metadata WHERE key = 'fingerprint'").fetchone()
+        if resume and stored is not None and fingerprint is not None and stored[0] != fingerprint:
+            self._connection.close()
+            raise ValueError(f"The checkpoint {path} belongs to another run and cannot be resumed.")
+
+        with self._connection:
+            if not resume:
+                self._connection.execute("DELETE FROM results")
+            self._connection.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('fingerprint', ?)",
+                                     (fingerprint,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """Returns the stored result for the given key, or default if no result has been stored yet."""
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def put(self, key, value):
+        """Durably store a JSON serialisable result."""
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """Durably store multiple (key, value) results in one transaction: either all or none of them are stored."""
+        rows = [(key, json.dumps(value)) for key, value in items]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", rows)
+
+    def items(self):
+        """Returns all stored (key, value) results."""
+        with self._lock:
+            rows = self._connection.execute("SELECT key, value FROM results").fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def close(self):
+        self._connection.close()
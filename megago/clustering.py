@@ -0,0 +1,294 @@
+"""Summarise the GO-terms of a sample by clustering redundant terms, similar to REVIGO.
+
+Two terms are redundant if their similarity (lin_metric or rel_metric) is at least a given threshold. Computing the
+similarity of every pair of terms is far too slow for samples with thousands of terms, but only very few pairs are
+similar enough to matter. The lin similarity of two terms is 2 * IC(dca) / (IC(a) + IC(b)), so two terms can only be
+redundant if they share an ancestor x with IC(a) + IC(b) <= 2 * IC(x) / threshold. The rel similarity is never larger
+than the lin similarity, so the same bound holds. Candidate pairs are found with an inverted index from informative
+ancestors to the terms that have them. The terms of every posting are sorted by information content, such that the
+pairs that satisfy the bound are generated with array operations in time proportional to their amount (a shallow
+ancestor with many terms only contributes the pairs of its least informative terms). The exact similarity is then
+only computed for the candidates. This bound does not hold for the wang similarity, whose similarities are computed in
+blocks of matrix products instead.
+"""
+
+import argparse
+import collections
+
+import numpy as np
+
+from .constants import GO_DOMAINS
+from .execution import PROCESSES, map_bounded, plan_execution
+from . import metrics
+
+GREEDY = "greedy"
+SINGLE_LINKAGE = "single"
+CLUSTERING_METHODS = [GREEDY, SINGLE_LINKAGE]
+
+DEFAULT_THRESHOLD = 0.7
+
+
+class Cluster(object):
+    """A group of redundant GO-terms.
+
+    Attributes
+    ----------
+    representative : str
+        the term that represents the cluster
+    members : list
+        all terms in the cluster (including the representative), most frequent first
+    frequency : float
+        fraction of the terms of the sample (in this domain, counting duplicates) that belongs to this cluster
+    """
+
+    def __init__(self, representative, members, frequency):
+        self.representative = representative
+        self.members = members
+        self.frequency = frequency
+
+    def __repr__(self):
+        return f"Cluster(representative={self.representative!r}, members={len(self.members)}, " \
+               f"frequency={self.frequency})"
+
+
+def _effective_info_content(go_id, ancestor_index, highest_ic_anc):
+    """Information content of a term as used in the denominator of lin_metric and rel_metric."""
+    info_content = ancestor_index.info_content(go_id)
+    if info_content == 0:
+        info_content = highest_ic_anc.get(go_id, 0)
+    return info_content
+
+
+def find_candidate_pairs(terms, ancestor_index, highest_ic_anc, threshold):
+    """Find all pairs of terms whose similarity can be at least threshold (see the module documentation).
+
+    Parameters
+    ----------
+    terms : list
+        unique GO-terms of one domain, that are all present in the ontology
+    ancestor_index : AncestorIndex
+        an ancestor index with term counts (see megago.ontology)
+    highest_ic_anc : dict
+        dictionary: key: GO terms, values: information content of the ancestor with the highest information content
+    threshold : float
+        minimal similarity of redundant terms, should be larger than 0
+
+    Returns
+    -------
+    numpy.ndarray
+        k * 2 array with the (i, j) pairs (i < j, indices into terms) in ascending order
+    """
+    effective = np.array([_effective_info_content(term, ancestor_index, highest_ic_anc) for term in terms])
+    postings = collections.defaultdict(list)
+    for i, term in enumerate(terms):
+        minimum = threshold * effective[i] / 2
+        for ancestor in ancestor_index.ancestors(term):
+            info_content = ancestor_index.info_content(ancestor)
+            # A similarity above 0 requires a common ancestor with an information content above 0.
+            if info_content > 0 and info_content >= minimum:
+                postings[ancestor].append(i)
+
+    firsts, seconds = [], []
+    for ancestor, indices in postings.items():
+        if len(indices) > 1:
+            # A small tolerance keeps pairs whose similarity equals the threshold, despite rounding errors.
+            limit = 2 * ancestor_index.info_content(ancestor) / threshold * (1 + 1e-9)
+            pairs = _bounded_pairs(np.array(indices), effective[indices], limit)
+            firsts.append(np.minimum(*pairs))
+            seconds.append(np.maximum(*pairs))
+    if not firsts:
+        return np.empty((0, 2), dtype=np.intp)
+    keys = np.unique(np.concatenate(firsts).astype(np.int64) * len(terms) + np.concatenate(seconds))
+    return np.stack([keys // len(terms), keys % len(terms)], axis=1)
+
+
+def _bounded_pairs(indices, values, limit):
+    """Returns all pairs of different indices whose values sum to at most limit, as two arrays."""
+    order = np.argsort(values, kind="stable")
+    indices, values = indices[order], values[order]
+    positions = np.arange(len(values))
+    # The partners of the term at every position are the following terms, up to the last one that satisfies the bound.
+    ends = np.maximum(np.searchsorted(values, limit - values, side="right"), positions + 1)
+    counts = ends - positions - 1
+    firsts = np.repeat(positions, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[firsts], indices[firsts + 1 + offsets]
+
+
+def _similar_pairs_task(params):
+    """Compute the similarity of a chunk of candidate pairs and keep the pairs that reach the threshold."""
+    (pairs, context, similarity_method, threshold) = params
+    if context is None:
+        context = metrics._WORKER_CONTEXT
+    go_dag, term_counts, highest_ic_anc = context
+    output = []
+    for i, j, id1, id2 in pairs:
+        value = similarity_method(id1, id2, go_dag, term_counts, highest_ic_anc)
+        if value >= threshold:
+            output.append((i, j, value))
+    return output
+
+
+def _find_similar_pairs_wang(terms, wang_index, threshold):
+    """Compare every term with all following terms, one block of rows at a time."""
+    output = []
+    for start in range(0, len(terms), wang_index.BLOCK_SIZE):
+        end = min(start + wang_index.BLOCK_SIZE, len(terms))
+        block = wang_index.similarity_matrix(terms[start:end], terms[start:])
+        rows, cols = np.nonzero(np.triu(np.nan_to_num(block, nan=0.0), 1) >= threshold)
+        output.extend((start + i, start + j, float(block[i, j])) for i, j in zip(rows, cols))
+    return output
+
+
+def find_similar_pairs(terms, session, threshold=DEFAULT_THRESHOLD):
+    """Find all pairs of terms with a similarity of at least threshold.
+
+    Parameters
+    ----------
+    terms : list
+        unique GO-terms of one domain, that are all present in the ontology
+    session : Session
+        the session whose ontology, corpus tables, similarity method and worker pools are used
+    threshold : float
+        minimal similarity of the reported pairs, should be larger than 0
+
+    Returns
+    -------
+    list
+        (i, j, similarity) tuples, with indices into terms
+    """
+    if threshold <= 0:
+        raise ValueError(f"threshold should be larger than 0, but is {threshold}")
+
+    if session.similarity_method == "wang":
+        return _find_similar_pairs_wang(terms, metrics.get_wang_index(session.go_dag), threshold)
+
+    sim_func = metrics.SIMILARITY_METHODS[session.similarity_method]
+    candidates = find_candidate_pairs(terms, session.ancestor_index, session.highest_ic_anc, threshold).tolist()
+    if not candidates:
+        return []
+
+    plan = plan_execution(len(candidates), mode=session.execution, workers=session.workers,
+                          chunk_size=session.chunk_size)
+    context = None
+    if plan.mode != PROCESSES:
+        context = (session.go_dag, session.term_counts, session.highest_ic_anc)
+
+    tasks = (
+        (start, ([(i, j, terms[i], terms[j]) for i, j in candidates[start:start + plan.chunk_size]], context, sim_func,
+                 threshold))
+        for start in range(0, len(candidates), plan.chunk_size)
+    )
+    output = []
+    for _, pairs in map_bounded(session._get_executor(plan), _similar_pairs_task, tasks, plan.max_pending):
+        output.extend(pairs)
+    return output
+
+
+def cluster_terms(go_terms, session, threshold=DEFAULT_THRESHOLD, method=GREEDY):
+    """Cluster the redundant terms of a sample, per GO-domain.
+
+    Representatives are chosen by their frequency in the sample. Ties are broken in favour of the more specific term
+    (the one with the highest information content), and then by identifier, such that results are deterministic.
+
+    * greedy: the most frequent term that has not been clustered yet becomes a representative, and all unclustered
+      terms that are redundant with it join its cluster. This is repeated until all terms are clustered.
+    * single: single linkage clustering. All terms that are connected by a chain of redundant pairs form one cluster,
+      which is represented by its most frequent term.
+
+    Parameters
+    ----------
+    go_terms : list
+        all GO-terms present in the sample (duplicates are counted as frequency)
+    session : Session
+        the session that is used to compute similarities
+    threshold : float
+        minimal similarity of redundant terms
+    method : str
+        one of CLUSTERING_METHODS
+
+    Returns
+    -------
+    dict
+        maps every domain in GO_DOMAINS onto a list of Cluster objects, most frequent clusters first
+    """
+    if method not in CLUSTERING_METHODS:
+        raise ValueError(f"method must be in {CLUSTERING_METHODS} but is {method}")
+
+    index = session.ancestor_index
+    output = dict()
+    for domain, domain_terms in zip(GO_DOMAINS, session.split_per_domain(go_terms)):
+        counts = collections.Counter(domain_terms)
+        total = sum(counts.values())
+        terms = sorted(counts, key=lambda term: (-counts[term], -index.info_content(term), term))
+
+        neighbours = collections.defaultdict(list)
+        for i, j, _ in find_similar_pairs(terms, session, threshold):
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+
+        # Terms are sorted by priority, so the lowest index of a group of terms is its representative.
+        assignment = [None] * len(terms)
+        for i in range(len(terms)):
+            if assignment[i] is not None:
+                continue
+            assignment[i] = i
+            if method == GREEDY:
+                for j in neighbours[i]:
+                    if assignment[j] is None:
+                        assignment[j] = i
+            else:
+                stack = [i]
+                while stack:
+                    current = stack.pop()
+                    for j in neighbours[current]:
+                        if assignment[j] is None:
+                            assignment[j] = i
+                            stack.append(j)
+
+        members = collections.defaultdict(list)
+        for i, representative in enumerate(assignment):
+            members[representative].append(terms[i])
+
+        clusters = [
+            Cluster(terms[representative], values, sum(counts[term] for term in values) / total)
+            for representative, values in members.items()
+        ]
+        clusters.sort(key=lambda cluster: -cluster.frequency)
+        output[domain] = clusters
+    return output
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sample", help="File with the GO-terms of the sample")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Minimal similarity of redundant terms (default: %(default)s)")
+    parser.add_argument("--method", choices=CLUSTERING_METHODS, default=GREEDY,
+                        help="Clustering method (default: %(default)s)")
+    parser.add_argument("--similarity-method", choices=list(metrics.SIMILARITY_METHODS), default="lin",
+                        help="Similarity metric (default: %(default)s)")
+    return parser.parse_args()
+
+
+def main():
+    from .megago import read_input
+    from .session import Session
+
+    options = parse_args()
+    with open(options.sample) as f:
+        go_terms = read_input(f)
+
+    with Session(similarity_method=options.similarity_method) as session:
+        clusters = session.cluster(go_terms, options.threshold, options.method)
+
+    print("DOMAIN,REPRESENTATIVE,NAME,FREQUENCY,SIZE,MEMBERS")
+    for domain in GO_DOMAINS:
+        for cluster in clusters[domain]:
+            name = session.go_dag[cluster.representative].name.replace(",", " ")
+            print(f"{domain},{cluster.representative},{name},{cluster.frequency},{len(cluster.members)},"
+                  f"{';'.join(cluster.members)}")
+
+
+if __name__ == "__main__":
+    main()
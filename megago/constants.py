@@ -1,11 +1,18 @@
-import pkg_resources
 import os
 
-# Main directory that contains all resources for this module.
-DATA_DIR = pkg_resources.resource_filename(__name__, 'resources')
+# Main directory that contains all resources for this module. The package is always installed as a directory (not as a
+# zip file), so the resources can be found next to this file without the (slow) pkg_resources machinery.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources')
 
-# File that contains the precomputed frequency counts.
-FREQUENCY_COUNTS_FILE_PATH = os.path.join(DATA_DIR, "frequency_counts_uniprot.json")
+# File that contains the precomputed frequency counts, one value per (primary) GO-term (see ontology.TermArray). It's
+# not shipped, since it has to be derived from the exact go-basic.obo that's installed: the counts are converted on
+# first use and stored in CACHED_FREQUENCY_COUNTS_FILE_PATH. A package build may place the converted file here instead.
+FREQUENCY_COUNTS_FILE_PATH = os.path.join(DATA_DIR, "frequency_counts_uniprot.npz")
+
+# Frequency counts in the format of previous releases: a JSON dictionary from every primary and alternative
+# GO-identifier onto its count. Converted to CACHED_FREQUENCY_COUNTS_FILE_PATH when FREQUENCY_COUNTS_FILE_PATH is
+# missing or has been derived from another version of GO_DAG_FILE_PATH.
+LEGACY_FREQUENCY_COUNTS_FILE_PATH = os.path.join(DATA_DIR, "frequency_counts_uniprot.json")
 
 # Serialized version of the Direct Acyclic Graph of all GO-terms. Can be downloaded from
 # http://geneontology.org/docs/download-ontology/
@@ -14,9 +21,34 @@ GO_DAG_FILE_PATH = os.path.join(DATA_DIR, "go-basic.obo")
 # File that contains the UniProt associations at a specific moment in time (SwissProt)
 UNIPROT_ASSOCIATIONS_FILE_PATH = os.path.join(DATA_DIR, "associations-swissprot.tab")
 
-# File that contains the precomputed information content values
-HIGHEST_IC_FILE_PATH = os.path.join(DATA_DIR, "highest_ic_uniprot.json")
+# File that contains the precomputed information content values, one value per (primary) GO-term. Not shipped either
+# (see FREQUENCY_COUNTS_FILE_PATH).
+HIGHEST_IC_FILE_PATH = os.path.join(DATA_DIR, "highest_ic_uniprot.npz")
+
+# Information content values in the JSON format of previous releases (see LEGACY_FREQUENCY_COUNTS_FILE_PATH).
+LEGACY_HIGHEST_IC_FILE_PATH = os.path.join(DATA_DIR, "highest_ic_uniprot.json")
 
 HEATMAP_TEMPLATE = os.path.join(DATA_DIR, "heatmap_template.html")
 
+# Directory in which machine specific data (such as the calibration of the execution planner) is cached.
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "megago")
+
+# Frequency counts and information content values that have been converted or computed on this machine, since the
+# package directory may be read-only.
+CACHED_FREQUENCY_COUNTS_FILE_PATH = os.path.join(CACHE_DIR, "frequency_counts_uniprot.npz")
+CACHED_HIGHEST_IC_FILE_PATH = os.path.join(CACHE_DIR, "highest_ic_uniprot.npz")
+
+# File that contains the results of the micro-benchmark that calibrates the execution planner.
+CALIBRATION_FILE_PATH = os.path.join(CACHE_DIR, "calibration.json")
+
+# Checkpoint of the precomputation of the highest_ic values, such that an interrupted precomputation can be resumed.
+HIGHEST_IC_CHECKPOINT_FILE_PATH = os.path.join(CACHE_DIR, "highest_ic_checkpoint.sqlite")
+
 NAN_VALUE = float('nan')
+
+# The namespaces of the Gene Ontology, in the order in which similarities are reported.
+GO_DOMAINS = [
+    "biological_process",
+    "cellular_component",
+    "molecular_function"
+]
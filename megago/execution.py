@@ -0,0 +1,519 @@
+# This module decides how a batch of similarity computations should be executed. Small problems are computed
+# serially in the calling process, larger ones are divided into chunks that are processed by a pool of workers. The
+# decision is based on a simple cost model that is calibrated once by running a micro-benchmark on this machine.
+
+import concurrent.futures
+import json
+import math
+import os
+import pickle
+import random
+import time
+
+from .constants import CALIBRATION_FILE_PATH, GO_DAG_FILE_PATH
+
+SERIAL = "serial"
+THREADS = "threads"
+PROCESSES = "processes"
+EXECUTION_MODES = [SERIAL, THREADS, PROCESSES]
+
+# Kernels that compute similarities: Python loops over all pairs of terms (which hold the GIL, and therefore need
+# processes to scale), or array operations that release the GIL and scale with threads. The numpy backend never starts
+# child processes unless these are requested explicitly, which suits embedded deployments (e.g. WSGI servers).
+PYTHON = "python"
+NUMPY = "numpy"
+BACKENDS = [PYTHON, NUMPY]
+
+# Environment variables that can be used to override the decisions of the planner.
+ENV_EXECUTION = "MEGAGO_EXECUTION"
+ENV_WORKERS = "MEGAGO_WORKERS"
+ENV_CHUNK_SIZE = "MEGAGO_CHUNK_SIZE"
+ENV_TILE_SIZE = "MEGAGO_TILE_SIZE"
+ENV_BACKEND = "MEGAGO_BACKEND"
+
+# How long (in seconds) should the computation of one chunk take? Shorter chunks give smoother progress updates and a
+# better load balance, longer chunks reduce the scheduling overhead.
+TARGET_CHUNK_DURATION = 0.5
+# How many chunks should every worker receive at least (if there are enough rows to divide)?
+MIN_CHUNKS_PER_WORKER = 4
+# Maximum amount of columns that are processed by one task. Together with the chunk size (the amount of rows per task)
+# this determines the size of the tiles in which a computation is divided. Only the tiles that are currently being
+# processed are kept in memory, which bounds the memory usage for samples with a very large amount of terms.
+DEFAULT_TILE_SIZE = 5000
+# How many tasks may be waiting for a worker at the same time (per worker)?
+MAX_PENDING_TASKS_PER_WORKER = 2
+# Interval (in seconds) at which map_bounded checks whether it has been cancelled while it's waiting for results.
+CANCEL_POLL_INTERVAL = 0.1
+
+# Cost of comparing one pair of terms with the numpy backend, relative to the calibrated cost of the Python kernel, and
+# the (estimated) fraction of a thread's throughput that's gained by every additional thread.
+NUMPY_PAIR_COST_FACTOR = 0.1
+NUMPY_THREAD_EFFICIENCY = 0.7
+
+# Version of the calibration file format. Calibration files with another version are ignored.
+CALIBRATION_VERSION = 1
+# Amount of terms (per sample) that are compared with each other while calibrating the cost of one comparison.
+CALIBRATION_TERMS = 20
+
+# Cost model (or None if the machine has not been calibrated) of every calibration file that has been read or written
+# by this process.
+_COST_MODELS = dict()
+
+
+class CostModel(object):
+    """Estimated costs (in seconds) of the different steps that are involved in computing similarities.
+
+    Attributes
+    ----------
+    pair_cost : float
+        time required to compute the similarity of one pair of GO-terms.
+    worker_startup_cost : float
+        time every worker process needs before it can start computing (e.g. parsing the GO DAG).
+    worker_spawn_cost : float
+        time the parent process needs to launch one additional worker process.
+    thread_efficiency : float
+        fraction of a worker's throughput that is gained by every additional thread. This is 0 for kernels that hold
+        the GIL and approaches 1 for kernels that release it.
+    """
+
+    def __init__(self, pair_cost=2e-4, worker_startup_cost=1.0, worker_spawn_cost=0.05, thread_efficiency=0.0):
+        self.pair_cost = pair_cost
+        self.worker_startup_cost = worker_startup_cost
+        self.worker_spawn_cost = worker_spawn_cost
+        self.thread_efficiency = thread_efficiency
+
+    def to_dict(self):
+        return {
+            "version": CALIBRATION_VERSION,
+            "pair_cost": self.pair_cost,
+            "worker_startup_cost": self.worker_startup_cost,
+            "worker_spawn_cost": self.worker_spawn_cost,
+            "thread_efficiency": self.thread_efficiency
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(
+            values["pair_cost"],
+            values["worker_startup_cost"],
+            values["worker_spawn_cost"],
+            values["thread_efficiency"]
+        )
+
+    def estimate(self, mode, workers, items, item_cost=None, thread_efficiency=None):
+        """Estimate the wall clock time (in seconds) that is required to process a given amount of items.
+
+        Parameters
+        ----------
+        mode : str
+            one of EXECUTION_MODES
+        workers : int
+            amount of workers that are used by the threads and processes modes.
+        items : int
+            amount of items (e.g. pairs of GO-terms) that need to be processed.
+        item_cost : float, optional
+            cost of processing a single item. Defaults to the cost of computing the similarity of one pair.
+        thread_efficiency : float, optional
+            overrides the thread efficiency of this model (e.g. for kernels that release the GIL)
+
+        Returns
+        -------
+        float
+        """
+        if item_cost is None:
+            item_cost = self.pair_cost
+        if thread_efficiency is None:
+            thread_efficiency = self.thread_efficiency
+        serial_time = items * item_cost
+        if mode == SERIAL:
+            return serial_time
+        if mode == THREADS:
+            return serial_time / (1 + (workers - 1) * thread_efficiency)
+        return self.worker_startup_cost + workers * self.worker_spawn_cost + serial_time / workers
+
+
+class ExecutionPlan(object):
+    """Describes how a batch of computations should be executed.
+
+    Attributes
+    ----------
+    mode : str
+        one of EXECUTION_MODES
+    workers : int
+        amount of threads or processes that should be used (always 1 for serial execution).
+    chunk_size : int
+        amount of rows that are processed by one task.
+    tile_size : int
+        amount of columns that are processed by one task.
+    backend : str
+        one of BACKENDS
+    """
+
+    def __init__(self, mode, workers, chunk_size, tile_size, backend=PYTHON):
+        self.mode = mode
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.backend = backend
+
+    @property
+    def max_pending(self):
+        """Maximum amount of tasks that should be submitted to an executor, but have not yet been completed."""
+        return self.workers * MAX_PENDING_TASKS_PER_WORKER
+
+    def tiles(self, rows, cols):
+        """Divide a rows * cols grid into tiles of at most chunk_size * tile_size cells.
+
+        Returns
+        -------
+        generator
+            yields (row_start, row_end, col_start, col_end) tuples
+        """
+        for row_start in range(0, rows, self.chunk_size):
+            for col_start in range(0, cols, self.tile_size):
+                yield (row_start, min(row_start + self.chunk_size, rows),
+                       col_start, min(col_start + self.tile_size, cols))
+
+    def __repr__(self):
+        return f"ExecutionPlan(mode={self.mode!r}, workers={self.workers}, chunk_size={self.chunk_size}, " \
+               f"tile_size={self.tile_size}, backend={self.backend!r})"
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """Executor that runs every submitted task immediately in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def _read_int(path):
+    with open(path) as f:
+        return int(f.read().strip())
+
+
+def _cgroup_cpu_limit():
+    """Returns the amount of CPUs that this process is allowed to use according to its cgroup (e.g. the limit that is
+    set on a Docker container), or None if no limit has been configured.
+    """
+    # cgroup v2 exposes the quota and period in one file, e.g. "200000 100000" or "max 100000"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1
+    try:
+        quota = _read_int("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_int("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def available_cpus():
+    """Returns the amount of CPUs that can effectively be used by this process. Both the CPU affinity of this process and
+    the CPU quota of the cgroup it is running in are taken into account.
+
+    Returns
+    -------
+    int
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, int(limit))
+
+    return max(1, cpus)
+
+
+def calibrate(go_dag, term_counts, highest_ic_anc, similarity_method=None):
+    """Run a micro-benchmark that measures the parameters of the cost model on this machine.
+
+    Parameters
+    ----------
+    go_dag : GODag object
+        GODag object from the goatools package
+    term_counts : dict
+        dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
+    highest_ic_anc : dict
+        dictionary: key: GO terms, values: information content of the ancestor with the highest information content
+    similarity_method : function, optional
+        the similarity function that should be benchmarked (defaults to lin_metric)
+
+    Returns
+    -------
+    CostModel
+    """
+    from goatools.obo_parser import GODag
+    from .metrics import compute_similarity_method, lin_metric
+
+    if similarity_method is None:
+        similarity_method = lin_metric
+
+    rng = random.Random(0)
+    terms = sorted(term.id for term in go_dag.values() if term.namespace == "biological_process")
+    sample1 = rng.sample(terms, min(CALIBRATION_TERMS, len(terms)))
+    sample2 = rng.sample(terms, min(CALIBRATION_TERMS, len(terms)))
+
+    start = time.perf_counter()
+    compute_similarity_method(sample1, sample2, go_dag, term_counts, highest_ic_anc, similarity_method)
+    pair_cost = (time.perf_counter() - start) / max(1, len(sample1) * len(sample2))
+
+    # Every worker process parses the DAG and receives a copy of the corpus tables.
+    start = time.perf_counter()
+    GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
+    pickle.loads(pickle.dumps((term_counts, highest_ic_anc)))
+    worker_startup_cost = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        executor.submit(int).result()
+    worker_spawn_cost = time.perf_counter() - start
+
+    return CostModel(pair_cost, worker_startup_cost, worker_spawn_cost)
+
+
+def save_cost_model(cost_model, path=None):
+    """Store the cost model of a calibration, which is used by all plans of this process from now on (see
+    get_cost_model) and by future invocations."""
+    path = path or CALIBRATION_FILE_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as json_file:
+        json.dump(cost_model.to_dict(), json_file)
+    _COST_MODELS[path] = cost_model
+
+
+def load_cost_model(path=None):
+    """Returns the cost model that has been saved by a previous calibration, or None if no (valid) calibration exists."""
+    path = path or CALIBRATION_FILE_PATH
+    try:
+        with open(path) as json_file:
+            values = json.load(json_file)
+        if values.get("version") != CALIBRATION_VERSION:
+            return None
+        return CostModel.from_dict(values)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_cost_model(go_dag=None, term_counts=None, highest_ic_anc=None):
+    """Returns the calibrated cost model for this machine. If no calibration has been performed yet and all required
+    resources are given, the micro-benchmark is run once and its results are stored for future invocations. Otherwise,
+    the default cost model is returned.
+
+    The calibration file is only read once per process, since a plan is made for every comparison (and domain).
+
+    Returns
+    -------
+    CostModel
+    """
+    path = CALIBRATION_FILE_PATH
+    if path not in _COST_MODELS:
+        _COST_MODELS[path] = load_cost_model(path)
+    cost_model = _COST_MODELS[path]
+    if cost_model is not None:
+        return cost_model
+
+    if go_dag is None or term_counts is None or highest_ic_anc is None:
+        return CostModel()
+
+    cost_model = _COST_MODELS[path] = calibrate(go_dag, term_counts, highest_ic_anc)
+    try:
+        save_cost_model(cost_model)
+    except OSError:
+        # The calibration will simply be performed again next time.
+        pass
+    return cost_model
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Environment variable {name} should be an integer, but is {value}")
+
+
+def plan_execution(rows, cols=1, item_cost=None, mode=None, workers=None, chunk_size=None, tile_size=None,
+                   cost_model=None, backend=None, resources=None):
+    """Decide how a computation over rows * cols items should be executed.
+
+    Every argument that is given explicitly takes precedence over the corresponding MEGAGO_EXECUTION, MEGAGO_WORKERS,
+    MEGAGO_CHUNK_SIZE, MEGAGO_TILE_SIZE and MEGAGO_BACKEND environment variables, which in turn take precedence over the
+    choices made by the planner. The planner never chooses processes for the numpy backend.
+
+    Parameters
+    ----------
+    rows : int
+        amount of rows that need to be processed. Rows are the unit in which work is divided over the workers.
+    cols : int
+        amount of items that need to be processed for every row.
+    item_cost : float, optional
+        estimated cost (in seconds) of processing one item. Defaults to the cost of comparing one pair of terms.
+    mode : str, optional
+        one of EXECUTION_MODES
+    workers : int, optional
+        amount of threads or processes that should be used.
+    chunk_size : int, optional
+        amount of rows that should be processed per task.
+    tile_size : int, optional
+        maximum amount of columns that should be processed per task (defaults to DEFAULT_TILE_SIZE).
+    cost_model : CostModel, optional
+        cost model that should be used to make decisions. Defaults to the calibrated model for this machine.
+    backend : str, optional
+        one of BACKENDS (defaults to 'python')
+    resources : tuple, optional
+        (go_dag, term_counts, highest_ic_anc) with which the cost model is calibrated if this machine has not been
+        calibrated yet (see get_cost_model). The calibration spawns a process pool, so it's only run if the plan may
+        use processes: never for the numpy backend or for serial and thread execution.
+
+    Returns
+    -------
+    ExecutionPlan
+    """
+    mode = mode or os.environ.get(ENV_EXECUTION) or None
+    workers = workers or _env_int(ENV_WORKERS)
+    chunk_size = chunk_size or _env_int(ENV_CHUNK_SIZE)
+    tile_size = tile_size or _env_int(ENV_TILE_SIZE) or DEFAULT_TILE_SIZE
+    backend = backend or os.environ.get(ENV_BACKEND) or PYTHON
+
+    if mode is not None and mode not in EXECUTION_MODES:
+        raise ValueError(f"Execution mode must be in {EXECUTION_MODES} but is {mode}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be in {BACKENDS} but is {backend}")
+
+    rows = max(1, rows)
+    cols = max(1, cols)
+    tile_size = max(1, min(tile_size, cols))
+    tiles_per_row = math.ceil(cols / tile_size)
+
+    if mode is None or workers is None or chunk_size is None:
+        if cost_model is None:
+            may_use_processes = backend != NUMPY and mode in (None, PROCESSES)
+            cost_model = get_cost_model(*(resources if may_use_processes and resources else ()))
+        if item_cost is None:
+            item_cost = cost_model.pair_cost
+            if backend == NUMPY:
+                item_cost *= NUMPY_PAIR_COST_FACTOR
+
+    thread_efficiency = NUMPY_THREAD_EFFICIENCY if backend == NUMPY else None
+    if mode == SERIAL:
+        workers = 1
+    elif workers is None:
+        cpus = min(available_cpus(), rows)
+        if mode == THREADS or (mode is None and backend == NUMPY):
+            workers = cpus
+        else:
+            # Launching more processes is only useful as long as the time they save outweighs the time that's required
+            # to spawn them: t(w) = startup + w * spawn + serial / w is minimal for w = sqrt(serial / spawn).
+            serial_time = rows * cols * item_cost
+            optimum = math.sqrt(serial_time / max(cost_model.worker_spawn_cost, 1e-6))
+            workers = max(1, min(cpus, int(optimum)))
+
+    if mode is None:
+        candidates = [SERIAL]
+        if workers > 1:
+            candidates.append(THREADS)
+            if backend != NUMPY:
+                candidates.append(PROCESSES)
+        mode = min(candidates, key=lambda m: cost_model.estimate(m, workers, rows * cols, item_cost,
+                                                                 thread_efficiency))
+        if mode == SERIAL:
+            workers = 1
+
+    if chunk_size is None:
+        per_chunk = math.ceil(TARGET_CHUNK_DURATION / (tile_size * item_cost))
+        balanced = math.ceil(rows * tiles_per_row / (workers * MIN_CHUNKS_PER_WORKER))
+        chunk_size = max(1, min(per_chunk, balanced))
+
+    return ExecutionPlan(mode, workers, chunk_size, tile_size, backend)
+
+
+def map_bounded(executor, fn, tasks, max_pending, cancel_event=None):
+    """Apply fn to every task on the given executor, but never keep more than max_pending tasks in flight. Contrary to
+    Executor.map, the tasks are generated lazily and results are returned as soon as they are available, so that only
+    the tasks that are currently being processed (and not the complete workload) are kept in memory.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+    fn : function
+        function that's applied to the parameters of every task
+    tasks : iterable
+        yields (key, params) tuples
+    max_pending : int
+        maximum amount of tasks that have been submitted but whose result has not been yielded yet.
+    cancel_event : threading.Event, optional
+        if this event is set, the tasks that have not been started yet are dropped and a
+        concurrent.futures.CancelledError is raised.
+
+    Returns
+    -------
+    generator
+        yields (key, fn(params)) tuples in the order in which the tasks are completed.
+    """
+    tasks = iter(tasks)
+    pending = dict()
+    timeout = None if cancel_event is None else CANCEL_POLL_INTERVAL
+
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise concurrent.futures.CancelledError()
+
+    def submit_next():
+        for key, params in tasks:
+            pending[executor.submit(fn, params)] = key
+            return True
+        return False
+
+    try:
+        check_cancelled()
+        while len(pending) < max_pending and submit_next():
+            pass
+
+        while pending:
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            check_cancelled()
+            for future in done:
+                key = pending.pop(future)
+                submit_next()
+                yield key, future.result()
+                check_cancelled()
+    finally:
+        # Tasks that have not been started yet are dropped as soon as their results are no longer needed (because of
+        # a cancellation, an error or a consumer that stopped early).
+        for future in pending:
+            future.cancel()
+
+
+def create_executor(plan, initializer=None, initargs=()):
+    """Create an executor that follows the given plan. The initializer is only invoked for process pools, since threads
+    and serial tasks share the state of the calling process.
+
+    Returns
+    -------
+    concurrent.futures.Executor
+    """
+    if plan.mode == PROCESSES:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=plan.workers, initializer=initializer, initargs=initargs)
+    if plan.mode == THREADS:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=plan.workers)
+    return SerialExecutor()
@@ -1,55 +1,77 @@
 import json
+import math
+import os
 
-from .constants import HEATMAP_TEMPLATE
+from .constants import GO_DOMAINS, HEATMAP_TEMPLATE
+
+# Name of the variable that holds the data of the heatmap in the data file.
+HEATMAP_DATA_VARIABLE = "MEGAGO_HEATMAP_DATA"
 
 
 def read_heatmap_template():
-    output = ""
     with open(HEATMAP_TEMPLATE) as f:
-        for line in f:
-            output += line
-    return output
+        return f.read()
 
 
-def write_heatmap_template(template):
-    with open("heatmap.html", "w") as f:
+def write_heatmap_template(template, path="heatmap.html"):
+    with open(path, "w") as f:
         f.write(template)
 
 
-def generate_heatmap(results_dict: dict, sample_names):
-    bp_results = []
-    cc_results = []
-    mf_results = []
-
-    for i, name in enumerate(sample_names):
-        bp_row = []
-        cc_row = []
-        mf_row = []
-        for j, name in enumerate(sample_names):
-            if i == j:
-                bp_row.append(1)
-                cc_row.append(1)
-                mf_row.append(1)
-            elif i < j:
-                bp_row.append(results_dict[(i, j)][0])
-                cc_row.append(results_dict[(i, j)][1])
-                mf_row.append(results_dict[(i, j)][2])
-            else:
-                bp_row.append(results_dict[(j, i)][0])
-                cc_row.append(results_dict[(j, i)][1])
-                mf_row.append(results_dict[(j, i)][2])
-        bp_results.append(bp_row)
-        cc_results.append(cc_row)
-        mf_results.append(mf_row)
-
-    heatmap_template = read_heatmap_template()
-
-    heatmap_template = heatmap_template.replace("!!ROW_LABELS!!", json.dumps(sample_names))
-    heatmap_template = heatmap_template.replace("!!COL_LABELS!!", json.dumps(sample_names))
-
-    heatmap_template = heatmap_template.replace("!!BP_DATA!!", json.dumps(bp_results))
-    heatmap_template = heatmap_template.replace("!!CC_DATA!!", json.dumps(cc_results))
-    heatmap_template = heatmap_template.replace("!!MF_DATA!!", json.dumps(mf_results))
-
-    write_heatmap_template(heatmap_template)
+def _compact_value(value):
+    """Round a similarity for the heatmap data file. NaN is not valid JSON, and is written as null."""
+    if value is None or math.isnan(value):
+        return None
+    return round(float(value), 4)
+
+
+def write_heatmap_data(matrices, sample_names, path):
+    """Write the data of a heatmap to a JavaScript file that is loaded by the heatmap page. The rows of the matrices are
+    written one at a time, such that the complete file never needs to be kept in memory.
+
+    Parameters
+    ----------
+    matrices : list
+        for every domain in GO_DOMAINS, a square matrix (nested lists or a numpy array) with the similarity of every
+        pair of samples
+    sample_names : list
+    path : str
+    """
+    with open(path, "w") as f:
+        f.write(f"const {HEATMAP_DATA_VARIABLE} = {{\"labels\":")
+        json.dump(sample_names, f, separators=(",", ":"))
+        for domain, matrix in zip(GO_DOMAINS, matrices):
+            f.write(f",\n\"{domain}\":[")
+            for i, row in enumerate(matrix):
+                if i > 0:
+                    f.write(",\n")
+                json.dump([_compact_value(value) for value in row], f, separators=(",", ":"))
+            f.write("]")
+        f.write("};\n")
+
+
+def generate_heatmap_from_matrices(matrices, sample_names, path="heatmap.html"):
+    """Generate an interactive heatmap page. The data is written to a separate file next to the page (e.g.
+    heatmap_data.js for heatmap.html), which keeps the page small and avoids building the data as one huge string.
+    """
+    data_path = os.path.splitext(path)[0] + "_data.js"
+    write_heatmap_data(matrices, sample_names, data_path)
+    template = read_heatmap_template().replace("!!DATA_FILE!!", os.path.basename(data_path))
+    write_heatmap_template(template, path)
+
+
+def generate_heatmap(results_dict: dict, sample_names, path="heatmap.html"):
+    matrices = []
+    for domain in range(len(GO_DOMAINS)):
+        matrix = []
+        for i in range(len(sample_names)):
+            row = []
+            for j in range(len(sample_names)):
+                if i == j:
+                    row.append(1)
+                else:
+                    row.append(results_dict[(min(i, j), max(i, j))][domain])
+            matrix.append(row)
+        matrices.append(matrix)
 
+    generate_heatmap_from_matrices(matrices, sample_names, path)
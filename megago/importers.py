@@ -0,0 +1,384 @@
+"""Read the output of functional annotation tools (Unipept, MetaProteomeAnalyzer, MEGAN, eggNOG-mapper and InterProScan)
+and turn it into weighted sets of GO-terms that can be compared by MegaGO.
+
+Mapping files (interpro2go, eggNOG OG to GO tables and UniProt GO tables) are parsed only once into a dictionary. This
+dictionary is kept in memory and is also cached on disk, such that subsequent invocations can skip parsing altogether.
+The cache directory may be shared with other users, so cached dictionaries are stored as JSON (loading them cannot
+execute code) together with the key of the file they were parsed from.
+"""
+
+import collections
+import csv
+import hashlib
+import itertools
+import json
+import os
+import re
+
+from .constants import CACHE_DIR
+
+GO_TERM_REGEX = re.compile(r"GO:\d{7}")
+
+# Directory in which parsed mapping files are cached.
+MAPPING_CACHE_DIR = os.path.join(CACHE_DIR, "mappings")
+# Version of the cached mapping files. Increase this whenever the output of one of the parsers changes.
+MAPPING_CACHE_VERSION = 2
+
+# All input formats that are supported by read_samples. The value indicates whether a mapping file is required.
+INPUT_FORMATS = {
+    "terms": False,
+    "unipept": False,
+    "eggnog": False,
+    "mpa": True,
+    "megan": True,
+    "interproscan": True
+}
+
+_MAPPINGS = dict()
+
+
+def _cached_mapping(path, parser):
+    """Returns the result of parser(path). Results are cached both in memory and on disk, and are invalidated when the
+    file is modified."""
+    stat = os.stat(path)
+    key = (parser.__name__, os.path.abspath(path), stat.st_mtime_ns, stat.st_size, MAPPING_CACHE_VERSION)
+    if key in _MAPPINGS:
+        return _MAPPINGS[key]
+
+    cache_file = os.path.join(MAPPING_CACHE_DIR, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".json")
+    mapping = None
+    try:
+        with open(cache_file, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == list(key) and isinstance(cached.get("mapping"), dict):
+            mapping = cached["mapping"]
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if mapping is None:
+        mapping = parser(path)
+        try:
+            os.makedirs(MAPPING_CACHE_DIR, exist_ok=True)
+            temp_file = cache_file + f".{os.getpid()}.tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "mapping": mapping}, f)
+            os.replace(temp_file, cache_file)
+        except OSError:
+            # Caching is an optimisation, the mapping will simply be parsed again next time.
+            pass
+
+    _MAPPINGS[key] = mapping
+    return mapping
+
+
+def _parse_interpro2go(path):
+    mapping = collections.defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            # e.g. "InterPro:IPR000003 Retinoid X receptor/HNF4 > GO:DNA binding ; GO:0003677"
+            if not line.startswith("InterPro:"):
+                continue
+            accession = line[9:line.find(" ", 9)].strip()
+            match = GO_TERM_REGEX.search(line, line.rfind(";"))
+            if match:
+                mapping[accession].append(match.group(0))
+    return dict(mapping)
+
+
+def _parse_table(path):
+    """Parse a tab separated file with an identifier in the first column and a comma separated list of GO-terms in the
+    second column (e.g. the output of MEGAN_outputs/get_gos_from_ogs.py or a MEGAN/interpro2go_to_go.py table)."""
+    mapping = dict()
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 2:
+                continue
+            terms = GO_TERM_REGEX.findall(fields[1])
+            if terms:
+                # The identifier may be followed by a description (e.g. "IPR000397 Heat shock protein Hsp33")
+                mapping[fields[0].split(" ")[0]] = terms
+    return mapping
+
+
+def _parse_uniprot(path):
+    """Parse a tab separated UniProt export that contains the "Entry" and "Gene ontology IDs" columns."""
+    mapping = dict()
+    with open(path, newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader)
+        entry_column = header.index("Entry")
+        go_column = header.index("Gene ontology IDs")
+        for row in reader:
+            if len(row) > go_column:
+                mapping[row[entry_column]] = GO_TERM_REGEX.findall(row[go_column])
+    return mapping
+
+
+def load_interpro2go(path):
+    """Load an interpro2go mapping file (http://current.geneontology.org/ontology/external2go/interpro2go).
+
+    Returns
+    -------
+    dict
+        maps InterPro accessions (e.g. IPR000003) onto a list of GO-terms
+    """
+    return _cached_mapping(path, _parse_interpro2go)
+
+
+def load_og2go(path):
+    """Load a tab separated table that maps eggNOG orthologous groups onto a comma separated list of GO-terms.
+
+    Returns
+    -------
+    dict
+        maps orthologous groups (e.g. COG0028) onto a list of GO-terms
+    """
+    return _cached_mapping(path, _parse_table)
+
+
+def load_protein2go(path):
+    """Load a UniProt export (tab separated, with an "Entry" and "Gene ontology IDs" column) or a table with a protein
+    accession and a comma separated list of GO-terms per line.
+
+    Returns
+    -------
+    dict
+        maps protein accessions onto a list of GO-terms
+    """
+    with open(path) as f:
+        header = f.readline()
+    if "Gene ontology IDs" in header.rstrip("\n").split("\t"):
+        return _cached_mapping(path, _parse_uniprot)
+    return _cached_mapping(path, _parse_table)
+
+
+def _parse_count(value, path, line, parse=int):
+    """Parse a count that was read from the given line of path. A ValueError that names the file and line is raised if
+    it's not a valid number."""
+    try:
+        return parse(value)
+    except ValueError:
+        raise ValueError(f"{path}, line {line}: {value!r} is not a valid count") from None
+
+
+def read_unipept(path):
+    """Read a GO-term export of Unipept (e.g. 737NS_GO_terms-biological_process-export.csv). The weight of a term is the
+    amount of peptides that have been annotated with it. Rows without a count are skipped.
+
+    Returns
+    -------
+    collections.Counter
+    """
+    terms = collections.Counter()
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        count_column = header.index("#peptides")
+        term_column = header.index("GO term")
+        for row in reader:
+            if len(row) > max(term_column, count_column) and row[count_column].strip():
+                terms[row[term_column]] += _parse_count(row[count_column], path, reader.line_num)
+    return terms
+
+
+def read_eggnog(path):
+    """Read the annotations of eggNOG-mapper (e.g. hmm_annotations.tabular), in which the sixth column contains a comma
+    separated list with the GO-terms of a query. Every query contributes a weight of 1 to each of its terms.
+
+    Returns
+    -------
+    collections.Counter
+    """
+    terms = collections.Counter()
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.split("\t", 6)
+            if len(fields) > 5 and fields[5]:
+                terms.update(GO_TERM_REGEX.findall(fields[5]))
+    return terms
+
+
+def read_mpa(path, protein2go):
+    """Read the identified proteins of a MetaProteomeAnalyzer export (e.g. *_proteins.csv), or a plain list with one
+    protein accession per line (e.g. all_proteins.tab). Every protein contributes its spectral count (or 1 if the export
+    does not contain spectral counts) to each of its GO-terms.
+
+    Parameters
+    ----------
+    path : str
+        the MPA export
+    protein2go : dict
+        maps protein accessions onto GO-terms (see load_protein2go)
+
+    Returns
+    -------
+    collections.Counter
+    """
+    terms = collections.Counter()
+    with open(path, newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        first = next(reader, None)
+        if first is None:
+            return terms
+        if "Protein Accession" in first:
+            accession_column = first.index("Protein Accession")
+            count_column = first.index("Spectral Count") if "Spectral Count" in first else None
+        else:
+            accession_column = 0
+            count_column = None
+            reader = itertools.chain([first], reader)
+
+        for row in reader:
+            if len(row) <= accession_column:
+                continue
+            weight = 1
+            if count_column is not None and len(row) > count_column and row[count_column].strip():
+                weight = _parse_count(row[count_column], path, reader.line_num)
+            for term in protein2go.get(row[accession_column].strip(), ()):
+                terms[term] += weight
+    return terms
+
+
+def _is_log_column(name):
+    """Whether a column of a MEGAN table holds log2 values. R prefixes column names that are not valid identifiers with
+    "X." (once)."""
+    return (name[2:] if name.startswith("X.") else name).startswith("Log2")
+
+
+def read_megan(path, og2go, samples=None):
+    """Read a table of MEGAN with the counts of eggNOG orthologous groups per dataset (e.g. megan_OGS.tab). Every
+    orthologous group contributes its count in a dataset to each of its GO-terms.
+
+    Parameters
+    ----------
+    path : str
+        the MEGAN table. It should contain an "og" column with the orthologous groups and one column with counts per
+        dataset. Columns whose name starts with "Log2" are ignored.
+    og2go : dict
+        maps orthologous groups onto GO-terms (see load_og2go)
+    samples : list, optional
+        the names of the dataset columns that should be read (default: all dataset columns)
+
+    Returns
+    -------
+    collections.OrderedDict
+        maps every dataset onto a collections.Counter with its GO-terms
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader)
+        og_column = header.index("og")
+        if samples is None:
+            samples = [name for i, name in enumerate(header)
+                       if i not in (0, og_column) and not _is_log_column(name)]
+        columns = [header.index(name) for name in samples]
+        output = collections.OrderedDict((name, collections.Counter()) for name in samples)
+
+        for row in reader:
+            terms = og2go.get(row[og_column])
+            if not terms:
+                continue
+            for name, column in zip(samples, columns):
+                count = _parse_count(row[column], path, reader.line_num, float)
+                if count > 0:
+                    counter = output[name]
+                    for term in terms:
+                        counter[term] += count
+    return output
+
+
+def read_interproscan(path, interpro2go):
+    """Read the tab separated output of InterProScan. The InterPro accession of every match (12th column) is mapped
+    onto GO-terms with interpro2go. GO-terms that are reported by InterProScan itself (14th column) are used as well.
+    Every protein contributes a weight of 1 to each of its GO-terms.
+
+    Returns
+    -------
+    collections.Counter
+    """
+    per_protein = collections.defaultdict(set)
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 12:
+                continue
+            terms = per_protein[fields[0]]
+            terms.update(interpro2go.get(fields[11], ()))
+            if len(fields) > 13:
+                terms.update(GO_TERM_REGEX.findall(fields[13]))
+
+    output = collections.Counter()
+    for terms in per_protein.values():
+        output.update(terms)
+    return output
+
+
+def to_term_list(terms, weighted=False):
+    """Turn a weighted set of GO-terms into a list that can be compared by MegaGO.
+
+    Parameters
+    ----------
+    terms : dict
+        maps GO-terms onto their weight
+    weighted : bool
+        if True, every term occurs round(weight) times in the output (at least once), such that the best match average
+        weighs each term by its abundance. Otherwise, every term occurs once.
+
+    Returns
+    -------
+    list
+    """
+    if not weighted:
+        return sorted(terms)
+    return [term for term in sorted(terms) for _ in range(max(1, int(round(terms[term]))))]
+
+
+def read_samples(path, input_format, mapping=None, weighted=False):
+    """Read all samples from the output of an annotation tool.
+
+    Parameters
+    ----------
+    path : str
+        the file that should be read. For formats that contain one sample per file, multiple files can be given as a
+        comma separated list (e.g. the three domain specific exports of Unipept). Their terms are combined into one
+        sample.
+    input_format : str
+        one of INPUT_FORMATS
+    mapping : str, optional
+        the mapping file that's required by the mpa (UniProt GO table), megan (eggNOG OG to GO table) and interproscan
+        (interpro2go) formats.
+    weighted : bool
+        see to_term_list
+
+    Returns
+    -------
+    list
+        (name, list of GO-terms) tuples. Only the megan format can contain more than one sample per file.
+    """
+    if input_format not in INPUT_FORMATS:
+        raise ValueError(f"input_format must be in {list(INPUT_FORMATS)} but is {input_format}")
+    if INPUT_FORMATS[input_format] and mapping is None:
+        raise ValueError(f"The {input_format} format requires a mapping file.")
+
+    if input_format == "terms":
+        from .megago import read_input
+        with open(path) as f:
+            return [(path, read_input(f))]
+    if input_format == "megan":
+        samples = read_megan(path, load_og2go(mapping))
+        return [(f"{path}:{name}", to_term_list(terms, weighted)) for name, terms in samples.items()]
+
+    terms = collections.Counter()
+    for part in path.split(","):
+        if input_format == "unipept":
+            terms.update(read_unipept(part))
+        elif input_format == "eggnog":
+            terms.update(read_eggnog(part))
+        elif input_format == "mpa":
+            terms.update(read_mpa(part, load_protein2go(mapping)))
+        else:
+            terms.update(read_interproscan(part, load_interpro2go(mapping)))
+    return [(path, to_term_list(terms, weighted))]
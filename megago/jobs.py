@@ -0,0 +1,270 @@
+"""Comparisons that run in the background, for services such as the MegaGO API.
+
+At most max_running jobs are computed at the same time, the others wait in a queue. Jobs can be cancelled explicitly,
+and jobs whose results have not been requested for idle_timeout seconds are cancelled automatically (e.g. because the
+user closed the browser tab). Cancelling a job that's waiting removes it from the queue. Cancelling a job that's
+running sets its cancel event, which stops the comparison engine as soon as possible (see
+megago.metrics.compute_bma_metric), after which the next job in the queue is started.
+
+Jobs that are done (finished, failed or cancelled) are kept until their result has been fetched, and are then removed
+once fetched_ttl seconds have passed (such that a client can retry a request that failed). Results that are never
+fetched are removed finished_ttl seconds after their job was done, and only the max_finished most recent results are
+kept at all.
+"""
+
+import concurrent.futures
+import logging
+import math
+import threading
+import time
+import uuid
+
+from .monitoring import Histogram
+from .progress import EtaEstimator
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+STATES = [QUEUED, RUNNING, FINISHED, FAILED, CANCELLED]
+
+DEFAULT_MAX_RUNNING = 2
+# Seconds that the result of a job is kept after it was done, or after it was fetched.
+DEFAULT_FINISHED_TTL = 3600
+DEFAULT_FETCHED_TTL = 60
+# Maximum amount of jobs that are done and are kept.
+DEFAULT_MAX_FINISHED = 1000
+
+
+class Job(object):
+    """A computation that's executed by a JobQueue.
+
+    Attributes
+    ----------
+    id : str
+    state : str
+        one of QUEUED, RUNNING, FINISHED, FAILED or CANCELLED
+    progress : float
+        progress of the computation, between 0 and 1. It's only 1 when the result is available.
+    eta : float
+        estimated amount of seconds until the computation has finished, or None if it's unknown
+    result
+        the return value of the computation, once it has finished
+    cancel_event : threading.Event
+        is set when the job is cancelled. The computation should pass it on to the comparison engine.
+    metadata : dict
+        additional information that belongs to this job
+    submitted_at, started_at, finished_at : float
+        time.monotonic() when the job was submitted, started and done (None until it happens)
+    expires_at : float
+        time.monotonic() after which the job is removed from its queue (None until it's done)
+    """
+
+    def __init__(self, function, metadata=None):
+        self.id = str(uuid.uuid4())
+        self.state = QUEUED
+        self.progress = 0
+        self.eta = None
+        self.result = None
+        self.cancel_event = threading.Event()
+        self.metadata = metadata if metadata is not None else dict()
+        self.last_seen = time.monotonic()
+        self.submitted_at = self.last_seen
+        self.started_at = None
+        self.finished_at = None
+        self.expires_at = None
+        self._function = function
+        self._future = None
+        self._eta_estimator = EtaEstimator()
+
+    def __repr__(self):
+        return f"Job(id={self.id!r}, state={self.state!r}, progress={self.progress})"
+
+    @property
+    def done(self):
+        return self.state in (FINISHED, FAILED, CANCELLED)
+
+    def update_progress(self, progress):
+        # A progress of 1 means that the result is available, which is only the case once the computation has returned.
+        self.progress = min(progress, 0.99)
+        self.eta = self._eta_estimator.update(progress)
+
+    def touch(self):
+        """Record that somebody is still interested in this job."""
+        self.last_seen = time.monotonic()
+
+
+class JobQueue(object):
+    """Executes jobs in the background.
+
+    Parameters
+    ----------
+    max_running : int
+        maximum amount of jobs that are computed at the same time
+    idle_timeout : float, optional
+        jobs that have not been touched for this amount of seconds are cancelled. Jobs are never cancelled automatically
+        if not given.
+    finished_ttl : float
+        jobs that are done are removed after this amount of seconds
+    fetched_ttl : float
+        jobs whose result has been fetched are removed after this amount of seconds
+    max_finished : int
+        maximum amount of jobs that are done and are kept, the oldest of these are removed first
+
+    Attributes
+    ----------
+    wait_time, run_time : megago.monitoring.Histogram
+        time that jobs waited in the queue before they started, and time that they took once they had started
+    """
+
+    def __init__(self, max_running=DEFAULT_MAX_RUNNING, idle_timeout=None, finished_ttl=DEFAULT_FINISHED_TTL,
+                 fetched_ttl=DEFAULT_FETCHED_TTL, max_finished=DEFAULT_MAX_FINISHED):
+        self.max_running = max_running
+        self.idle_timeout = idle_timeout
+        self.finished_ttl = finished_ttl
+        self.fetched_ttl = fetched_ttl
+        self.max_finished = max_finished
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_running)
+        self._lock = threading.Lock()
+        self._jobs = dict()
+        self._closed = threading.Event()
+        threading.Thread(target=self._maintain, daemon=True).start()
+
+    def submit(self, function, metadata=None):
+        """Queue a computation. function is called with the Job as its only argument, and its return value becomes the
+        result of the job.
+
+        Returns
+        -------
+        Job
+        """
+        job = Job(function, metadata)
+        with self._lock:
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        with self._lock:
+            if job.state != QUEUED:
+                return
+            job.state = RUNNING
+            job.started_at = time.monotonic()
+        self.wait_time.observe(job.started_at - job.submitted_at)
+        try:
+            result = job._function(job)
+        except concurrent.futures.CancelledError:
+            job.state = CANCELLED
+        except Exception:
+            logging.exception("Job %s failed", job.id)
+            job.state = FAILED
+        else:
+            job.result = result
+            job.progress = 1
+            job.eta = 0.0
+            job.state = CANCELLED if job.cancel_event.is_set() else FINISHED
+        finally:
+            job.finished_at = time.monotonic()
+            self.run_time.observe(job.finished_at - job.started_at)
+            self._job_done(job)
+
+    def _job_done(self, job):
+        """Schedule the removal of a job that's done, and remove the oldest jobs if too many jobs are done."""
+        with self._lock:
+            job.expires_at = job.finished_at + self.finished_ttl
+            done = sorted((other for other in self._jobs.values() if other.expires_at is not None),
+                          key=lambda other: other.finished_at)
+            for other in done[:max(0, len(done) - self.max_finished)]:
+                del self._jobs[other.id]
+
+    def get(self, job_id, touch=True):
+        """Returns the job with the given id (or None if it does not exist), and records that it's still needed."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and touch:
+            job.touch()
+        return job
+
+    def fetched(self, job_id):
+        """Record that the result of a job that's done has been delivered, after which it's removed within fetched_ttl
+        seconds."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.expires_at is not None:
+                job.expires_at = min(job.expires_at, time.monotonic() + self.fetched_ttl)
+
+    def expire(self, now=None):
+        """Remove all jobs that are done and whose results have been kept long enough.
+
+        Returns
+        -------
+        list
+            the ids of the removed jobs
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [job.id for job in self._jobs.values() if job.expires_at is not None and now > job.expires_at]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return expired
+
+    def counts(self):
+        """Returns the amount of jobs in every state (see STATES)."""
+        counts = dict.fromkeys(STATES, 0)
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.state] += 1
+        return counts
+
+    @property
+    def busy(self):
+        """Amount of jobs that are being computed."""
+        return self.counts()[RUNNING]
+
+    def cancel(self, job_id):
+        """Cancel a job. Returns False if the job does not exist or has already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            job.cancel_event.set()
+            queued = job.state == QUEUED
+            if queued:
+                job._future.cancel()
+                job.state = CANCELLED
+                job.finished_at = time.monotonic()
+        if queued:
+            self._job_done(job)
+        return True
+
+    def cancel_idle(self, now=None):
+        """Cancel all jobs that have not been touched for idle_timeout seconds.
+
+        Returns
+        -------
+        list
+            the ids of the cancelled jobs
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [job.id for job in self._jobs.values()
+                    if not job.done and now - job.last_seen > self.idle_timeout]
+        return [job_id for job_id in idle if self.cancel(job_id)]
+
+    def _maintain(self):
+        interval = min(self.fetched_ttl, self.finished_ttl, self.idle_timeout or math.inf)
+        while not self._closed.wait(max(1.0, interval / 4)):
+            if self.idle_timeout is not None:
+                for job_id in self.cancel_idle():
+                    logging.info("Cancelled job %s, since nobody has asked for its results", job_id)
+            self.expire()
+
+    def close(self):
+        """Cancel all jobs and stop the background threads."""
+        self._closed.set()
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        self._executor.shutdown(wait=False)
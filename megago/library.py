@@ -0,0 +1,312 @@
+"""Index a library of reference samples and find the references that are most similar to a new sample.
+
+Every reference sample is summarised by a signature that is stored on disk: the GO-terms of the sample (per domain) and
+an information content weighted vector over all ancestors of these terms. A query first ranks all references with the
+cosine similarity of these vectors, which is cheap to compute: the vectors of all references are kept as one sparse
+matrix per domain, which is multiplied with the vector of the query at once. The exact best match average similarity is
+then only computed for the best candidates of this approximate ranking.
+
+Signatures depend on the ontology and on the corpus (the information content of the terms). A library records the
+fingerprint of both (see megago.metrics.CorpusTables), and refuses sessions of another GO release or corpus.
+"""
+
+import argparse
+import collections
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from .constants import GO_DOMAINS
+
+# Version of the file format of a reference library. Libraries with a different version cannot be opened.
+LIBRARY_VERSION = 2
+# By default, the exact similarity is computed for SHORTLIST_FACTOR * k candidates per domain.
+SHORTLIST_FACTOR = 5
+# The shortlist always contains at least this amount of candidates per domain (if the library is large enough).
+MIN_SHORTLIST = 50
+
+
+def compute_signature(go_terms, ancestor_index):
+    """Compute the signature of a sample.
+
+    Parameters
+    ----------
+    go_terms : list
+        all GO-terms present in the sample (duplicates are counted).
+    ancestor_index : AncestorIndex
+        an ancestor index with term counts (see megago.ontology)
+
+    Returns
+    -------
+    dict
+        {"terms": {domain: {term: count}}, "vectors": {domain: {ancestor: weight}}, "norms": {domain: norm}}. The
+        weight of an ancestor is its information content multiplied with the fraction of terms of the sample (in that
+        domain) that descend from it.
+    """
+    signature = {"terms": {}, "vectors": {}, "norms": {}}
+    for domain, terms in ancestor_index.split_per_domain(go_terms).items():
+        counts = collections.Counter(terms)
+        vector = collections.defaultdict(float)
+        for term, count in counts.items():
+            for ancestor in ancestor_index.ancestors(term):
+                vector[ancestor] += count
+        total = sum(counts.values())
+        vector = {
+            ancestor: ancestor_index.info_content(ancestor) * value / total
+            for ancestor, value in vector.items()
+        }
+        vector = {ancestor: weight for ancestor, weight in vector.items() if weight > 0}
+        signature["terms"][domain] = dict(counts)
+        signature["vectors"][domain] = vector
+        signature["norms"][domain] = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return signature
+
+
+def cosine_similarity(vector1, norm1, vector2, norm2):
+    """Cosine similarity of two sparse vectors (dicts) with precomputed norms."""
+    if norm1 == 0 or norm2 == 0:
+        return 0.0
+    if len(vector1) > len(vector2):
+        vector1, vector2 = vector2, vector1
+    dot = sum(weight * vector2.get(key, 0.0) for key, weight in vector1.items())
+    return dot / (norm1 * norm2)
+
+
+def _expand(counts):
+    """Turn a {term: count} dictionary back into a list in which every term occurs count times."""
+    return [term for term, count in counts.items() for _ in range(count)]
+
+
+class SignatureMatrix(object):
+    """The vectors of all references of a library in one domain, as a sparse matrix in coordinate format.
+
+    Attributes
+    ----------
+    names : list
+        name of the reference of every row
+    columns : dict
+        column of every ancestor that occurs in at least one vector
+    entry_rows, entry_columns, entry_weights : numpy.ndarray
+        row, column and weight of every non-zero entry
+    norms : numpy.ndarray
+        norm of the vector of every row
+    """
+
+    def __init__(self, samples, domain):
+        self.names = list(samples)
+        self.columns = dict()
+        rows, columns, weights = [], [], []
+        for row, name in enumerate(self.names):
+            vector = samples[name]["vectors"][domain]
+            rows.extend([row] * len(vector))
+            columns.extend(self.columns.setdefault(ancestor, len(self.columns)) for ancestor in vector)
+            weights.extend(vector.values())
+        self.entry_rows = np.array(rows, dtype=np.intp)
+        self.entry_columns = np.array(columns, dtype=np.intp)
+        self.entry_weights = np.array(weights, dtype=np.float64)
+        self.norms = np.array([samples[name]["norms"][domain] for name in self.names], dtype=np.float64)
+
+    def cosine_similarities(self, vector, norm):
+        """Cosine similarity of every row with a sparse vector (dict) with the given norm."""
+        query = np.zeros(len(self.columns))
+        for ancestor, weight in vector.items():
+            column = self.columns.get(ancestor)
+            if column is not None:
+                query[column] = weight
+        dots = np.bincount(self.entry_rows, weights=self.entry_weights * query[self.entry_columns],
+                           minlength=len(self.names))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where((self.norms > 0) & (norm > 0), dots / (self.norms * norm), 0.0)
+
+
+class ReferenceLibrary(object):
+    """A collection of reference samples whose signatures are stored in a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        file in which the library is stored. The library is empty if this file does not exist yet.
+
+    Attributes
+    ----------
+    fingerprint : str
+        identifies the ontology and corpus with which the signatures have been computed (see Session.fingerprint), or
+        None if the library is empty
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.samples = collections.OrderedDict()
+        self.fingerprint = None
+        # SignatureMatrix of every domain, built when it's needed after the library has changed.
+        self._matrices = dict()
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != LIBRARY_VERSION:
+                raise ValueError(f"{path} is not a reference library of version {LIBRARY_VERSION}.")
+            self.samples.update(data["samples"])
+            self.fingerprint = data["fingerprint"]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __contains__(self, name):
+        return name in self.samples
+
+    def _check_session(self, session):
+        """Raise a ValueError if the session uses another ontology or corpus than the signatures of this library."""
+        fingerprint = session.fingerprint()
+        if self.fingerprint is not None and self.samples and fingerprint != self.fingerprint:
+            raise ValueError(f"{self.path} has been built with another GO release or corpus than the given session.")
+        return fingerprint
+
+    def add(self, name, go_terms, session):
+        """Add a sample (or replace the sample with the same name) to the library. The library is not written to disk
+        until save() is called.
+
+        Parameters
+        ----------
+        name : str
+            unique name of the reference sample
+        go_terms : list
+            all GO-terms present in the sample
+        session : Session
+            the session whose ontology and corpus tables are used to compute the signature. It should use the same
+            ontology and corpus as the samples that are already in the library.
+        """
+        self.fingerprint = self._check_session(session)
+        self.samples[name] = compute_signature(go_terms, session.ancestor_index)
+        self._matrices.clear()
+
+    def remove(self, name):
+        del self.samples[name]
+        self._matrices.clear()
+
+    def save(self):
+        """Write the library to disk. The file is replaced atomically, such that a crash never leaves a corrupt library
+        behind."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"version": LIBRARY_VERSION, "fingerprint": self.fingerprint, "samples": self.samples}, f)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def rank(self, signature, domain, limit=None):
+        """Rank all references by the cosine similarity of their signature with the given signature in one domain.
+
+        Parameters
+        ----------
+        signature : dict
+            see compute_signature
+        domain : str
+        limit : int, optional
+            only the limit most similar references are returned if given
+
+        Returns
+        -------
+        list
+            (name, approximate similarity) tuples, most similar references first. References with the same similarity
+            are ranked in the order in which they were added.
+        """
+        matrix = self._matrices.get(domain)
+        if matrix is None:
+            matrix = self._matrices[domain] = SignatureMatrix(self.samples, domain)
+        scores = matrix.cosine_similarities(signature["vectors"][domain], signature["norms"][domain])
+        order = np.argsort(-scores, kind="stable")
+        if limit is not None:
+            order = order[:limit]
+        return [(matrix.names[row], float(scores[row])) for row in order]
+
+    def query(self, go_terms, session, k=20, shortlist=None, domains=None):
+        """Find the k references that are most similar to a sample, in each of the GO-domains.
+
+        Parameters
+        ----------
+        go_terms : list
+            all GO-terms present in the query sample
+        session : Session
+            the session that computes the exact similarities. It should use the same ontology and corpus as the
+            library.
+        k : int
+            amount of references that should be reported per domain
+        shortlist : int, optional
+            amount of candidates (per domain) for which the exact similarity is computed. Defaults to
+            max(SHORTLIST_FACTOR * k, MIN_SHORTLIST). A larger shortlist decreases the chance that a similar reference
+            is missed by the approximate ranking.
+        domains : list, optional
+            the GO-domains that should be searched (defaults to all domains)
+
+        Returns
+        -------
+        dict
+            maps every domain onto a list with (name, similarity) tuples, most similar references first. References for
+            which the similarity is undefined (e.g. no terms in this domain) are reported last.
+        """
+        self._check_session(session)
+        if shortlist is None:
+            shortlist = max(SHORTLIST_FACTOR * k, MIN_SHORTLIST)
+        shortlist = max(shortlist, k)
+
+        signature = compute_signature(go_terms, session.ancestor_index)
+        results = dict()
+        for domain in domains or GO_DOMAINS:
+            query_terms = _expand(signature["terms"][domain])
+            candidates = [name for name, _ in self.rank(signature, domain, shortlist)]
+            scores = [
+                (name, session.compare_domain(query_terms, _expand(self.samples[name]["terms"][domain])))
+                for name in candidates
+            ]
+            scores.sort(key=lambda item: -item[1] if not math.isnan(item[1]) else math.inf)
+            results[domain] = scores[:k]
+        return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Add samples to a reference library (created if required)")
+    add_parser.add_argument("library", help="JSON file that contains the reference library")
+    add_parser.add_argument("samples", nargs="+", help="Files with GO-terms. The file name is used as sample name.")
+
+    query_parser = subparsers.add_parser("query", help="Find the references that are most similar to a sample")
+    query_parser.add_argument("library", help="JSON file that contains the reference library")
+    query_parser.add_argument("sample", help="File with the GO-terms of the query sample")
+    query_parser.add_argument("-k", type=int, default=20, help="Amount of references to report per domain")
+    query_parser.add_argument("--shortlist", type=int, default=None,
+                              help="Amount of candidates for which the exact similarity is computed per domain")
+
+    return parser.parse_args()
+
+
+def main():
+    from .megago import read_input
+    from .session import Session
+
+    options = parse_args()
+    library = ReferenceLibrary(options.library)
+    with Session() as session:
+        if options.command == "add":
+            for sample in options.samples:
+                with open(sample) as f:
+                    library.add(sample, read_input(f), session)
+            library.save()
+        else:
+            with open(options.sample) as f:
+                results = library.query(read_input(f), session, options.k, options.shortlist)
+            print("DOMAIN,RANK,REFERENCE,SIMILARITY")
+            for domain in GO_DOMAINS:
+                for rank, (name, similarity) in enumerate(results[domain], 1):
+                    print(f"{domain},{rank},{name},{similarity}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Compare an arbitrary list of pairs of samples in one invocation (megago --manifest MANIFEST_FILE).
+
+A manifest is a tab separated file with two kinds of records:
+
+    sample<TAB>ID<TAB>PATH
+        gives the sample that's stored in PATH an identifier
+    pair<TAB>SAMPLE_1<TAB>SAMPLE_2
+        compares two samples, that are given by their identifier or by their path
+
+Empty lines and lines that start with # are ignored. Relative paths are resolved against the directory of the manifest.
+A sample from a file that contains more than one sample (e.g. a MEGAN export) is given as PATH:NAME.
+
+Every distinct sample is read only once, no matter how many pairs it's part of. All pairs are then compared by the same
+session, several pairs at the same time, and their results are reported either in the order of the manifest or as soon
+as they are available.
+"""
+
+import concurrent.futures
+import os
+
+from .execution import SerialExecutor, map_bounded
+from .importers import read_samples
+
+SAMPLE_RECORD = "sample"
+PAIR_RECORD = "pair"
+
+ORDERED = "ordered"
+UNORDERED = "unordered"
+RESULT_ORDERS = [ORDERED, UNORDERED]
+
+
+class Manifest(object):
+    """The distinct samples of a manifest and the pairs that should be compared.
+
+    Attributes
+    ----------
+    samples : list
+        the GO-terms of every distinct sample
+    names : list
+        the name of every sample: its identifier, or its path if it has none
+    pairs : list
+        (i, j) tuples with the indices of the samples that should be compared, in the order of the manifest
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.names = []
+        self.pairs = []
+
+
+def read_manifest(path, input_format="terms", mapping=None, weighted=False):
+    """Read a manifest and all samples that it refers to (see the description of this module).
+
+    Parameters
+    ----------
+    path : str
+    input_format : str
+        format of the sample files (one of megago.importers.INPUT_FORMATS)
+    mapping : str, optional
+        mapping file that's required by some input formats
+    weighted : bool
+        see megago.importers.to_term_list
+
+    Returns
+    -------
+    Manifest
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    identifiers = dict()
+    records = []
+
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 3 or fields[0] not in (SAMPLE_RECORD, PAIR_RECORD):
+                raise ValueError(f"{path}, line {line_number}: expected 'sample<TAB>ID<TAB>PATH' or "
+                                 f"'pair<TAB>SAMPLE_1<TAB>SAMPLE_2', but found {line!r}")
+            if fields[0] == SAMPLE_RECORD:
+                if fields[1] in identifiers:
+                    raise ValueError(f"{path}, line {line_number}: sample {fields[1]} has already been defined")
+                identifiers[fields[1]] = fields[2]
+            else:
+                records.append((line_number, fields[1], fields[2]))
+
+    manifest = Manifest()
+    # Index of every sample that has been read, by its (absolute) location, and the samples of every file that has been
+    # read, such that files that contain multiple samples are read only once as well.
+    indices = dict()
+    files = dict()
+
+    def read_file(file_path):
+        if file_path not in files:
+            files[file_path] = dict(read_samples(file_path, input_format, mapping, weighted))
+        return files[file_path]
+
+    def resolve(line_number, reference):
+        name = reference if reference in identifiers else None
+        location = os.path.join(directory, identifiers.get(reference, reference))
+        if location in indices:
+            return indices[location]
+
+        if os.path.isfile(location.split(",")[0]):
+            samples = read_file(location)
+            if len(samples) != 1:
+                raise ValueError(f"{path}, line {line_number}: {reference} contains {len(samples)} samples, refer to "
+                                 f"one of them as PATH:NAME")
+            terms = next(iter(samples.values()))
+        else:
+            file_path, _, sample_name = location.rpartition(":")
+            if not file_path or not os.path.isfile(file_path):
+                raise ValueError(f"{path}, line {line_number}: {reference} is neither a sample identifier nor a file")
+            samples = read_file(file_path)
+            if location not in samples:
+                raise ValueError(f"{path}, line {line_number}: {file_path} does not contain a sample {sample_name}")
+            terms = samples[location]
+
+        indices[location] = len(manifest.samples)
+        manifest.samples.append(terms)
+        manifest.names.append(name if name is not None else reference)
+        return indices[location]
+
+    for line_number, reference_1, reference_2 in records:
+        manifest.pairs.append((resolve(line_number, reference_1), resolve(line_number, reference_2)))
+    return manifest
+
+
+def compare_pairs(compare, pairs, concurrency=1, order=ORDERED):
+    """Compare pairs of samples, several at the same time.
+
+    Parameters
+    ----------
+    compare : function (i, j) => results
+        compares the samples with indices i and j. It's called from multiple threads if concurrency > 1.
+    pairs : iterable
+        (i, j) tuples
+    concurrency : int
+        maximum amount of pairs that are compared at the same time
+    order : str
+        ORDERED yields the results in the order of pairs, UNORDERED as soon as they are available
+
+    Returns
+    -------
+    generator
+        yields ((i, j), results) tuples
+    """
+    if order not in RESULT_ORDERS:
+        raise ValueError(f"order must be in {RESULT_ORDERS} but is {order}")
+
+    tasks = ((index, pair) for index, pair in enumerate(pairs))
+    executor = SerialExecutor() if concurrency <= 1 else concurrent.futures.ThreadPoolExecutor(concurrency)
+    with executor:
+        # Results that are completed before all results that precede them in the manifest (only if ORDERED).
+        completed = dict()
+        next_index = 0
+        for index, ((i, j), results) in map_bounded(executor, lambda pair: (pair, compare(*pair)), tasks,
+                                                    max(1, concurrency)):
+            if order == UNORDERED:
+                yield (i, j), results
+                continue
+            completed[index] = ((i, j), results)
+            while next_index in completed:
+                yield completed.pop(next_index)
+                next_index += 1
@@ -4,22 +4,26 @@ Read a file that contains GO terms and print their semantic similarity.
 """
 
 import argparse
+import importlib.metadata
 import numbers
-import seaborn as sns
 import sys
 import logging
-import pkg_resources
 import re
-import os
 
-from goatools.obo_parser import GODag
-from progress.bar import IncrementalBar
-
-from .constants import GO_DAG_FILE_PATH
-from .precompute_highest_ic import get_highest_ic
-from .metrics import compute_bma_metric
-from .precompute_frequency_counts import get_frequency_counts
-from .heatmap import generate_heatmap
+from .checkpoint import Checkpoint, checkpoint_key
+from .constants import GO_DOMAINS
+from .execution import BACKENDS, EXECUTION_MODES, available_cpus, calibrate, save_cost_model
+from .importers import INPUT_FORMATS, load_protein2go, read_samples
+from .manifest import ORDERED, RESULT_ORDERS, compare_pairs, read_manifest
+from .metrics import SIMILARITY_METHODS
+from .outputs import OUTPUT_FORMATS, open_writer, pair_file_name
+from .pair_cache import MIB, PairCache
+from .partitions import parse_domains
+from .proteins import read_protein_pairs
+from .reduction import REDUCTION_MODES, SLIM, read_slim
+from .significance import DEFAULT_CONFIDENCE, SignificanceResult
+from . import shards
+from .session import Session, get_default_session, get_default_go_dag, split_per_domain
 
 
 
@@ -28,18 +32,12 @@ EXIT_FASTA_FILE_ERROR = 3
 DEFAULT_MIN_LEN = 0
 DEFAULT_VERBOSE = False
 HEADER = 'DOMAIN,SIMILARITY'
+SIGNIFICANCE_HEADER = 'DOMAIN,SIMILARITY,P_VALUE,CI_LOW,CI_HIGH'
+PROTEIN_HEADER = 'PROTEIN_1,PROTEIN_2,DOMAIN,SIMILARITY'
 PROGRAM_NAME = "megago"
-GO_DOMAINS = [
-    "biological_process",
-    "cellular_component",
-    "molecular_function"
-]
-# How many items should be present in a sample before we compute metrics in parallel?
-PARALLEL_TRESHOLD = 200
-
 try:
-    PROGRAM_VERSION = pkg_resources.require(PROGRAM_NAME)[0].version
-except pkg_resources.DistributionNotFound:
+    PROGRAM_VERSION = importlib.metadata.version(PROGRAM_NAME)
+except importlib.metadata.PackageNotFoundError:
     PROGRAM_VERSION = "undefined_version"
 
 
@@ -101,9 +99,139 @@ def parse_args():
                              " extension (e.g. .png, .svg)",
                         default=None
                         )
+    parser.add_argument('--output',
+                        metavar='OUTPUT_FILE',
+                        action='append',
+                        default=[],
+                        help="Write the similarities of all pairs of samples to OUTPUT_FILE as soon as they are computed. "
+                             f"The format is determined by the extension ({', '.join(OUTPUT_FORMATS)}). Can be given "
+                             "multiple times")
+    parser.add_argument('--manifest',
+                        metavar='MANIFEST_FILE',
+                        default=None,
+                        help="Compare the pairs of samples that are listed in MANIFEST_FILE instead of comparing all "
+                             "SAMPLES with each other. Every line of this tab separated file is either "
+                             "'sample<TAB>ID<TAB>PATH' or 'pair<TAB>SAMPLE_1<TAB>SAMPLE_2', where the samples of a "
+                             "pair are given by their ID or PATH. Several pairs are compared at the same time.")
+    parser.add_argument('--order',
+                        choices=RESULT_ORDERS,
+                        default=ORDERED,
+                        help="Report the results of --manifest in the order of the manifest, or as soon as they are "
+                             "available (default: %(default)s)")
+    parser.add_argument('--proteins',
+                        metavar='PROTEIN_TABLE',
+                        default=None,
+                        help="Compare the proteins of PROTEIN_TABLE with each other instead of comparing SAMPLES. This "
+                             "is a UniProt export with the 'Entry' and 'Gene ontology IDs' columns, or a tab separated "
+                             "table with a protein and a comma separated list of GO-terms per line. All proteins are "
+                             "compared in one batch, which is much faster than comparing them one pair at a time.")
+    parser.add_argument('--pairs',
+                        metavar='PAIRS_FILE',
+                        default=None,
+                        help="Only compare the pairs of proteins that are listed in PAIRS_FILE (tab separated, two "
+                             "proteins per line) instead of all proteins of --proteins with each other")
     parser.add_argument('--heatmap',
                         action='store_true',
                         help="Generate an interactive heatmap for the compared samples")
+    parser.add_argument('--input-format',
+                        choices=list(INPUT_FORMATS),
+                        default="terms",
+                        help="Format of the sample files: a list of GO-terms (default) or the output of an annotation "
+                             "tool. Files that should be combined into one sample (e.g. the domain specific exports of "
+                             "Unipept) can be given as a comma separated list.")
+    parser.add_argument('--mapping',
+                        metavar='MAPPING_FILE',
+                        default=None,
+                        help="Mapping onto GO-terms that is required by some input formats: a UniProt GO table for "
+                             "mpa, an eggNOG OG to GO table for megan and interpro2go for interproscan.")
+    parser.add_argument('--weighted',
+                        action='store_true',
+                        help="Weigh the GO-terms that are read from annotation tool output by their abundance")
+    parser.add_argument('--similarity-method',
+                        choices=list(SIMILARITY_METHODS),
+                        default="lin",
+                        help="Semantic similarity metric that's used to compare GO-terms (default: %(default)s)")
+    parser.add_argument('--reduce',
+                        choices=REDUCTION_MODES,
+                        default=None,
+                        help="Reduce the samples before they are compared: 'leaves' removes terms of which a more "
+                             "specific term is present in the same sample, 'slim' maps all terms onto the GO slim "
+                             "given with --goslim. The amount of removed terms and an estimate of the effect on the "
+                             "similarity are reported on stderr.")
+    parser.add_argument('--goslim',
+                        metavar='GOSLIM_FILE',
+                        default=None,
+                        help="GO slim (OBO-file or list of GO-terms) that's used by --reduce slim")
+    parser.add_argument('--permutations',
+                        type=int,
+                        default=0,
+                        help="Compute a p-value for every similarity with the given amount of permutations of the terms "
+                             "of both samples. A low p-value means that both samples are more similar than chance.")
+    parser.add_argument('--bootstraps',
+                        type=int,
+                        default=0,
+                        help="Compute a confidence interval for every similarity with the given amount of bootstrapped "
+                             "samples")
+    parser.add_argument('--confidence',
+                        type=float,
+                        default=DEFAULT_CONFIDENCE,
+                        help="Confidence level of the bootstrap confidence intervals (default: %(default)s)")
+    parser.add_argument('--seed',
+                        type=int,
+                        default=None,
+                        help="Seed for the permutations and bootstraps, to make their results reproducible")
+    parser.add_argument('--checkpoint',
+                        metavar='CHECKPOINT_FILE',
+                        default=None,
+                        help="Store the result of every comparison in CHECKPOINT_FILE as soon as it's available")
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help="Skip the comparisons whose results are already present in the checkpoint file, instead "
+                             "of starting over")
+    parser.add_argument('--execution',
+                        choices=EXECUTION_MODES,
+                        default=None,
+                        help="How the similarities should be computed. Chosen automatically based on the size of the "
+                             "samples if not given (can also be set with the MEGAGO_EXECUTION environment variable)")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help="Amount of threads or processes that are used to compute similarities (can also be set "
+                             "with the MEGAGO_WORKERS environment variable)")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=None,
+                        help="Amount of GO-terms that are processed per task (can also be set with the "
+                             "MEGAGO_CHUNK_SIZE environment variable)")
+    parser.add_argument('--tile-size',
+                        type=int,
+                        default=None,
+                        help="Maximum amount of GO-terms from the second sample that are compared per task. Lower this "
+                             "value to reduce the memory usage for very large samples (can also be set with the "
+                             "MEGAGO_TILE_SIZE environment variable)")
+    parser.add_argument('--backend',
+                        choices=BACKENDS,
+                        default=None,
+                        help="Kernel that computes the similarities: Python loops (default) or numpy array operations "
+                             "that run on threads instead of processes (can also be set with the MEGAGO_BACKEND "
+                             "environment variable)")
+    parser.add_argument('--pair-cache-size',
+                        type=int,
+                        default=None,
+                        metavar='MIB',
+                        help="Memory size (in MiB) of a cache with the similarities of pairs of GO-terms that is "
+                             "shared by all comparisons, which speeds up comparing many samples with overlapping "
+                             "terms with the Python backend. Disabled if not given (can also be set with the MEGAGO_PAIR_CACHE_SIZE "
+                             "environment variable)")
+    parser.add_argument('--domains',
+                        type=parse_domains,
+                        default=None,
+                        help="Comma separated GO-domains that should be compared (biological_process, "
+                             "cellular_component and molecular_function, or bp, cc and mf). Only the terms of these "
+                             "domains are loaded, and no work is done for the others. All domains if not given")
+    parser.add_argument('--calibrate',
+                        action='store_true',
+                        help="Rerun the micro-benchmark that is used to decide how similarities are computed")
     parser.add_argument('samples',
                         metavar='SAMPLES',
                         nargs=argparse.REMAINDER,
@@ -144,39 +272,12 @@ class RedirectStdStreams(object):
         sys.stderr = self.old_stderr
 
 
-def split_per_domain(go_terms, go_dag):
-    """ Split a list of go_terms into three different lists that correspond to the GO-domains.
-
-    Parameters
-    ----------
-    go_terms : a list of strings
-        a list of GO terms that need to be divided over the different GO-domains.
-    go_dag : a graph that represents the Gene Ontology
-
-    Returns
-    -------
-    biological_process, cellular_component, molecular_function
-        Three different lists with respectively the GO-terms that belong to the biological process, cellular component
-        and molecular function domains.
-    """
-    output = {domain: [] for domain in GO_DOMAINS}
-
-    for go_term in go_terms:
-        if go_term in go_dag:
-            ns = go_dag[go_term].namespace
-            output[ns].append(go_term)
-        else:
-            logging.warning(f"{go_term} was not found in the Gene Ontology parsed by this script.")
-
-    return [output[domain] for domain in GO_DOMAINS]
-
-
-def get_default_go_dag():
-    return GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
-
-
-def run_comparison(go_list_1, go_list_2, go_dag=None, progress=None):
-    """ Compute the pairwise similarity values for all rows from the given file.
+def run_comparison(go_list_1, go_list_2, go_dag=None, progress=None, execution=None, workers=None, chunk_size=None,
+                   tile_size=None, reduction=None, slim_terms=None, permutations=0, bootstraps=0,
+                   confidence=DEFAULT_CONFIDENCE, seed=None, backend=None, domains=None):
+    """ Compute the pairwise similarity values for all rows from the given file. This is a thin wrapper around the
+    compare method of the default session (see megago.session.Session), which keeps the resources and worker pools in
+    memory between calls.
 
     Parameters
     ----------
@@ -188,49 +289,48 @@ def run_comparison(go_list_1, go_list_2, go_dag=None, progress=None):
         GODag object from the goatools package
     progress : function (number) => void
         is called with the current progress value (a floating point value between 0 and 1)
+    execution : str, optional
+        one of 'serial', 'threads' or 'processes'. Chosen automatically if not given.
+    workers : int, optional
+        amount of threads or processes that should be used. Chosen automatically if not given.
+    chunk_size : int, optional
+        amount of GO-terms that are processed per task. Chosen automatically if not given.
+    tile_size : int, optional
+        maximum amount of GO-terms from the second sample that are compared per task. Smaller tiles reduce the memory
+        usage for samples with a very large amount of terms.
+    reduction : str, optional
+        'leaves' or 'slim'. Reduces both samples before they are compared (see megago.reduction).
+    slim_terms : list, optional
+        the GO-terms of the GO slim that's used by the 'slim' reduction
+    permutations : int, optional
+        amount of permutations that are used to compute a p-value for each similarity (see megago.significance)
+    bootstraps : int, optional
+        amount of bootstrapped samples that are used to compute a confidence interval for each similarity
+    confidence : float, optional
+        confidence level of the bootstrap confidence intervals
+    seed : int, optional
+        seed for the permutations and bootstraps
+    backend : str, optional
+        'python' or 'numpy'. The numpy backend computes similarities on threads instead of processes.
+    domains : list or str, optional
+        the GO-domains that should be compared (see megago.partitions.parse_domains). Only the slice of the Gene
+        Ontology with these domains is loaded if go_dag is not given. All domains if not given.
 
     Returns
     -------
     tuple
         A tuple with 3 values. These correspond to the similarity scores of biological process, cellular component and
-        molecular function respectively.
+        molecular function respectively. If permutations or bootstraps are requested, these values are
+        SignificanceResult objects that contain the similarity, p-value and confidence interval. The similarity of a
+        domain that's not compared is NaN.
     """
 
-    freq_dict = get_frequency_counts()
-    highest_ic_anc = get_highest_ic()
-    if go_dag is None:
-        go_dag = GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
-
-    split_per_domain_1 = split_per_domain(go_list_1, go_dag)
-    split_per_domain_2 = split_per_domain(go_list_2, go_dag)
-
-    output = list()
-
-    total_comparisons = len(set(go_list_1)) * len(set(go_list_2))
-    done = 0
-
-    def progress_reporter(batch_size):
-        nonlocal done
-        if progress:
-            done += batch_size
-            progress(done / total_comparisons)
-
-    for i in range(len(GO_DOMAINS)):
-        output.append(
-            compute_bma_metric(
-                split_per_domain_1[i],
-                split_per_domain_2[i],
-                freq_dict,
-                highest_ic_anc,
-                progress_reporter,
-                similarity_method="lin"
-            )
-        )
-
-    if progress:
-        progress(1)
-
-    return tuple(output)
+    session = get_default_session(go_dag, domains)
+    if permutations or bootstraps:
+        return session.significance(go_list_1, go_list_2, permutations, bootstraps, confidence, seed, reduction,
+                                    domains=domains, slim_terms=slim_terms)
+    return session.compare(go_list_1, go_list_2, progress, execution, workers, chunk_size, tile_size, reduction,
+                           backend=backend, domains=domains, slim_terms=slim_terms)
 
 
 def find_non_existing_terms(go_list, go_dag):
@@ -255,39 +355,212 @@ def plot_similarity(list_similarity_values):
     l_is_number = [isinstance(x, numbers.Number) for x in list_similarity_values]
     if not all(l_is_number):
         raise ValueError(f"List contains non numeric values: {list_similarity_values}")
+    # seaborn (and matplotlib) take seconds to import, so they are only loaded when a plot is requested.
+    import seaborn as sns
+
     ax = sns.swarmplot(x=list_similarity_values)
     fig = ax.get_figure()
     return fig
 
 
-def process(options):
+def load_samples(options):
+    """ Read all samples that are given on the command line.
+
+    Returns
+    -------
+    tuple
+        (samples, sample_names): a list with the GO-terms of every sample and a list with the names of the samples that
+        have been read from a file.
+    """
     samples = []
     sample_names = []
 
     for sample in options.samples:
         # The GO-terms that need to be compared can be given as a CSV-file or inline in the command as a ";" delimited
         # string.
-        if re.match(".*\.[^.]+$", sample):
+        if options.input_format != "terms":
+            logging.info("Reading %s output from %s", options.input_format, sample)
+            for name, terms in read_samples(sample, options.input_format, options.mapping, options.weighted):
+                sample_names.append(name)
+                samples.append(terms)
+        elif re.match(".*\.[^.]+$", sample):
             logging.info("Processing sample 1 from %s", sample)
             sample_names.append(sample)
             samples.append(read_input(open(sample, 'r')))
         else:
             samples.append(sample.split(';'))
 
-    all_results = {}
+    return samples, sample_names
+
+
+def open_checkpoint(path, session, resume):
+    """Open the checkpoint of a run with the given session. The checkpoint records the ontology and corpus of the
+    session (see Session.fingerprint), and resuming is refused with a ValueError if these have changed since (e.g.
+    after an update of go-basic.obo or of the frequency counts), since the stored results would be stale."""
+    return Checkpoint(path, session.fingerprint(), resume=resume)
+
+
+def process_proteins(options):
+    """Compare the proteins of options.proteins in one batch and write their similarities to the --output files, or
+    print them as CSV."""
+    for option, given in (("SAMPLES", options.samples), ("--manifest", options.manifest),
+                          ("--heatmap", options.heatmap), ("--reduce", options.reduce),
+                          ("--permutations", options.permutations), ("--bootstraps", options.bootstraps),
+                          ("--checkpoint", options.checkpoint), ("--plot", options.plot_file)):
+        if given:
+            logging.error("%s cannot be combined with --proteins", option)
+            sys.exit(EXIT_COMMAND_LINE_ERROR)
+
+    protein_table = load_protein2go(options.proteins)
+    names = list(protein_table)
+    proteins = [protein_table[name] for name in names]
+    pairs = read_protein_pairs(options.pairs, names) if options.pairs else None
+    logging.info("Comparing %d proteins", len(proteins))
+
+    with Session(similarity_method=options.similarity_method, execution=options.execution, workers=options.workers,
+                 chunk_size=options.chunk_size, tile_size=options.tile_size, backend=options.backend,
+                 domains=options.domains) as session:
+        similarities = session.compare_proteins(proteins, pairs)
+    domains = options.domains or GO_DOMAINS
+
+    # All proteins have been compared with each other if no pairs are given, every domain then has a matrix.
+    all_vs_all = pairs is None
+    if all_vs_all:
+        pairs = [(i, j) for i in range(len(proteins)) for j in range(i + 1, len(proteins))]
+
+    writers = [open_writer(path, names, domains=options.domains) for path in options.output]
+    if not writers:
+        print(PROTEIN_HEADER)
+    for index, (i, j) in enumerate(pairs):
+        results = tuple(float(values[i, j] if all_vs_all else values[index]) for values in similarities)
+        for writer in writers:
+            writer.write(i, j, results)
+        if not writers:
+            for domain, value in zip(GO_DOMAINS, results):
+                if domain in domains:
+                    print(f"{names[i]},{names[j]},{domain},{value}")
+    for writer in writers:
+        writer.close()
 
-    for i in range(len(samples)):
-        for j in range(i + 1, len(samples)):
-            results = run_comparison(samples[i], samples[j])
-            all_results[(i, j)] = results
 
+def process(options):
+    if options.proteins:
+        return process_proteins(options)
+    if options.pairs:
+        logging.error("--pairs requires a protein table (--proteins)")
+        sys.exit(EXIT_COMMAND_LINE_ERROR)
+
+    if options.manifest:
+        if options.samples:
+            logging.error("SAMPLES cannot be combined with --manifest")
+            sys.exit(EXIT_COMMAND_LINE_ERROR)
+        if options.heatmap:
+            logging.error("--heatmap requires all pairs of samples to be compared and cannot be combined with "
+                          "--manifest")
+            sys.exit(EXIT_COMMAND_LINE_ERROR)
+        manifest = read_manifest(options.manifest, options.input_format, options.mapping, options.weighted)
+        samples, sample_names, pairs = manifest.samples, manifest.names, manifest.pairs
+        concurrency = options.workers or available_cpus()
+    else:
+        samples, sample_names = load_samples(options)
+        if len(sample_names) != len(samples):
+            sample_names = ["Sample " + str(i) for i in range(len(samples))]
+        pairs = [(i, j) for i in range(len(samples)) for j in range(i + 1, len(samples))]
+        concurrency = 1
+
+    all_results = {}
+
+    slim_terms = None
+    if options.reduce == SLIM:
+        if options.goslim is None:
+            logging.error("--reduce slim requires a GO slim (--goslim)")
+            sys.exit(EXIT_COMMAND_LINE_ERROR)
+        slim_terms = read_slim(options.goslim)
+
+    if options.resume and not options.checkpoint:
+        logging.error("--resume requires a checkpoint file (--checkpoint)")
+        sys.exit(EXIT_COMMAND_LINE_ERROR)
+
+    session = Session(similarity_method=options.similarity_method, execution=options.execution,
+                      workers=options.workers, chunk_size=options.chunk_size, tile_size=options.tile_size,
+                      reduction=options.reduce, slim_terms=slim_terms, backend=options.backend,
+                      pair_cache=PairCache(options.pair_cache_size * MIB) if options.pair_cache_size else None,
+                      domains=options.domains)
+    domains = session.domains
+
+    if options.calibrate:
+        logging.info("Calibrating the execution planner")
+        save_cost_model(calibrate(session.go_dag, session.term_counts, session.highest_ic_anc))
+
+    significance = options.permutations > 0 or options.bootstraps > 0
+
+    checkpoint = None
+    if options.checkpoint:
+        try:
+            checkpoint = open_checkpoint(options.checkpoint, session, options.resume)
+        except ValueError as error:
+            logging.error(error)
+            sys.exit(EXIT_COMMAND_LINE_ERROR)
+    # Everything that influences the result of a comparison, next to the terms of both samples.
+    settings = [options.similarity_method, options.reduce, sorted(slim_terms or []), options.permutations,
+                options.bootstraps, options.confidence, options.seed]
+    if options.domains:
+        settings.append(options.domains)
+
+    def compare(i, j):
+        key = None
+        if checkpoint is not None:
+            key = checkpoint_key(settings, sorted(samples[i]), sorted(samples[j]))
+            stored = checkpoint.get(key)
+            if stored is not None:
+                logging.info("Results for sample %d and %d are taken from the checkpoint", i, j)
+                return tuple(SignificanceResult(*values) for values in stored) if significance else tuple(stored)
+
+        if significance:
+            results = session.significance(samples[i], samples[j], options.permutations, options.bootstraps,
+                                           options.confidence, options.seed)
+            stored = [[r.similarity, r.p_value, r.ci_low, r.ci_high] for r in results]
+        else:
+            results = session.compare(samples[i], samples[j])
+            stored = list(results)
+        if checkpoint is not None:
+            checkpoint.put(key, stored)
+        return results
+
+    writers = [open_writer(path, sample_names, significance, options.domains) for path in options.output]
+    with session:
+        for (i, j), results in compare_pairs(compare, pairs, concurrency, options.order):
+            for writer in writers:
+                writer.write(i, j, tuple(result.similarity for result in results) if significance else results,
+                             results if significance else None)
             print(f"Results for sample {i} and {j}")
-            print(HEADER)
             lines = [HEADER]
-            for idx, domain in enumerate(GO_DOMAINS):
-                line = f"{domain},{results[idx]}"
-                print(line)
-                lines.append(line)
+            if significance:
+                print(SIGNIFICANCE_HEADER)
+                for domain, result in zip(GO_DOMAINS, results):
+                    if domain not in domains:
+                        continue
+                    print(f"{domain},{result.similarity},{result.p_value},{result.ci_low},{result.ci_high}")
+                    lines.append(f"{domain},{result.similarity}")
+                results = tuple(result.similarity for result in results)
+            else:
+                print(HEADER)
+                for idx, domain in enumerate(GO_DOMAINS):
+                    if domain not in domains:
+                        continue
+                    line = f"{domain},{results[idx]}"
+                    print(line)
+                    lines.append(line)
+            all_results[(i, j)] = results
+
+            if options.reduce:
+                report = session.reduction_report(samples[i], samples[j], results)
+                for domain, values in zip(GO_DOMAINS, report):
+                    if domain not in domains:
+                        continue
+                    print(f"{domain}: reduced sample {i} from {values['terms_1']} to {values['reduced_1']} and sample "
+                          f"{j} from {values['terms_2']} to {values['reduced_2']} unique terms, estimated similarity "
+                          f"without reduction {values['estimate']:.4f} ({values['effect']:+.4f})", file=sys.stderr)
 
             csv_table_string = "\n".join(lines)
             list_similarity_values = []
@@ -295,10 +568,18 @@ def process(options):
                 list_similarity_values.append(float(l.split(",")[1]))
             if options.plot_file:
                 figure = plot_similarity(list_similarity_values)
-                figure.savefig(options.plot_file)
+                # Every pair gets its own plot, instead of overwriting the plot of the previous pair.
+                figure.savefig(options.plot_file if len(pairs) == 1 else pair_file_name(options.plot_file, i, j))
+
+    for writer in writers:
+        writer.close()
+    if checkpoint is not None:
+        checkpoint.close()
 
     if options.heatmap:
-        generate_heatmap(all_results, sample_names if len(sample_names) == len(samples) else ["Sample " + str(i) for i in range(len(samples))])
+        from .heatmap import generate_heatmap
+
+        generate_heatmap(all_results, sample_names)
 
 
 
@@ -340,6 +621,11 @@ def init_logging(log_filename, verbose):
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in shards.SHARD_COMMANDS:
+        # Distributed execution: megago plan | run-shard | merge (see megago.shards)
+        shards.main(sys.argv[1:])
+        return
+
     options = parse_args()
     init_logging(options.log, options.verbose)
     logging.info(f"MegaGO version {PROGRAM_VERSION}")
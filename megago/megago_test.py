@@ -4,11 +4,99 @@ Unit tests for megago.
 Usage: python -m unittest -v megago_test
 """
 
+import concurrent.futures
+import gc
+import importlib.util
+import json
 import matplotlib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import weakref
 from io import StringIO
+from unittest import mock
 # pylint: disable=no-name-in-module
-from megago.megago import read_input, is_go_term, plot_similarity
+from megago.megago import read_input, is_go_term, open_checkpoint, plot_similarity
+from megago.checkpoint import Checkpoint
+from megago.clustering import find_candidate_pairs
+from megago.execution import CostModel, SerialExecutor, get_cost_model, load_cost_model, plan_execution, \
+    map_bounded, save_cost_model
+from megago.library import ReferenceLibrary, compute_signature, cosine_similarity
+from megago.jobs import CANCELLED, FINISHED, JobQueue
+from megago.importers import _parse_interpro2go, load_interpro2go, read_megan, read_mpa, read_unipept, \
+    to_term_list
+from megago.monitoring import render_metrics
+from megago.manifest import ORDERED, UNORDERED, compare_pairs, read_manifest
+from megago.heatmap import HEATMAP_DATA_VARIABLE, generate_heatmap
+from megago.outputs import open_writer, pair_file_name
+from megago.pair_cache import MIB, SLOT_BYTES, PairCache
+from megago.partitions import parse_domains, partition_obo
+from megago.progress import EtaEstimator, ProgressCounters, ProgressTracker, write_progress
+from megago.metrics import bma_from_best_matches, compute_best_matches, compute_bma_metric, compute_similarity_method, \
+    get_wang_index, lin_metric, rel_metric
+from megago.ontology import AncestorIndex, TermArray, TermTable, WangIndex
+from megago.session import Session
+from megago.releases import Release, ReleaseRegistry
+from megago.reduction import reduce_leaves, reduce_to_slim
+from megago.shards import compute_shard, merge_shards, plan_shards, write_plan
+from megago.significance import assess_significance, bma_from_matrix, compute_similarity_matrix
+from megago.validation import GoatoolsEngine, NumpyEngine, PythonEngine, random_pairs, validate
+
+import numpy as np
+
+from goatools.obo_parser import GODag
+
+# A tiny ontology: GO:0000001 is the root, GO:0000004 has two parents.
+#
+#   GO:0000001 - GO:0000002 - GO:0000004
+#             \- GO:0000003 -/         \- GO:0000005
+TEST_OBO = """format-version: 1.2
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: c
+namespace: biological_process
+is_a: GO:0000002 ! a
+is_a: GO:0000003 ! b
+
+[Term]
+id: GO:0000005
+name: d
+namespace: biological_process
+alt_id: GO:0000009
+is_a: GO:0000004 ! c
+"""
+
+
+def load_test_dag(obo=TEST_OBO):
+    fd, path = tempfile.mkstemp(suffix=".obo")
+    with os.fdopen(fd, "w") as f:
+        f.write(obo)
+    try:
+        return GODag(path, prt=None)
+    finally:
+        os.remove(path)
 
 
 class TestIsStringContaingGo(unittest.TestCase):
@@ -116,5 +204,1126 @@ class TestPlotSimilarity(unittest.TestCase):
         self.do_test(lst, ValueError)
 
 
+class TestStartup(unittest.TestCase):
+    '''Guards the startup time of the command line interface'''
+
+    # Modules that take long to import and should only be loaded when they are used.
+    HEAVY_MODULES = ["goatools", "seaborn", "matplotlib", "pkg_resources", "scipy", "pandas"]
+    # Maximum time (in microseconds) that importing the command line interface may take. It's about 0.1s at the time
+    # of writing and was more than 2s when seaborn was imported eagerly.
+    IMPORT_TIME_BUDGET = 1000000
+
+    def test_import_time(self):
+        code = "import sys, megago.megago; print(','.join(sorted(m for m in sys.modules if '.' not in m)))"
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        loaded = set(result.stdout.strip().split(","))
+        self.assertEqual([], [module for module in self.HEAVY_MODULES if module in loaded])
+        # The last line of the report contains the cumulative import time of megago.megago.
+        cumulative = int(result.stderr.strip().splitlines()[-1].split("|")[1])
+        self.assertLess(cumulative, self.IMPORT_TIME_BUDGET)
+
+
+class TestPlanExecution(unittest.TestCase):
+    '''Unit tests for plan_execution'''
+
+    COST_MODEL = CostModel(pair_cost=1e-4, worker_startup_cost=1.0, worker_spawn_cost=0.05)
+
+    def do_plan(self, rows, cols, cpus=8, env=None, **kwargs):
+        "Wrapper function that plans an execution for a machine with the given amount of CPUs"
+        with mock.patch("megago.execution.available_cpus", return_value=cpus), \
+                mock.patch.dict(os.environ, env or {}, clear=True):
+            return plan_execution(rows, cols, cost_model=self.COST_MODEL, **kwargs)
+
+    def test_small_problem_is_serial(self):
+        plan = self.do_plan(3, 3)
+        self.assertEqual("serial", plan.mode)
+        self.assertEqual(1, plan.workers)
+
+    def test_large_problem_uses_processes(self):
+        plan = self.do_plan(5000, 5000)
+        self.assertEqual("processes", plan.mode)
+        self.assertEqual(8, plan.workers)
+
+    def test_single_cpu_is_serial(self):
+        plan = self.do_plan(5000, 5000, cpus=1)
+        self.assertEqual("serial", plan.mode)
+
+    def test_chunks_are_balanced(self):
+        plan = self.do_plan(5000, 5000)
+        chunks = -(-5000 // plan.chunk_size)
+        self.assertGreaterEqual(chunks, plan.workers * 4)
+
+    def test_environment_overrides_planner(self):
+        plan = self.do_plan(3, 3, env={"MEGAGO_EXECUTION": "threads", "MEGAGO_WORKERS": "2", "MEGAGO_CHUNK_SIZE": "1"})
+        self.assertEqual("threads", plan.mode)
+        self.assertEqual(2, plan.workers)
+        self.assertEqual(1, plan.chunk_size)
+
+    def test_arguments_override_environment(self):
+        plan = self.do_plan(3, 3, env={"MEGAGO_EXECUTION": "threads"}, mode="processes", workers=3)
+        self.assertEqual("processes", plan.mode)
+        self.assertEqual(3, plan.workers)
+
+    def test_numpy_backend_uses_threads(self):
+        plan = self.do_plan(5000, 5000, backend="numpy")
+        self.assertEqual("threads", plan.mode)
+        self.assertEqual(8, plan.workers)
+
+    def calibration_file(self):
+        "Patch the calibration file with a file in a temporary directory"
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "calibration.json")
+        patch = mock.patch("megago.execution.CALIBRATION_FILE_PATH", path)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return path
+
+    def test_calibration_only_if_processes_may_be_used(self):
+        self.calibration_file()
+        resources = ("go_dag", "term_counts", "highest_ic_anc")
+        with mock.patch("megago.execution.load_cost_model", return_value=None), \
+                mock.patch("megago.execution.save_cost_model"), \
+                mock.patch("megago.execution.calibrate", return_value=self.COST_MODEL) as calibrate:
+            plan_execution(5000, 5000, backend="numpy", resources=resources)
+            plan_execution(5000, 5000, mode="threads", resources=resources)
+            calibrate.assert_not_called()
+            plan_execution(5000, 5000, resources=resources)
+            calibrate.assert_called_once_with(*resources)
+
+    def test_calibration_is_read_once(self):
+        self.calibration_file()
+        with mock.patch("megago.execution.load_cost_model", wraps=load_cost_model) as load:
+            self.assertEqual(CostModel().to_dict(), get_cost_model().to_dict())
+            save_cost_model(self.COST_MODEL)
+            # Saving a calibration replaces the cost model that has been read before.
+            for _ in range(3):
+                self.assertIs(self.COST_MODEL, get_cost_model())
+                plan_execution(5000, 5000)
+            load.assert_called_once()
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            self.do_plan(3, 3, mode="gpu")
+
+    def test_tiles_cover_grid(self):
+        plan = self.do_plan(10, 7, chunk_size=3, tile_size=4)
+        cells = set()
+        for row_start, row_end, col_start, col_end in plan.tiles(10, 7):
+            self.assertLessEqual((row_end - row_start) * (col_end - col_start), 12)
+            cells.update((i, j) for i in range(row_start, row_end) for j in range(col_start, col_end))
+        self.assertEqual(70, len(cells))
+
+    def test_map_bounded(self):
+        tasks = ((i, i) for i in range(10))
+        results = dict(map_bounded(SerialExecutor(), lambda x: x * x, tasks, 2))
+        self.assertEqual({i: i * i for i in range(10)}, results)
+
+    def test_map_bounded_cancelled(self):
+        cancel_event = threading.Event()
+        tasks = ((i, i) for i in range(10))
+        results = []
+        with self.assertRaises(concurrent.futures.CancelledError):
+            for key, value in map_bounded(SerialExecutor(), lambda x: x, tasks, 2, cancel_event):
+                results.append(value)
+                cancel_event.set()
+        self.assertEqual(1, len(results))
+
+
+class TestJobs(unittest.TestCase):
+    '''Unit tests for the background job queue'''
+
+    def setUp(self):
+        self.queue = JobQueue(max_running=1, idle_timeout=60)
+        self.addCleanup(self.queue.close)
+
+    def test_cancel(self):
+        started = threading.Event()
+
+        def wait_for_cancellation(job):
+            started.set()
+            job.cancel_event.wait()
+            raise concurrent.futures.CancelledError()
+
+        running = self.queue.submit(wait_for_cancellation)
+        queued = self.queue.submit(lambda job: 42)
+        started.wait()
+        self.assertTrue(self.queue.cancel(running.id))
+        queued._future.result()
+        self.assertEqual(CANCELLED, running.state)
+        # The next job starts as soon as the running job has been cancelled.
+        self.assertEqual(FINISHED, queued.state)
+        self.assertEqual(42, queued.result)
+        self.assertFalse(self.queue.cancel(queued.id))
+
+    def test_cancel_idle(self):
+        blocker = threading.Event()
+        self.addCleanup(blocker.set)
+        self.queue.submit(lambda job: blocker.wait())
+        job = self.queue.submit(lambda job: 42)
+        self.assertEqual([], self.queue.cancel_idle(job.last_seen + 30))
+        self.assertIn(job.id, self.queue.cancel_idle(job.last_seen + 61))
+        self.assertEqual(CANCELLED, job.state)
+
+    def test_expire(self):
+        queue = JobQueue(max_running=1, finished_ttl=60, fetched_ttl=5, max_finished=2)
+        self.addCleanup(queue.close)
+        jobs = [queue.submit(lambda job: 42) for _ in range(3)]
+        jobs[-1]._future.result()
+        # Only the most recent jobs that are done are kept.
+        self.assertIsNone(queue.get(jobs[0].id))
+        fetched, unfetched = jobs[1:]
+        queue.fetched(fetched.id)
+        self.assertEqual([], queue.expire(fetched.finished_at))
+        self.assertEqual([fetched.id], queue.expire(fetched.finished_at + 30))
+        self.assertEqual([unfetched.id], queue.expire(unfetched.finished_at + 61))
+        self.assertEqual(0, sum(queue.counts().values()))
+
+    def test_metrics(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        values = TermArray(table, [1] * len(table))
+        with Session(go_dag=go_dag, execution="serial", term_counts=values, highest_ic_anc=values) as session:
+            compare = lambda job: session.compare(["GO:0000002", "GO:0000004"], ["GO:0000003"])
+            self.queue.submit(compare)._future.result()
+            self.queue.submit(compare)._future.result()
+            lines = render_metrics(self.queue, {"bundled": session}).splitlines()
+        self.assertIn('megago_jobs{state="finished"} 2', lines)
+        self.assertIn('megago_job_workers 1', lines)
+        self.assertIn('megago_job_run_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('megago_job_wait_seconds_count 2', lines)
+        self.assertIn('megago_pairs_compared_total{release="bundled"} 2', lines)
+        # Every comparison looks up one result per domain. Both empty domains share a result, and the second comparison
+        # only finds cached results.
+        self.assertIn('megago_result_cache_hits_total{release="bundled"} 4', lines)
+        self.assertIn('megago_result_cache_misses_total{release="bundled"} 2', lines)
+
+
+class TestProgress(unittest.TestCase):
+    '''Unit tests for progress reporting'''
+
+    def test_tracker(self):
+        counters = ProgressCounters(slots=1)
+        tracker = ProgressTracker(counters, 20, lambda value: None)
+        token = tracker.start_task()
+        self.assertEqual(-1, tracker.start_task())
+        # A worker reports the rows it has compared so far.
+        write_progress(counters.array, token, 4)
+        self.assertEqual(4, tracker.done())
+        tracker.finish_task(token, 10)
+        tracker.add(5)
+        self.assertEqual(15, tracker.done())
+        self.assertEqual(0.75, tracker.fraction())
+
+    def test_late_writes_are_ignored(self):
+        counters = ProgressCounters(slots=1)
+        with ProgressTracker(counters, 20, lambda value: None) as tracker:
+            # The task fails, while its worker is still running.
+            cancelled = tracker.start_task()
+        tracker = ProgressTracker(counters, 20, lambda value: None)
+        token = tracker.start_task()
+        self.assertNotEqual(cancelled, token)
+        self.assertEqual(0, tracker.done())
+        # The next task of the slot doesn't count the writes of the worker of the cancelled task.
+        write_progress(counters.array, cancelled, 7)
+        self.assertEqual(0, tracker.done())
+        write_progress(counters.array, token, 3)
+        self.assertEqual(3, tracker.done())
+
+    def test_eta(self):
+        estimator = EtaEstimator()
+        self.assertIsNone(estimator.update(0.0, now=0))
+        self.assertAlmostEqual(30, estimator.update(0.25, now=10))
+        self.assertEqual(0, estimator.update(1, now=20))
+
+    def test_compare(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        values = TermArray(table, [1] * len(table))
+        values_reported = []
+        with Session(go_dag=go_dag, execution="serial", tile_size=1, term_counts=values,
+                     highest_ic_anc=values) as session:
+            session.compare(["GO:0000002", "GO:0000004"], ["GO:0000003", "GO:0000005", "GO:0000005"],
+                            values_reported.append)
+            # All slots are free again once the comparison has finished.
+            self.assertEqual(len(session.progress_counters.array), len(session.progress_counters._free))
+        self.assertEqual(1, values_reported[-1])
+
+
+class TestCheckpoint(unittest.TestCase):
+    '''Unit tests for checkpoints'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "checkpoint.sqlite")
+
+    def test_resume(self):
+        with Checkpoint(self.path, "run") as checkpoint:
+            checkpoint.put("a", [0.5, float("nan")])
+        with Checkpoint(self.path, "run") as checkpoint:
+            self.assertIn("a", checkpoint)
+            self.assertEqual(0.5, checkpoint.get("a")[0])
+        with Checkpoint(self.path, "run", resume=False) as checkpoint:
+            self.assertEqual(0, len(checkpoint))
+
+    def test_other_run(self):
+        Checkpoint(self.path, "run").close()
+        with self.assertRaises(ValueError):
+            Checkpoint(self.path, "other run")
+
+    def test_corpus_changed(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        ones = TermArray(table, [1] * len(table))
+        with Session(go_dag=go_dag, execution="serial", term_counts=ones, highest_ic_anc=ones) as session:
+            open_checkpoint(self.path, session, resume=True).close()
+            open_checkpoint(self.path, session, resume=True).close()
+        # The frequency counts have been updated since the checkpoint was written.
+        counts = TermArray(table, range(1, len(table) + 1))
+        with Session(go_dag=go_dag, execution="serial", term_counts=counts, highest_ic_anc=ones) as session:
+            with self.assertRaises(ValueError):
+                open_checkpoint(self.path, session, resume=True)
+            open_checkpoint(self.path, session, resume=False).close()
+
+
+class TestShards(unittest.TestCase):
+    '''Unit tests for dividing comparisons over shards'''
+
+    samples = [
+        [["GO:%07d" % i for i in range(40)], [], ["GO:0000001"]],
+        [["GO:%07d" % i for i in range(30)], ["GO:0000002"], ["GO:0000001", "GO:0000001"]],
+        [["GO:%07d" % i for i in range(20)], [], []]
+    ]
+
+    def test_all_rows_covered(self):
+        shards = plan_shards(self.samples, 5)
+        self.assertEqual(5, len(shards))
+        rows = dict()
+        for units in shards:
+            for i, j, domain, row_start, row_end in units:
+                rows.setdefault((i, j, domain), []).extend(range(row_start, row_end))
+        # Domains without terms in one of both samples do not need any work.
+        self.assertEqual({(0, 1, 0), (0, 1, 2), (0, 2, 0), (1, 2, 0)}, set(rows))
+        self.assertEqual(list(range(40)), sorted(rows[(0, 1, 0)]))
+        self.assertEqual([0], rows[(0, 1, 2)])
+
+    def test_deterministic(self):
+        self.assertEqual(plan_shards(self.samples, 3), plan_shards(self.samples, 3))
+
+    def test_merged_shards_equal_compare(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        counts = TermArray(table, [10, 6, 5, 3, 1])
+        highest_ic = TermArray(table, [0.5] * len(table))
+        samples = [["GO:0000002", "GO:0000004", "GO:0000004"], ["GO:0000003", "GO:0000005"],
+                   ["GO:0000001", "GO:0000004", "GO:0000005"], ["GO:0000002"]]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with Session(go_dag=go_dag, execution="serial", term_counts=counts, highest_ic_anc=highest_ic) as session:
+            write_plan(directory.name, samples, [], 3, session)
+            for shard in range(3):
+                compute_shard(directory.name, shard, session)
+            results, names = merge_shards(directory.name)
+            self.assertEqual(["Sample 0", "Sample 1", "Sample 2", "Sample 3"], names)
+            for i in range(len(samples)):
+                for j in range(i + 1, len(samples)):
+                    np.testing.assert_allclose(session.compare(samples[i], samples[j]), results[(i, j)])
+
+        # Shards are refused on a machine with other frequency counts.
+        other_counts = TermArray(table, [10, 6, 5, 3, 2])
+        with Session(go_dag=go_dag, execution="serial", term_counts=other_counts,
+                     highest_ic_anc=highest_ic) as session:
+            with self.assertRaises(ValueError):
+                compute_shard(directory.name, 0, session, force=True)
+
+
+class TestOutputs(unittest.TestCase):
+    '''Unit tests for the streaming result writers'''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_csv(self):
+        path = os.path.join(self.directory.name, "results.csv")
+        with open_writer(path, ["a", "b", "c"]) as writer:
+            writer.write(0, 2, (0.5, float("nan"), 1.0))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(["SAMPLE_1,SAMPLE_2,DOMAIN,SIMILARITY", "a,c,biological_process,0.5",
+                          "a,c,cellular_component,nan", "a,c,molecular_function,1.0"], lines)
+
+    def test_npy(self):
+        path = os.path.join(self.directory.name, "results.npy")
+        with open_writer(path, ["a", "b", "c"]) as writer:
+            writer.write(0, 2, (0.5, 0.25, 1.0))
+        matrix = np.load(os.path.join(self.directory.name, "results_cellular_component.npy"))
+        self.assertEqual(0.25, matrix[2, 0])
+        self.assertEqual(1, matrix[1, 1])
+        self.assertTrue(np.isnan(matrix[0, 1]))
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "requires pyarrow")
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        path = os.path.join(self.directory.name, "results.parquet")
+        # Every pair is written as a separate row group.
+        with mock.patch("megago.outputs.WRITE_BATCH_SIZE", 1):
+            with open_writer(path, ["a", "b", "c"], domains=["molecular_function"]) as writer:
+                writer.write(0, 2, (0.5, 0.25, 1.0))
+                writer.write(1, 2, (0.75, float("nan"), 0.0))
+        self.assertEqual(2, pyarrow.parquet.ParquetFile(path).num_row_groups)
+        self.assertEqual({"SAMPLE_1": ["a", "b"], "SAMPLE_2": ["c", "c"],
+                          "DOMAIN": ["molecular_function", "molecular_function"], "SIMILARITY": [1.0, 0.0]},
+                         pyarrow.parquet.read_table(path).to_pydict())
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            open_writer(os.path.join(self.directory.name, "results.txt"), ["a", "b"])
+
+    def test_heatmap(self):
+        path = os.path.join(self.directory.name, "heatmap.html")
+        results = {(0, 1): (0.5, float("nan"), 0.123456), (0, 2): (0.25, 0.0, 1.0), (1, 2): (1.0, 0.5, 0.75)}
+        generate_heatmap(results, ["a", "b", "c"], path)
+        with open(path) as f:
+            self.assertIn('src="heatmap_data.js"', f.read())
+        with open(os.path.join(self.directory.name, "heatmap_data.js")) as f:
+            content = f.read()
+        prefix = f"const {HEATMAP_DATA_VARIABLE} = "
+        self.assertTrue(content.startswith(prefix))
+        data = json.loads(content[len(prefix):].strip().rstrip(";"))
+        self.assertEqual(["a", "b", "c"], data["labels"])
+        self.assertEqual([[1, 0.5, 0.25], [0.5, 1, 1.0], [0.25, 1.0, 1]], data["biological_process"])
+        # NaN is not valid JSON.
+        self.assertEqual([[1, None, 0.0], [None, 1, 0.5], [0.0, 0.5, 1]], data["cellular_component"])
+        self.assertEqual([[1, 0.1235, 1.0], [0.1235, 1, 0.75], [1.0, 0.75, 1]], data["molecular_function"])
+
+    def test_pair_file_name(self):
+        self.assertEqual(os.path.join("plots", "plot_0_1.png"), pair_file_name(os.path.join("plots", "plot.png"), 0, 1))
+
+
+class TestManifest(unittest.TestCase):
+    '''Unit tests for batch comparisons of the pairs in a manifest'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for name, terms in [("a.txt", ["GO:0000001", "GO:0000002"]), ("ref.txt", ["GO:0000003"])]:
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write("GO\n" + "\n".join(terms) + "\n")
+
+    def write_manifest(self, lines):
+        path = os.path.join(self.directory, "manifest.tsv")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def test_read(self):
+        manifest = read_manifest(self.write_manifest([
+            "# sample and reference", "sample\treference\tref.txt", "pair\ta.txt\treference", "",
+            "pair\treference\ta.txt"
+        ]))
+        # Every sample is read only once.
+        self.assertEqual(["a.txt", "reference"], manifest.names)
+        self.assertEqual([["GO:0000001", "GO:0000002"], ["GO:0000003"]], manifest.samples)
+        self.assertEqual([(0, 1), (1, 0)], manifest.pairs)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            read_manifest(self.write_manifest(["pair\ta.txt\tunknown"]))
+        with self.assertRaises(ValueError):
+            read_manifest(self.write_manifest(["pair\ta.txt"]))
+
+    def test_compare_pairs(self):
+        pairs = [(0, 1), (0, 2), (1, 2)]
+
+        def compare(i, j):
+            # The first pair only finishes once the other pairs have been compared.
+            if (i, j) == (0, 1):
+                self.assertTrue(released.wait(5))
+            return i + j
+
+        released = threading.Event()
+        results = []
+        for pair, result in compare_pairs(compare, pairs, concurrency=3, order=UNORDERED):
+            results.append(pair)
+            if len(results) == 2:
+                released.set()
+        self.assertEqual((0, 1), results[-1])
+
+        released.clear()
+        threading.Timer(0.1, released.set).start()
+        self.assertEqual([((0, 1), 1), ((0, 2), 2), ((1, 2), 3)],
+                         list(compare_pairs(compare, pairs, concurrency=3, order=ORDERED)))
+
+
+class TestImporters(unittest.TestCase):
+    '''Unit tests for the annotation tool importers'''
+
+    def write_temp_file(self, content):
+        "Write content to a temporary file that is removed after the test"
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_interpro2go(self):
+        path = self.write_temp_file("""!version date: 2020/01/01
+InterPro:IPR000003 Retinoid X receptor/HNF4 > GO:DNA binding ; GO:0003677
+InterPro:IPR000003 Retinoid X receptor/HNF4 > GO:zinc ion binding ; GO:0008270
+InterPro:IPR000005 Helix-turn-helix, AraC type > GO:DNA-binding transcription factor activity ; GO:0003700
+""")
+        expected = {"IPR000003": ["GO:0003677", "GO:0008270"], "IPR000005": ["GO:0003700"]}
+        self.assertEqual(expected, _parse_interpro2go(path))
+
+    def test_cached_mapping(self):
+        path = self.write_temp_file("InterPro:IPR000005 Helix-turn-helix, AraC type > GO:DNA-binding ; GO:0003700\n")
+        with tempfile.TemporaryDirectory() as cache_dir, mock.patch("megago.importers.MAPPING_CACHE_DIR", cache_dir):
+            with mock.patch.dict("megago.importers._MAPPINGS", clear=True):
+                self.assertEqual({"IPR000005": ["GO:0003700"]}, load_interpro2go(path))
+            [cache_file] = os.listdir(cache_dir)
+            with open(os.path.join(cache_dir, cache_file)) as f:
+                cached = json.load(f)
+            # The cached mapping is used instead of the file...
+            cached["mapping"] = {"IPR000005": ["GO:0000001"]}
+            with open(os.path.join(cache_dir, cache_file), "w") as f:
+                json.dump(cached, f)
+            with mock.patch.dict("megago.importers._MAPPINGS", clear=True):
+                self.assertEqual({"IPR000005": ["GO:0000001"]}, load_interpro2go(path))
+            # ...but only if it has been parsed from the same file.
+            cached["key"][1] = "/elsewhere"
+            with open(os.path.join(cache_dir, cache_file), "w") as f:
+                json.dump(cached, f)
+            with mock.patch.dict("megago.importers._MAPPINGS", clear=True):
+                self.assertEqual({"IPR000005": ["GO:0003700"]}, load_interpro2go(path))
+
+    def test_megan(self):
+        path = self.write_temp_file('''"X.Datasets"	"XA"	"XB"	"Log2.A.1"	"og"
+"COG1 x"	2	0	1.58	"COG1"
+"COG2 y"	1	3	1	"COG2"
+"COG3 z"	5	5	2.58	"COG3"
+'''.replace('"', ""))
+        og2go = {"COG1": ["GO:0000001", "GO:0000002"], "COG2": ["GO:0000002"]}
+        samples = read_megan(path, og2go)
+        self.assertEqual(["XA", "XB"], list(samples))
+        self.assertEqual({"GO:0000001": 2, "GO:0000002": 3}, samples["XA"])
+        self.assertEqual({"GO:0000002": 3}, samples["XB"])
+
+    def test_megan_log_columns(self):
+        path = self.write_temp_file("X.Datasets\tXXLog2\tX.Log2.A\tog\nCOG1 x\t2\t1\tCOG1\n")
+        # Only a single "X." prefix is removed before looking for "Log2".
+        self.assertEqual(["XXLog2"], list(read_megan(path, {"COG1": ["GO:0000001"]})))
+
+    def test_unipept_counts(self):
+        path = self.write_temp_file("GO term,#peptides\nGO:0000001,3\nGO:0000002,\nGO:0000001,2\n")
+        self.assertEqual({"GO:0000001": 5}, read_unipept(path))
+        path = self.write_temp_file("GO term,#peptides\nGO:0000001,3\nGO:0000002,many\n")
+        with self.assertRaisesRegex(ValueError, f"{re.escape(path)}, line 3: 'many'"):
+            read_unipept(path)
+
+    def test_mpa_counts(self):
+        protein2go = {"P1": ["GO:0000001"], "P2": ["GO:0000002"]}
+        path = self.write_temp_file("Protein Accession\tSpectral Count\nP1\t4\nP2\t\n")
+        self.assertEqual({"GO:0000001": 4, "GO:0000002": 1}, read_mpa(path, protein2go))
+        path = self.write_temp_file("Protein Accession\tSpectral Count\nP1\t4\nP2\t2.5\n")
+        with self.assertRaisesRegex(ValueError, "line 3: '2.5'"):
+            read_mpa(path, protein2go)
+
+    def test_weighted_term_list(self):
+        terms = {"GO:0000002": 2, "GO:0000001": 0.2}
+        self.assertEqual(["GO:0000001", "GO:0000002"], to_term_list(terms))
+        self.assertEqual(["GO:0000001", "GO:0000002", "GO:0000002"], to_term_list(terms, weighted=True))
+
+
+class TestReduction(unittest.TestCase):
+    '''Unit tests for the term reduction pre-pass'''
+
+    def setUp(self):
+        self.index = AncestorIndex(load_test_dag())
+
+    def test_leaves(self):
+        terms = ["GO:0000001", "GO:0000003", "GO:0000004", "GO:0000004", "GO:9999999"]
+        reduction = reduce_leaves(terms, self.index)
+        self.assertEqual(["GO:0000004", "GO:0000004", "GO:9999999"], reduction.terms)
+        self.assertEqual(2, reduction.removed)
+
+    def test_slim(self):
+        terms = ["GO:0000005", "GO:0000003", "GO:0000001"]
+        reduction = reduce_to_slim(terms, self.index, ["GO:0000001", "GO:0000002", "GO:0000003"])
+        self.assertEqual(["GO:0000002", "GO:0000003", "GO:0000003", "GO:0000001"], reduction.terms)
+        self.assertEqual(1, reduction.removed)
+
+
+class TestTermTable(unittest.TestCase):
+    '''Unit tests for the integer indexed term tables'''
+
+    def setUp(self):
+        self.go_dag = load_test_dag()
+        self.table = TermTable(self.go_dag)
+
+    def test_indices(self):
+        self.assertEqual(4, self.table.index("GO:0000005"))
+        self.assertEqual(4, self.table.index("GO:0000009"))
+        self.assertEqual("GO:0000005", self.table.go_id(4))
+        self.assertEqual([0, 4, -1, -1], self.table.indices(["GO:0000001", "GO:0000009", "GO:0000006", "foo"]).tolist())
+
+    def test_deepest_common_ancestor(self):
+        self.assertEqual(0, self.table.deepest_common_ancestor(1, 2))
+        self.assertEqual(3, self.table.deepest_common_ancestor(4, 3))
+
+    def test_lin_metric(self):
+        term_counts = {"GO:0008150": 100, "GO:0000001": 100, "GO:0000002": 50, "GO:0000003": 40, "GO:0000004": 10,
+                       "GO:0000005": 5, "GO:0000009": 5}
+        highest_ic_anc = dict.fromkeys(term_counts, 0)
+        term_array = TermArray.from_dict(self.table, term_counts)
+        highest_ic_array = TermArray.from_dict(self.table, highest_ic_anc)
+        self.assertEqual(5, term_array["GO:0000009"])
+        for id1, id2 in [("GO:0000002", "GO:0000005"), ("GO:0000004", "GO:0000009"), ("GO:0000003", "GO:0000002")]:
+            self.assertAlmostEqual(lin_metric(id1, id2, self.go_dag, term_counts, highest_ic_anc),
+                                   lin_metric(id1, id2, self.go_dag, term_array, highest_ic_array))
+
+    def test_numpy_backend(self):
+        values = TermArray(self.table, [100, 50, 40, 10, 5])
+        highest_ic = TermArray(self.table, [0] * len(self.table))
+        terms = ["GO:0000001", "GO:0000002", "GO:0000003", "GO:0000004", "GO:0000009", "GO:9999999"]
+        for metric in (lin_metric, rel_metric):
+            expected = compute_similarity_method(terms, terms[::-1], self.go_dag, values, highest_ic, metric)
+            actual = compute_similarity_method(terms, terms[::-1], self.go_dag, values, highest_ic, metric,
+                                               backend="numpy")
+            np.testing.assert_allclose(expected, actual)
+        rows, cols = [4, 3, 2, 1], [3, 2, 1]
+        self.assertEqual([[self.table.deepest_common_ancestor(i, j) for j in cols] for i in rows],
+                         self.table.deepest_common_ancestors(rows, cols).tolist())
+
+    def test_save_load(self):
+        fd, path = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        TermArray(self.table, [1, 2, 3, 4, 5]).save(path, "obo-1")
+        self.assertEqual([1, 2, 3, 4, 5], TermArray.load(path, self.table).values.tolist())
+        self.assertEqual([1, 2, 3, 4, 5], TermArray.load(path, self.table, "obo-1").values.tolist())
+        # Values that have been derived from another version of the ontology are refused.
+        with self.assertRaises(ValueError):
+            TermArray.load(path, self.table, "obo-2")
+
+
+class TestBestMatches(unittest.TestCase):
+    '''Unit tests for the tiled reduction of the similarity matrix to best matches'''
+
+    TERMS = ["GO:0000001", "GO:0000002", "GO:0000003", "GO:0000004", "GO:0000005"]
+
+    def setUp(self):
+        self.go_dag = load_test_dag()
+        table = TermTable(self.go_dag)
+        self.term_counts = TermArray(table, [10, 6, 5, 3, 1])
+        self.highest_ic = TermArray(table, [0.5] * len(table))
+
+    def untiled(self, terms1, terms2):
+        "Best matches computed from the complete similarity matrix, undefined similarities are ignored"
+        matrix = np.array([[lin_metric(term1, term2, self.go_dag, self.term_counts, self.highest_ic)
+                            for term2 in terms2] for term1 in terms1]).reshape(len(terms1), len(terms2))
+        matrix = np.nan_to_num(matrix, nan=0.0)
+        return (dict(zip(terms1, matrix.max(axis=1, initial=0.0))), dict(zip(terms2, matrix.max(axis=0, initial=0.0))))
+
+    def best_matches(self, terms1, terms2, **kwargs):
+        return compute_best_matches(terms1, terms2, self.term_counts, self.highest_ic, similarity_method="lin",
+                                    go_dag=self.go_dag, **kwargs)
+
+    def assert_best_matches_equal(self, expected, actual):
+        for expected_matches, actual_matches in zip(expected, actual):
+            self.assertEqual(set(expected_matches), set(actual_matches))
+            for term, value in expected_matches.items():
+                self.assertAlmostEqual(value, actual_matches[term])
+
+    def test_tiles_that_do_not_divide_the_samples(self):
+        terms1 = self.TERMS + ["GO:9999999"]
+        terms2 = self.TERMS
+        expected = self.untiled(terms1, terms2)
+        for backend in ("python", "numpy"):
+            for execution in ("serial", "threads"):
+                for tile_size, chunk_size in ((1, 1), (2, 4), (4, 4), (5, 6), (3, 5)):
+                    actual = self.best_matches(terms1, terms2, execution=execution, workers=2, tile_size=tile_size,
+                                               chunk_size=chunk_size, backend=backend)
+                    self.assert_best_matches_equal(expected, actual)
+
+    def test_single_term(self):
+        for terms1, terms2 in ((["GO:0000004"], self.TERMS), (self.TERMS, ["GO:0000004"])):
+            expected = self.untiled(terms1, terms2)
+            self.assert_best_matches_equal(expected, self.best_matches(terms1, terms2, execution="serial",
+                                                                       tile_size=2, chunk_size=1))
+
+    def test_empty_sample(self):
+        best_match1, best_match2 = self.best_matches([], self.TERMS, execution="serial", tile_size=2)
+        self.assertEqual({}, best_match1)
+        self.assertEqual(dict.fromkeys(self.TERMS, 0.0), best_match2)
+        self.assertTrue(np.isnan(bma_from_best_matches([], self.TERMS, best_match1, best_match2)))
+        self.assertEqual(0, bma_from_best_matches([], [], *self.best_matches([], [], execution="serial")))
+
+
+class TestSession(unittest.TestCase):
+    '''Unit tests for sessions'''
+
+    def setUp(self):
+        self.go_dag = load_test_dag()
+        table = TermTable(self.go_dag)
+        self.term_counts = TermArray(table, [10, 6, 5, 3, 1])
+        self.highest_ic = TermArray(table, [0.5] * len(table))
+
+    def create_session(self, **kwargs):
+        session = Session(go_dag=self.go_dag, term_counts=self.term_counts, highest_ic_anc=self.highest_ic, **kwargs)
+        self.addCleanup(session.close)
+        return session
+
+    def test_result_cache(self):
+        session = self.create_session(execution="serial")
+        with mock.patch("megago.session.RESULT_CACHE_SIZE", 2):
+            first = session.compare_domain(["GO:0000002", "GO:0000004"], ["GO:0000005"])
+            # Results are cached by the multiset of terms of both samples, independent of their order.
+            self.assertEqual(first, session.compare_domain(["GO:0000004", "GO:0000002"], ["GO:0000005"]))
+            self.assertEqual(1, session.statistics()["cache_hits"])
+            session.compare_domain(["GO:0000003"], ["GO:0000005"])
+            session.compare_domain(["GO:0000004"], ["GO:0000005"])
+            # The least recently used result has been evicted.
+            self.assertEqual(2, session.statistics()["cache_entries"])
+            session.compare_domain(["GO:0000002", "GO:0000004"], ["GO:0000005"])
+            self.assertEqual(1, session.statistics()["cache_hits"])
+            self.assertEqual(4, session.statistics()["cache_misses"])
+
+    def test_worker_processes_use_the_same_dag(self):
+        fd, path = tempfile.mkstemp(suffix=".obo")
+        with os.fdopen(fd, "w") as f:
+            f.write(TEST_OBO)
+        self.addCleanup(os.remove, path)
+        terms1, terms2 = ["GO:0000002", "GO:0000004"], ["GO:0000003", "GO:0000005"]
+        expected = self.create_session(similarity_method="wang", execution="serial").compare_domain(terms1, terms2)
+        with Session(go_dag_path=path, similarity_method="wang", execution="processes", workers=2,
+                     term_counts=self.term_counts, highest_ic_anc=self.highest_ic) as session:
+            self.assertEqual(expected, session.compare_domain(terms1, terms2))
+        # Processes cannot load a GO DAG without its file.
+        session = self.create_session(similarity_method="wang")
+        with mock.patch.dict(os.environ, {"MEGAGO_EXECUTION": "processes"}):
+            self.assertEqual("threads", session._execution_mode())
+        with self.assertRaises(ValueError):
+            session.compare_domain(terms1, terms2, execution="processes")
+
+    def test_slim_per_comparison(self):
+        sample1, sample2, slim = ["GO:0000005", "GO:0000003"], ["GO:0000004"], ["GO:0000001", "GO:0000002"]
+        expected = self.create_session(execution="serial", reduction="slim", slim_terms=slim).compare(sample1, sample2)
+        session = self.create_session(execution="serial")
+        self.assertEqual(expected, session.compare(sample1, sample2, reduction="slim", slim_terms=slim))
+        # The GO slim of one comparison doesn't leak into the session.
+        self.assertIsNone(session.slim_terms)
+
+    def test_close(self):
+        session = self.create_session(execution="threads", workers=2)
+        session.compare(["GO:0000002", "GO:0000004"], ["GO:0000003", "GO:0000005"])
+        executor = session._executors["threads"]
+        session.close()
+        self.assertEqual({}, session._executors)
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+        with self.assertRaises(RuntimeError):
+            session.compare(["GO:0000002"], ["GO:0000003"])
+
+    def test_domains(self):
+        session = self.create_session(domains="bp,mf")
+        self.assertEqual(["biological_process", "molecular_function"], session._select_domains())
+        self.assertEqual(["molecular_function"], session._select_domains("mf"))
+        with self.assertRaises(ValueError):
+            session._select_domains("cc")
+        terms = ["GO:0000002", "GO:0000005", "GO:9999999"]
+        self.assertEqual([["GO:0000002", "GO:0000005"], [], []], session.split_per_domain(terms))
+        self.assertEqual([[], [], []], session.split_per_domain(terms, "mf"))
+        self.assertIsNone(self.create_session()._select_domains("bp,cc,mf"))
+
+    def test_compare_matches_compute_bma_metric(self):
+        sample_1 = ["GO:0000002", "GO:0000004", "GO:0000004"]
+        sample_2 = ["GO:0000003", "GO:0000005"]
+        for method in ("lin", "rel"):
+            expected = compute_bma_metric(sample_1, sample_2, self.term_counts, self.highest_ic,
+                                          similarity_method=method, go_dag=self.go_dag, execution="serial")
+            for execution in ("serial", "threads"):
+                session = self.create_session(similarity_method=method, execution=execution)
+                self.assertAlmostEqual(expected, session.compare(sample_1, sample_2)[0])
+
+
+class TestReleases(unittest.TestCase):
+    '''Unit tests for the registry of GO releases'''
+
+    def create_release(self, name):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        values = TermArray(table, [1] * len(table))
+        return Release(name, Session(go_dag=go_dag, term_counts=values, highest_ic_anc=values))
+
+    def test_hot_swap(self):
+        registry = ReleaseRegistry()
+        old = self.create_release("2020")
+        registry.register(old)
+        with registry.acquire() as release:
+            self.assertIs(old, release)
+            new = self.create_release("2021")
+            registry.register(new, default=True)
+            registry.unregister("2020")
+            # Running jobs keep their release, new jobs use the new default release.
+            self.assertFalse(old.session._closed)
+            with registry.acquire() as other:
+                self.assertIs(new, other)
+        self.assertTrue(old.session._closed)
+        self.assertEqual(["2021"], registry.names())
+
+    def test_replace(self):
+        registry = ReleaseRegistry()
+        old = self.create_release("current")
+        registry.register(old)
+        registry.register(self.create_release("current"))
+        self.assertTrue(old.session._closed)
+        with self.assertRaises(ValueError):
+            registry.unregister("current")
+        with self.assertRaises(KeyError):
+            with registry.acquire("unknown"):
+                pass
+
+
+class TestWang(unittest.TestCase):
+    '''Unit tests for the Wang similarity'''
+
+    def setUp(self):
+        self.index = WangIndex(load_test_dag())
+
+    def test_contributions(self):
+        expected = {"GO:0000005": 1, "GO:0000004": 0.8, "GO:0000002": 0.64, "GO:0000003": 0.64, "GO:0000001": 0.512}
+        contributions = self.index.contributions("GO:0000005")
+        self.assertEqual(set(expected), set(contributions))
+        for term, value in expected.items():
+            self.assertAlmostEqual(value, contributions[term])
+
+    def test_similarity(self):
+        self.assertAlmostEqual(5.832 / 6.832, self.index.similarity("GO:0000004", "GO:0000005"))
+        self.assertEqual(1.0, self.index.similarity("GO:0000002", "GO:0000002"))
+        self.assertTrue(np.isnan(self.index.similarity("GO:0000002", "GO:9999999")))
+
+    def test_similarity_matrix(self):
+        terms1 = ["GO:0000001", "GO:0000004", "GO:9999999"]
+        terms2 = ["GO:0000005", "GO:0000002", "GO:0000003"]
+        expected = [[self.index.similarity(term1, term2) for term2 in terms2] for term1 in terms1]
+        np.testing.assert_allclose(expected, self.index.similarity_matrix(terms1, terms2))
+
+    def test_cached_index_does_not_keep_dag_alive(self):
+        go_dag = load_test_dag()
+        self.assertAlmostEqual(5.832 / 6.832, get_wang_index(go_dag).similarity("GO:0000004", "GO:0000005"))
+        reference = weakref.ref(go_dag)
+        del go_dag
+        gc.collect()
+        self.assertIsNone(reference())
+
+
+class TestClustering(unittest.TestCase):
+    '''Unit tests for the redundancy clustering'''
+
+    def test_candidate_pairs(self):
+        # GO:0008150 is the root of the biological process domain, which provides the total count.
+        term_counts = {"GO:0008150": 100, "GO:0000001": 100, "GO:0000002": 50, "GO:0000003": 50, "GO:0000004": 10,
+                       "GO:0000005": 5}
+        index = AncestorIndex(load_test_dag(), term_counts)
+        terms = ["GO:0000002", "GO:0000003", "GO:0000004", "GO:0000005"]
+        # GO:0000002 and GO:0000003 only share the root, which has no information content.
+        self.assertEqual([[0, 2], [0, 3], [1, 2], [1, 3], [2, 3]], find_candidate_pairs(terms, index, {}, 0.1).tolist())
+        # Only GO:0000004 and GO:0000005 can reach a similarity of 0.85: 2 * IC(4) / (IC(4) + IC(5)) = 0.87.
+        self.assertEqual([[2, 3]], find_candidate_pairs(terms, index, {}, 0.85).tolist())
+        self.assertEqual([], find_candidate_pairs(terms, index, {}, 0.9).tolist())
+
+    def test_candidate_pairs_scale(self):
+        # 100 parents with 100 children each: all children of a parent share an informative ancestor, but the
+        # similarity of two siblings is 2 * log(100) / (2 * log(10000)) = 0.5.
+        lines = ["format-version: 1.2", "", "[Term]", "id: GO:0008150", "name: root", "namespace: biological_process"]
+        term_counts = {"GO:0008150": 10000}
+        children = []
+        for parent in range(1, 101):
+            parent_id = "GO:%07d" % parent
+            lines += ["", "[Term]", f"id: {parent_id}", "name: p", "namespace: biological_process",
+                      "is_a: GO:0008150 ! root"]
+            term_counts[parent_id] = 100
+            for child in range(100):
+                child_id = "GO:%07d" % (parent * 1000 + child)
+                lines += ["", "[Term]", f"id: {child_id}", "name: c", "namespace: biological_process",
+                          f"is_a: {parent_id} ! p"]
+                term_counts[child_id] = 1
+                children.append(child_id)
+        index = AncestorIndex(load_test_dag("\n".join(lines) + "\n"), term_counts)
+        # The bound discards all 495000 pairs of siblings without generating them one by one.
+        self.assertEqual(0, len(find_candidate_pairs(children, index, {}, 0.7)))
+        self.assertEqual(100 * 4950, len(find_candidate_pairs(children, index, {}, 0.5)))
+
+
+class TestProteins(unittest.TestCase):
+    '''Unit tests for the batched comparison of proteins'''
+
+    proteins = [
+        ["GO:0000002", "GO:0000004"],
+        ["GO:0000003", "GO:0000005", "GO:0000005"],
+        ["GO:0000009", "GO:9999999"],
+        [],
+        ["GO:0000001"]
+    ]
+
+    def test_compare_proteins(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        term_counts = TermArray(table, [10, 6, 5, 3, 1])
+        highest_ic = TermArray(table, [0.5] * len(table))
+        for backend in ("python", "numpy"):
+            with Session(go_dag=go_dag, execution="serial", term_counts=term_counts, highest_ic_anc=highest_ic,
+                         backend=backend) as session:
+                matrices = session.compare_proteins(self.proteins)
+                pairs = [(0, 1), (2, 3), (3, 3), (4, 0)]
+                listed = session.compare_proteins(self.proteins, pairs)
+                for i, protein_1 in enumerate(self.proteins):
+                    for j, protein_2 in enumerate(self.proteins):
+                        np.testing.assert_allclose(session.compare(protein_1, protein_2),
+                                                   [matrix[i, j] for matrix in matrices])
+                for k, (i, j) in enumerate(pairs):
+                    np.testing.assert_allclose([matrix[i, j] for matrix in matrices], [values[k] for values in listed])
+
+
+class TestLibrary(unittest.TestCase):
+    '''Unit tests for the reference library'''
+
+    TERMS = ["GO:0008150", "GO:0000002", "GO:0000003", "GO:0000004", "GO:0000005"]
+
+    def setUp(self):
+        # Signatures look up the information content of the standard root terms.
+        self.go_dag = load_test_dag(TEST_OBO.replace("GO:0000001", "GO:0008150"))
+        table = TermTable(self.go_dag)
+        self.term_counts = TermArray(table, [6, 5, 3, 1, 10])
+        self.session = Session(go_dag=self.go_dag, execution="serial", term_counts=self.term_counts,
+                               highest_ic_anc=TermArray(table, [0.5] * len(table)))
+        self.addCleanup(self.session.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "library.json")
+        self.library = ReferenceLibrary(self.path)
+        rng = np.random.default_rng(3)
+        for i in range(12):
+            self.library.add(f"reference {i}", list(rng.choice(self.TERMS, size=rng.integers(1, 5))), self.session)
+
+    def test_shortlist_recall(self):
+        domain = "biological_process"
+        queries = [[term1, term2] for term1 in self.TERMS for term2 in self.TERMS]
+        found = {8: 0, len(self.library): 0}
+        for query in queries:
+            exact = sorted((self.session.compare_domain(query, [term for term, count in sample["terms"][domain].items()
+                                                                for _ in range(count)])
+                            for sample in self.library.samples.values()), reverse=True)[:3]
+            for shortlist in found:
+                results = self.library.query(query, self.session, k=3, shortlist=shortlist, domains=[domain])
+                found[shortlist] += sum(np.isclose(exact, [similarity for _, similarity in results[domain]]))
+        # The exact top 3 is found if all references are shortlisted, and mostly found from two thirds of them.
+        self.assertEqual(found[len(self.library)], 3 * len(queries))
+        self.assertGreaterEqual(found[8], 0.9 * 3 * len(queries))
+
+        query = ["GO:0000004", "GO:0000005", "GO:0000005"]
+        # The sparse matrix ranks the references like the cosine similarity of their signatures.
+        signature = compute_signature(query, self.session.ancestor_index)
+        vector, norm = signature["vectors"][domain], signature["norms"][domain]
+        for name, score in self.library.rank(signature, domain):
+            reference = self.library.samples[name]
+            self.assertAlmostEqual(score, cosine_similarity(vector, norm, reference["vectors"][domain],
+                                                            reference["norms"][domain]))
+
+    def test_save_and_load(self):
+        self.library.save()
+        loaded = ReferenceLibrary(self.path)
+        self.assertEqual(self.library.fingerprint, loaded.fingerprint)
+        self.assertEqual(list(self.library.samples), list(loaded.samples))
+        query = ["GO:0000002", "GO:0000004"]
+        self.assertEqual(self.library.query(query, self.session, k=5), loaded.query(query, self.session, k=5))
+
+        # A session of another corpus is refused.
+        term_counts = TermArray(self.term_counts.table, [6, 5, 3, 1, 20])
+        other = Session(go_dag=self.go_dag, execution="serial", term_counts=term_counts,
+                        highest_ic_anc=self.session.highest_ic_anc)
+        with other, self.assertRaises(ValueError):
+            loaded.query(query, other)
+
+
+class TestPairCache(unittest.TestCase):
+    '''Unit tests for the cache of pair similarities'''
+
+    def test_get_and_put(self):
+        cache = PairCache(64 * SLOT_BYTES)
+        context = PairCache.context("lin_metric", b"corpus")
+        cache.put(context, [1, 2, 3], [4, 5, 6], [0.1, 0.2, 0.3])
+        values, found = cache.get(context, [4, 2, 3, 7], [1, 5, 6, 8])
+        np.testing.assert_array_equal(found, [True, True, True, False])
+        np.testing.assert_array_equal(values[:3], [0.1, 0.2, 0.3])
+        self.assertFalse(cache.get(PairCache.context("rel_metric", b"corpus"), [1], [4])[1].any())
+        self.assertEqual((cache.statistics()["hits"], cache.statistics()["misses"]), (3, 2))
+
+        # A full cache evicts pairs, but never returns the value of another pair.
+        indices = np.arange(1000)
+        cache.put(context, indices, indices + 1, indices / 1000)
+        values, found = cache.get(context, indices, indices + 1)
+        self.assertLessEqual(cache.statistics()["entries"], cache.slots)
+        self.assertTrue(0 < found.sum() <= cache.slots)
+        np.testing.assert_array_equal(values[found], indices[found] / 1000)
+
+    def test_session(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        term_counts = TermArray(table, [10, 6, 5, 3, 1])
+        highest_ic = TermArray(table, [0.5] * len(table))
+        sample_1 = ["GO:0000002", "GO:0000004", "GO:0000005"]
+        sample_2 = ["GO:0000003", "GO:0000005", "GO:9999999"]
+        with Session(go_dag=go_dag, execution="serial", term_counts=term_counts, highest_ic_anc=highest_ic) as session:
+            expected = session.compare(sample_1, sample_2)
+        cache = PairCache(1 << 16)
+        with Session(go_dag=go_dag, execution="serial", term_counts=term_counts, highest_ic_anc=highest_ic,
+                     backend="python", pair_cache=cache) as session:
+            self.assertEqual(session.compare(sample_1, sample_2), expected)
+            self.assertEqual(session.compare(sample_2, sample_1), expected)
+            self.assertGreater(session.statistics()["pair_cache_hits"], 0)
+
+
+class TestDomains(unittest.TestCase):
+    '''Unit tests for the selection of GO-domains'''
+
+    def test_parse_domains(self):
+        self.assertEqual(parse_domains("MF, biological_process"), ["biological_process", "molecular_function"])
+        self.assertEqual(parse_domains(["cc"]), ["cellular_component"])
+        with self.assertRaises(ValueError):
+            parse_domains("bp,unknown")
+
+    def test_partition_obo(self):
+        # GO:0000006 is part of the molecular function domain, but has a part_of relationship with a BP term.
+        obo = TEST_OBO + "\n[Term]\nid: GO:0000006\nname: e\nnamespace: molecular_function\n" \
+                         "relationship: part_of GO:0000002 ! a\n"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "go.obo")
+            with open(path, "w") as f:
+                f.write(obo)
+            self.assertEqual(partition_obo(path, "bp,cc,mf", directory), path)
+            bp = GODag(partition_obo(path, "bp", directory), prt=None)
+            self.assertNotIn("GO:0000006", bp)
+            self.assertEqual(len(set(term.id for term in bp.values())), 5)
+            mf = GODag(partition_obo(path, "mf", directory), optional_attrs={'relationship'}, prt=None)
+            self.assertEqual(sorted(set(term.id for term in mf.values())), ["GO:0000001", "GO:0000002", "GO:0000006"])
+
+    def test_session(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        term_counts = TermArray(table, [10, 6, 5, 3, 1])
+        highest_ic = TermArray(table, [0.5] * len(table))
+        sample_1 = ["GO:0000002", "GO:0000004"]
+        sample_2 = ["GO:0000003", "GO:0000005"]
+        with Session(go_dag=go_dag, execution="serial", term_counts=term_counts, highest_ic_anc=highest_ic) as session:
+            expected = session.compare(sample_1, sample_2)[0]
+            result = session.compare(sample_1, sample_2, domains="bp")
+        self.assertEqual(result[0], expected)
+        self.assertTrue(np.isnan(result[1]) and np.isnan(result[2]))
+        with Session(go_dag=go_dag, execution="serial", term_counts=term_counts, highest_ic_anc=highest_ic,
+                     domains="bp") as session:
+            self.assertEqual(session.compare(sample_1, sample_2)[0], expected)
+            with self.assertRaises(ValueError):
+                session.compare(sample_1, sample_2, domains="mf")
+
+
+class TestValidation(unittest.TestCase):
+    '''Unit tests for the validation harness'''
+
+    def setUp(self):
+        # The goatools path looks up the standard root terms.
+        fd, path = tempfile.mkstemp(suffix=".obo")
+        with os.fdopen(fd, "w") as f:
+            f.write(TEST_OBO.replace("GO:0000001", "GO:0008150"))
+        try:
+            self.go_dag = GODag(path, prt=None)
+        finally:
+            os.remove(path)
+        table = TermTable(self.go_dag)
+        term_counts = TermArray(table, [6, 5, 3, 1, 10])
+        # All terms occur in the corpus, so none of them falls back to the information content of an ancestor.
+        highest_ic = TermArray(table, [0.0] * len(table))
+        self.arguments = (self.go_dag, term_counts, highest_ic, "rel")
+        self.pairs = random_pairs(self.go_dag, amount=5, max_terms=4, seed=1)
+
+    def test_engines_match_oracle(self):
+        oracle = GoatoolsEngine(*self.arguments)
+        for engine in (PythonEngine(*self.arguments), NumpyEngine(*self.arguments)):
+            for result in validate(engine, oracle, self.pairs):
+                self.assertGreater(result.compared, 0)
+                self.assertEqual([], result.mismatches)
+                self.assertEqual(0, result.max_absolute)
+
+    def test_mismatches(self):
+        class ShiftedEngine(PythonEngine):
+            def similarities(self, terms1, terms2):
+                return super().similarities(terms1, terms2) + 0.1
+
+        term_pairs = validate(ShiftedEngine(*self.arguments), GoatoolsEngine(*self.arguments), self.pairs)[0]
+        self.assertGreater(len(term_pairs.mismatches), 0)
+        self.assertAlmostEqual(0.1, term_pairs.max_absolute)
+
+
+class TestSignificance(unittest.TestCase):
+    '''Unit tests for the significance of similarities'''
+
+    matrix = np.array([
+        [1.0, 0.5, 0.1],
+        [0.5, 1.0, 0.2],
+        [0.1, 0.2, 1.0]
+    ])
+
+    def test_bma_from_matrix(self):
+        # best matches: 0 -> 0.5, 0 -> 0.5, 1 -> 0.5 and 2 -> 0.1
+        self.assertAlmostEqual((0.5 + 0.5 + 0.5 + 0.1) / 4, bma_from_matrix(self.matrix, [0, 0], [1, 2]))
+        self.assertTrue(np.isnan(bma_from_matrix(self.matrix, [0], [])))
+
+    def test_identical_samples(self):
+        result = assess_significance(self.matrix, [0, 1, 2], [0, 1, 2], permutations=99, bootstraps=99, seed=1)
+        self.assertEqual(1.0, result.similarity)
+        self.assertLessEqual(result.ci_low, result.ci_high)
+
+    def test_direction(self):
+        # Terms 2k and 2k + 1 are similar, all other pairs of different terms are not.
+        matrix = np.full((16, 16), 0.1)
+        for k in range(0, 16, 2):
+            matrix[k, k + 1] = matrix[k + 1, k] = 0.9
+        np.fill_diagonal(matrix, 1.0)
+        # Every term has a similar term in the other sample, which is rare for a random division of these terms.
+        similar = assess_significance(matrix, range(0, 16, 2), range(1, 16, 2), permutations=199, bootstraps=0, seed=1)
+        self.assertLess(similar.p_value, 0.05)
+        # No term has a similar term in the other sample, no permutation is less similar.
+        dissimilar = assess_significance(matrix, range(8), range(8, 16), permutations=199, bootstraps=0, seed=1)
+        self.assertEqual(1.0, dissimilar.p_value)
+
+    def test_similarity_matrix(self):
+        go_dag = load_test_dag()
+        table = TermTable(go_dag)
+        term_counts, highest_ic = TermArray(table, [10, 6, 5, 3, 1]), TermArray(table, [0.5] * len(table))
+        terms = ["GO:0000001", "GO:0000002", "GO:0000003", "GO:0000004", "GO:0000005"]
+
+        def matrix(chunk_size, tile_size):
+            plan = plan_execution(len(terms), len(terms), mode="serial", chunk_size=chunk_size, tile_size=tile_size)
+            return compute_similarity_matrix(terms, term_counts, highest_ic, "lin", go_dag, plan)
+
+        # Tiles that cross the diagonal fill in the lower half of the matrix as well.
+        tiled = matrix(2, 3)
+        np.testing.assert_array_equal(matrix(5, 5), tiled)
+        np.testing.assert_array_equal(tiled, tiled.T)
+        # 5 terms require 200 bytes.
+        with self.assertRaises(ValueError):
+            compute_similarity_matrix(terms, term_counts, highest_ic, "lin", go_dag, max_size=199 / MIB)
+
+    def test_reproducible(self):
+        first = assess_significance(self.matrix, [0, 0, 1], [2, 1], permutations=50, bootstraps=50, seed=7, workers=2)
+        second = assess_significance(self.matrix, [0, 0, 1], [2, 1], permutations=50, bootstraps=50, seed=7, workers=1)
+        self.assertEqual((first.p_value, first.ci_low, first.ci_high), (second.p_value, second.ci_low, second.ci_high))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,15 +1,89 @@
-import math
 import concurrent.futures
+import hashlib
+import math
 import os
+import weakref
+
+import numpy as np
 
-from goatools.obo_parser import GODag
-from goatools.semantic import deepest_common_ancestor
-from goatools.gosubdag.gosubdag import GoSubDag
+from .constants import NAN_VALUE, GO_DAG_FILE_PATH, GO_DOMAINS
+from .execution import NUMPY, PROCESSES, plan_execution, create_executor, map_bounded
+from .ontology import AncestorIndex, TermArray, WangIndex
+from .progress import write_progress
 
-from .constants import NAN_VALUE, GO_DAG_FILE_PATH
+# The GO DAG and corpus tables that are used by the tasks that are executed in a worker process. These are initialised
+# once per worker by _init_worker, instead of being sent along with every task.
+_WORKER_CONTEXT = None
+# Shared-memory progress counters of the session that started the worker process (see megago.progress).
+_WORKER_PROGRESS = None
+# Pair cache of the session that started the worker process (see megago.pair_cache).
+_WORKER_PAIR_CACHE = None
 
-PROCESSES = 6
-CHUNK_SIZE = 50
+# (weak reference to the GODag, WangIndex) of every GODag that wang_metric has been used with (keyed by id, since a
+# GODag is not hashable).
+_WANG_INDICES = dict()
+
+# CorpusTables of every pair of term counts and highest_ic values that has been used (keyed by their ids).
+_CORPUS_TABLES = dict()
+
+
+class CorpusTables(object):
+    """Information content of every term of a TermTable, derived from the term counts and highest_ic values once, such
+    that the lin and rel metrics only need to look up values by term index. The values are kept in lists, since
+    indexing these is faster than indexing numpy arrays for single elements.
+
+    Attributes
+    ----------
+    table : TermTable
+    frequency : list
+        relative frequency of every term in its namespace (see get_frequency)
+    info_content : list
+        information content of every term (see get_info_content)
+    effective_info_content : list
+        information content of every term, or the information content of its most informative ancestor if it's 0
+    frequency_array, info_content_array, effective_info_content_array : numpy.ndarray
+        the same values as arrays, for the vectorised metrics (see lin_index_matrix)
+    fingerprint : bytes
+        digest of the ontology and of all values, which identifies the corpus in a megago.pair_cache.PairCache
+    """
+
+    def __init__(self, term_counts, highest_ic_anc):
+        self.table = term_counts.table
+        counts = term_counts.values
+        root_counts = np.array([self._root_count(term_counts, domain) for domain in GO_DOMAINS])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frequency = counts / root_counts[self.table.namespaces]
+            info_content = np.where(frequency > 0, -np.log(frequency), 0.0)
+        highest_ic = TermArray.from_numbers(self.table, highest_ic_anc.table.numbers, highest_ic_anc.values).values
+        self.frequency_array = frequency
+        self.info_content_array = info_content
+        self.effective_info_content_array = np.where(info_content == 0, highest_ic, info_content)
+        self.frequency = frequency.tolist()
+        self.info_content = info_content.tolist()
+        self.effective_info_content = self.effective_info_content_array.tolist()
+        digest = hashlib.blake2b(self.table.fingerprint(), digest_size=16)
+        for array in (frequency, info_content, self.effective_info_content_array):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        self.fingerprint = digest.digest()
+
+    def _root_count(self, term_counts, domain):
+        """Count of the root term of a domain. Ontologies without the standard root terms (e.g. a subset of the Gene
+        Ontology) use the term of that domain with depth 0 instead."""
+        root = self.table.index(AncestorIndex.ROOTS[domain])
+        if root < 0:
+            roots = np.flatnonzero((self.table.namespaces == GO_DOMAINS.index(domain)) & (self.table.depths == 0))
+            root = roots[0] if len(roots) > 0 else -1
+        return term_counts.values[root] if root >= 0 else np.nan
+
+
+def get_corpus_tables(term_counts, highest_ic_anc):
+    """Returns the CorpusTables of the given TermArrays, which are computed the first time they're requested."""
+    key = (id(term_counts), id(highest_ic_anc))
+    tables = _CORPUS_TABLES.get(key)
+    if tables is None:
+        tables = _CORPUS_TABLES[key] = CorpusTables(term_counts, highest_ic_anc)
+        weakref.finalize(term_counts, _CORPUS_TABLES.pop, key, None)
+    return tables
 
 
 def get_frequency(go_id, term_counts, go_dag):
@@ -22,7 +96,7 @@ def get_frequency(go_id, term_counts, go_dag):
     ----------
     go_id : str
         gene ontology ID that the relative frequency should be calculated for
-    term_counts : dict
+    term_counts : dict or TermArray
         dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
     go_dag : GODag object
         GODag object from the goatools package
@@ -52,7 +126,7 @@ def get_info_content(go_id, term_counts, go_dag):
     ----------
     go_id : str
         gene ontology ID that the relative frequency should be calculated for
-    term_counts : dict
+    term_counts : dict or TermArray
         dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
     go_dag : GODag object
         GODag object from the goatools package
@@ -77,7 +151,7 @@ def get_ic_of_most_informative_ancestor(id, term_counts, go_dag):
     ----------
     go_id : str
         GO term
-    term_counts : dict
+    term_counts : dict or TermArray
         dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
     go_dag : GODag object
         GODag object from the goatools package
@@ -90,6 +164,8 @@ def get_ic_of_most_informative_ancestor(id, term_counts, go_dag):
     """
     if term_counts.get(id, 0) > 0:
         return 0
+    from goatools.gosubdag.gosubdag import GoSubDag
+
     gosubdag_r0 = GoSubDag([id], go_dag, prt=None)
     if id in gosubdag_r0.rcntobj.go2ancestors:
         P = gosubdag_r0.rcntobj.go2ancestors[id]
@@ -104,9 +180,78 @@ def get_ic_of_most_informative_ancestor(id, term_counts, go_dag):
 
 
 def get_deepest_common_ancestor(id1, id2, go_dag):
+    from goatools.semantic import deepest_common_ancestor
+
     return deepest_common_ancestor([id1, id2], go_dag)
 
 
+def lin_index_metric(index1, index2, tables):
+    """lin_metric for two terms that are identified by their index in tables.table (-1 for unknown terms)."""
+    table = tables.table
+    if index1 < 0 or index2 < 0 or table.namespaces[index1] != table.namespaces[index2]:
+        return NAN_VALUE
+    denominator = tables.effective_info_content[index1] + tables.effective_info_content[index2]
+    if denominator == 0:
+        return 0
+    lca = table.deepest_common_ancestor(index1, index2)
+    if lca < 0:
+        return NAN_VALUE
+    return (2 * tables.info_content[lca]) / denominator
+
+
+def rel_index_metric(index1, index2, tables):
+    """rel_metric for two terms that are identified by their index in tables.table (-1 for unknown terms)."""
+    table = tables.table
+    if index1 < 0 or index2 < 0 or table.namespaces[index1] != table.namespaces[index2]:
+        return NAN_VALUE
+    denominator = tables.effective_info_content[index1] + tables.effective_info_content[index2]
+    if denominator == 0:
+        return 0
+    lca = table.deepest_common_ancestor(index1, index2)
+    if lca < 0:
+        return NAN_VALUE
+    return (2 * tables.info_content[lca] * (1 - tables.frequency[lca])) / denominator
+
+
+def _index_matrix(indices1, indices2, tables, numerator):
+    """Evaluate a metric of the form numerator(lca) / (IC(c1) + IC(c2)) for all pairs of terms at once, with the same
+    special cases as lin_index_metric and rel_index_metric."""
+    table = tables.table
+    indices1 = np.asarray(indices1)
+    indices2 = np.asarray(indices2)
+    output = np.full((len(indices1), len(indices2)), NAN_VALUE)
+    valid1 = indices1 >= 0
+    valid2 = indices2 >= 0
+    rows = indices1[valid1]
+    cols = indices2[valid2]
+    if len(rows) == 0 or len(cols) == 0:
+        return output
+
+    lca = table.deepest_common_ancestors(rows, cols)
+    denominator = tables.effective_info_content_array[rows][:, None] + tables.effective_info_content_array[cols]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(lca >= 0, numerator(lca) / denominator, NAN_VALUE)
+    values = np.where(denominator == 0, 0.0, values)
+    values = np.where(table.namespaces[rows][:, None] == table.namespaces[cols], values, NAN_VALUE)
+    output[np.ix_(valid1, valid2)] = values
+    return output
+
+
+def lin_index_matrix(indices1, indices2, tables):
+    """lin_index_metric for every pair of terms of indices1 and indices2, as a len(indices1) x len(indices2) array."""
+    return _index_matrix(indices1, indices2, tables, lambda lca: 2 * tables.info_content_array[lca])
+
+
+def rel_index_matrix(indices1, indices2, tables):
+    """rel_index_metric for every pair of terms of indices1 and indices2, as a len(indices1) x len(indices2) array."""
+    return _index_matrix(indices1, indices2, tables,
+                         lambda lca: 2 * tables.info_content_array[lca] * (1 - tables.frequency_array[lca]))
+
+
+def _use_term_tables(term_counts, highest_ic_anc):
+    return isinstance(term_counts, TermArray) and isinstance(highest_ic_anc, TermArray)
+
+
 def rel_metric(c1, c2, go_dag, term_counts, highest_ic_anc):
     """calculate semantic similarity of the GO terms id1 and id2 using the rel metric
 
@@ -125,7 +270,7 @@ def rel_metric(c1, c2, go_dag, term_counts, highest_ic_anc):
         GO term
     go_dag : GODag object
         GODag object from the goatools package
-    term_counts : dict
+    term_counts : dict or TermArray
         dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
 
     Returns
@@ -135,6 +280,9 @@ def rel_metric(c1, c2, go_dag, term_counts, highest_ic_anc):
         else: rel metric
 
     """
+    if _use_term_tables(term_counts, highest_ic_anc):
+        table = term_counts.table
+        return rel_index_metric(table.index(c1), table.index(c2), get_corpus_tables(term_counts, highest_ic_anc))
 
     if (c1 not in go_dag) or (c2 not in go_dag):
         return NAN_VALUE
@@ -176,7 +324,7 @@ def lin_metric(c1, c2, go_dag, term_counts, highest_ic_anc):
         GO term
     go_dag : GODag object
         GODag object from the goatools package
-    term_counts : dict
+    term_counts : dict or TermArray
         dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
 
     Returns
@@ -186,6 +334,10 @@ def lin_metric(c1, c2, go_dag, term_counts, highest_ic_anc):
         else: rel metric
 
     """
+    if _use_term_tables(term_counts, highest_ic_anc):
+        table = term_counts.table
+        return lin_index_metric(table.index(c1), table.index(c2), get_corpus_tables(term_counts, highest_ic_anc))
+
     if (c1 not in go_dag) or (c2 not in go_dag):
         return NAN_VALUE
 
@@ -207,19 +359,255 @@ def lin_metric(c1, c2, go_dag, term_counts, highest_ic_anc):
         return NAN_VALUE
 
 
-def compute_similarity_method(params):
-    (go_list1, go_list2, term_counts, go_dag_path, highest_ic_anc, similarity_method) = params
-    go_dag = GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
-    result = dict()
+def get_wang_index(go_dag):
+    """Returns the WangIndex of go_dag, which is created the first time it's requested and lives as long as go_dag. The
+    index only refers to go_dag through a weak proxy, such that it doesn't keep go_dag (e.g. of a release that has
+    been unloaded) alive."""
+    key = id(go_dag)
+    entry = _WANG_INDICES.get(key)
+    if entry is None or entry[0]() is not go_dag:
+        entry = _WANG_INDICES[key] = (weakref.ref(go_dag), WangIndex(weakref.proxy(go_dag)))
+        weakref.finalize(go_dag, _WANG_INDICES.pop, key, None)
+    return entry[1]
+
+
+def wang_metric(c1, c2, go_dag, term_counts=None, highest_ic_anc=None):
+    """calculate semantic similarity of the GO terms id1 and id2 using the graph based metric of Wang et al.
+
+    Formula of the metric: sum(S_c1(t) + S_c2(t) for t in common ancestors) / (SV(c1) + SV(c2))
+    where S_c(t) is the semantic contribution of ancestor t to c (the highest product of edge weights on a path from c
+    to t, with weights 0.8 for is_a and 0.6 for part_of) and SV(c) is the sum of the contributions of all ancestors of c.
+    Metric is implemented according to: Wang, J.Z., Du, Z., Payattakool, R., Yu, P.S., Chen, C.F. A new method to
+    measure the semantic similarity of GO terms. Bioinformatics 23, 1274-1281 (2007) doi:10.1093/bioinformatics/btm087
+
+    The metric does not depend on a corpus, term_counts and highest_ic_anc are only accepted to have the same signature
+    as lin_metric and rel_metric.
+
+    Parameters
+    ----------
+    c1 : str
+        GO term
+    c2 : str
+        GO term
+    go_dag : GODag object
+        GODag object from the goatools package, loaded with optional_attrs={"relationship"} to take part_of relations
+        into account
+
+    Returns
+    -------
+    float
+        if go_id1 and go_id2 are from different GO namespaces or either of them misses in the go_dag: NAN_VALUE
+        else: wang metric
+
+    """
+    return get_wang_index(go_dag).similarity(c1, c2)
 
-    for id1 in go_list1:
-        for id2 in go_list2:
-            key = (id1, id2) if id1 < id2 else (id2, id1)
-            result[key] = similarity_method(id1, id2, go_dag, term_counts, highest_ic_anc)
-    return result
 
+SIMILARITY_METHODS = {
+    "lin": lin_metric,
+    "rel": rel_metric,
+    "wang": wang_metric
+}
 
-def compute_bma_metric(go_list1, go_list2, term_counts, highest_ic_anc, progress_listener=None, similarity_method="rel"):
+# Variants of the similarity methods that compare terms by their index in a TermTable.
+INDEX_METRICS = {
+    lin_metric: lin_index_metric,
+    rel_metric: rel_index_metric
+}
+
+# Vectorised variants of the index metrics, which are used by the numpy backend.
+INDEX_MATRIX_METRICS = {
+    lin_metric: lin_index_matrix,
+    rel_metric: rel_index_matrix
+}
+
+
+def cached_index_similarities(indices1, indices2, tables, similarity_method, pair_cache, row_callback=None):
+    """Similarity of every pair of terms of indices1 and indices2 (indices in tables.table, -1 for unknown terms) with
+    lin_metric or rel_metric, as a len(indices1) x len(indices2) array. Pairs that are found in the pair cache are not
+    recomputed, all other pairs are computed by the index metric and are added to the cache. All pairs are looked up at
+    once, since the overhead of a lookup is much larger than its cost per pair.
+
+    row_callback is called after the missing pairs of every known term of indices1 have been computed.
+
+    The numpy backend doesn't use the cache: its kernel computes a pair faster than the pair can be fetched from a table
+    that doesn't fit in the CPU caches.
+    """
+    index_metric = INDEX_METRICS[similarity_method]
+    indices1 = np.asarray(indices1)
+    indices2 = np.asarray(indices2)
+    output = np.full((len(indices1), len(indices2)), NAN_VALUE)
+    valid1 = indices1 >= 0
+    valid2 = indices2 >= 0
+    rows = indices1[valid1]
+    cols = indices2[valid2]
+    if len(rows) == 0 or len(cols) == 0:
+        return output
+
+    context = pair_cache.context(similarity_method.__name__, tables.fingerprint)
+    values, found = pair_cache.get(context, rows[:, None], cols[None, :])
+    # The missing pairs, in row-major order.
+    missing = np.nonzero(~found)
+    missing_rows = rows[missing[0]]
+    missing_cols = cols[missing[1]]
+    computed = np.empty(len(missing_rows))
+    bounds = np.searchsorted(missing[0], np.arange(len(rows) + 1)).tolist()
+    indices = list(zip(missing_rows.tolist(), missing_cols.tolist()))
+    for row in range(len(rows)):
+        for k in range(bounds[row], bounds[row + 1]):
+            computed[k] = index_metric(indices[k][0], indices[k][1], tables)
+        if row_callback is not None:
+            row_callback()
+    if len(computed) > 0:
+        values[missing] = computed
+        pair_cache.put(context, missing_rows, missing_cols, computed)
+    output[np.ix_(valid1, valid2)] = values
+    return output
+
+
+def _init_worker(go_dag_path, term_counts, highest_ic_anc, progress_counters=None, pair_cache=None):
+    from goatools.obo_parser import GODag
+
+    global _WORKER_CONTEXT, _WORKER_PROGRESS, _WORKER_PAIR_CACHE
+    _WORKER_CONTEXT = (GODag(go_dag_path, optional_attrs={'relationship'}, prt=open(os.devnull, 'w')), term_counts,
+                       highest_ic_anc)
+    _WORKER_PROGRESS = progress_counters
+    _WORKER_PAIR_CACHE = pair_cache
+
+
+def compute_similarity_method(go_list1, go_list2, go_dag, term_counts, highest_ic_anc, similarity_method,
+                              cancel_event=None, counters=None, slot=-1, backend=None, pair_cache=None):
+    """compute the similarity of every pair of terms in a chunk and reduce the values to row and column maxima
+
+    Only the best match of each row and column leaves the worker, so the amount of data that is sent back to the
+    parent process grows with len(go_list1) + len(go_list2) instead of with the number of compared pairs.
+
+    Parameters
+    ----------
+    go_list1 : list
+        list, containing go term strings (the rows of this chunk)
+    go_list2 : list
+        list, containing go term strings (the columns of this chunk)
+    go_dag : GODag object
+        GODag object from the goatools package
+    term_counts : dict or TermArray
+        dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
+    highest_ic_anc : dict or TermArray
+        dictionary: key: GO terms, values: information content of the ancestor with the highest information content
+    similarity_method : function
+        lin_metric, rel_metric or wang_metric. The similarities of wang_metric are computed in one batch by its
+        WangIndex.
+    cancel_event : threading.Event, optional
+        checked before every row, a concurrent.futures.CancelledError is raised once it has been set.
+    counters : multiprocessing.RawArray, optional
+        shared-memory progress counters (see megago.progress.ProgressCounters)
+    slot : int
+        token of the counter of this chunk (see megago.progress.ProgressCounters.acquire), which is set to the amount
+        of compared pairs after every row. Progress is not reported if it's negative.
+    backend : str, optional
+        'numpy' computes the lin and rel similarities of the complete chunk with array operations that release the GIL
+        (see megago.execution.BACKENDS). Python loops are used otherwise.
+    pair_cache : PairCache, optional
+        the lin and rel similarities of the Python kernel that are found in this cache are not recomputed, all other
+        pairs are added to it (see megago.pair_cache)
+
+    Returns
+    -------
+    tuple
+        (row_max, col_max) lists with the highest similarity value for each term in go_list1 and go_list2. NaN values
+        are ignored, a row or column without any valid similarity value will have a maximum of 0.
+    """
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise concurrent.futures.CancelledError()
+
+    compared = 0
+
+    def report(pairs):
+        nonlocal compared
+        if counters is not None:
+            compared += pairs
+            write_progress(counters, slot, compared)
+
+    if similarity_method is wang_metric:
+        if not go_list1 or not go_list2:
+            return [0.0] * len(go_list1), [0.0] * len(go_list2)
+        matrix = get_wang_index(go_dag).similarity_matrix(go_list1, go_list2)
+        matrix[np.isnan(matrix)] = 0.0
+        report(matrix.size)
+        return matrix.max(axis=1).tolist(), matrix.max(axis=0).tolist()
+
+    row_max = [0.0] * len(go_list1)
+    col_max = [0.0] * len(go_list2)
+
+    matrix_metric = INDEX_MATRIX_METRICS.get(similarity_method)
+    if backend == NUMPY and matrix_metric is not None and _use_term_tables(term_counts, highest_ic_anc):
+        check_cancelled()
+        if not go_list1 or not go_list2:
+            return row_max, col_max
+        tables = get_corpus_tables(term_counts, highest_ic_anc)
+        matrix = matrix_metric(tables.table.indices(go_list1), tables.table.indices(go_list2), tables)
+        matrix[np.isnan(matrix)] = 0.0
+        report(matrix.size)
+        return matrix.max(axis=1, initial=0.0).tolist(), matrix.max(axis=0, initial=0.0).tolist()
+
+    index_metric = INDEX_METRICS.get(similarity_method)
+    if index_metric is not None and _use_term_tables(term_counts, highest_ic_anc):
+        # The identifiers are parsed once per chunk, all comparisons only use term indices.
+        tables = get_corpus_tables(term_counts, highest_ic_anc)
+        if pair_cache is not None:
+            def row_done():
+                report(len(go_list2))
+                check_cancelled()
+
+            check_cancelled()
+            matrix = cached_index_similarities(tables.table.indices(go_list1), tables.table.indices(go_list2), tables,
+                                               similarity_method, pair_cache, row_done)
+            matrix[np.isnan(matrix)] = 0.0
+            return matrix.max(axis=1, initial=0.0).tolist(), matrix.max(axis=0, initial=0.0).tolist()
+
+        indices2 = tables.table.indices(go_list2).tolist()
+        for i, index1 in enumerate(tables.table.indices(go_list1).tolist()):
+            check_cancelled()
+            for j, index2 in enumerate(indices2):
+                value = index_metric(index1, index2, tables)
+                if value > row_max[i]:
+                    row_max[i] = value
+                if value > col_max[j]:
+                    col_max[j] = value
+            report(len(indices2))
+        return row_max, col_max
+
+    for i, id1 in enumerate(go_list1):
+        check_cancelled()
+        for j, id2 in enumerate(go_list2):
+            value = similarity_method(id1, id2, go_dag, term_counts, highest_ic_anc)
+            if value > row_max[i]:
+                row_max[i] = value
+            if value > col_max[j]:
+                col_max[j] = value
+        report(len(go_list2))
+    return row_max, col_max
+
+
+def _compute_similarity_task(params):
+    """Entry point for one chunk of work. The context (GO DAG, term counts and highest ic values) is None for tasks
+    that are executed by a process pool, these use the context that has been set up by _init_worker. The cancel event is
+    None for these tasks as well, since it cannot be shared with other processes. The same holds for the progress
+    counters and the pair cache: only the token of the slot of the task is sent along."""
+    (go_list1, go_list2, context, similarity_method, cancel_event, counters, slot, backend, pair_cache) = params
+    if context is None:
+        context = _WORKER_CONTEXT
+        counters = _WORKER_PROGRESS
+        pair_cache = _WORKER_PAIR_CACHE
+    go_dag, term_counts, highest_ic_anc = context
+    return compute_similarity_method(go_list1, go_list2, go_dag, term_counts, highest_ic_anc, similarity_method,
+                                     cancel_event, counters, slot, backend, pair_cache)
+
+
+def compute_bma_metric(go_list1, go_list2, term_counts, highest_ic_anc, progress_listener=None, similarity_method="rel",
+                       go_dag=None, execution=None, workers=None, chunk_size=None, tile_size=None, plan=None,
+                       executor=None, cancel_event=None, progress_tracker=None, backend=None, pair_cache=None):
     """calculate the best match average similarity of the two provided sets of go terms
 
     For each GO term in go_list1, the similarity value of the most similar term from go_list2 is picked. The sum of
@@ -227,75 +615,164 @@ def compute_bma_metric(go_list1, go_list2, term_counts, highest_ic_anc, progress
     is implemented according to: Schlicker, A., Domingues, F.S., Rahnenführer, J. et al. A new measure for functional
     similarity of gene products based on Gene Ontology. BMC Bioinformatics 7, 302 (2006) doi:10.1186/1471-2105-7-302
 
+    The similarity matrix is never kept in memory. It is computed in tiles of chunk_size * tile_size pairs that are
+    reduced to their row and column maxima as soon as they have been computed. Only a bounded amount of tiles is in
+    flight at the same time, so that the memory usage is O(len(go_list1) + len(go_list2) + tile).
+
     Parameters
     ----------
     go_list1 : iterable
         iterable, containing go term strings
     go_list2 : iterable
         iterable, containing go term strings
-    term_counts : dict
+    term_counts : dict or TermArray
         dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
-    highest_ic_anc : dict
+    highest_ic_anc : dict or TermArray
         dictionary: key: GO terms, values: information content of the ancestor with the highest information content
     progress_listener: function (number) => void
         is called with comparisons that currently have been performed
     similarity_method : string
-        choose between lin and rel metric. 'lin' -> lin_metric, 'rel' -> rel_metric
+        choose between lin, rel and wang metric. 'lin' -> lin_metric, 'rel' -> rel_metric, 'wang' -> wang_metric
+    go_dag : GODag object, optional
+        GODag object from the goatools package, used when the computation is not executed by a process pool. The
+        default GO DAG is loaded if required and not given.
+    execution : string, optional
+        one of 'serial', 'threads' or 'processes'. Chosen by the execution planner if not given.
+    workers : int, optional
+        amount of threads or processes that should be used. Chosen by the execution planner if not given.
+    chunk_size : int, optional
+        amount of terms from go_list1 that are processed per task. Chosen by the execution planner if not given.
+    tile_size : int, optional
+        maximum amount of terms from go_list2 that are processed per task.
+    plan : ExecutionPlan, optional
+        the plan that should be followed. If given, execution, workers, chunk_size, tile_size and backend are ignored.
+    executor : concurrent.futures.Executor, optional
+        an executor that matches the mode of the given plan and that should be used instead of a new one. Process pools
+        should have been initialised with _init_worker. The executor is not shut down afterwards.
+    cancel_event : threading.Event, optional
+        setting this event cancels the computation: tiles that have not been started yet are dropped, tiles that are
+        computed by threads stop before their next row and a concurrent.futures.CancelledError is raised.
+    progress_tracker : ProgressTracker, optional
+        records the progress of every tile while it's being computed (see megago.progress). Process pools should have
+        been initialised with the counters of the tracker. progress_listener is not called if a tracker is given.
+    backend : string, optional
+        'python' or 'numpy' (see megago.execution.BACKENDS). Chosen by the execution planner if not given.
+    pair_cache : PairCache, optional
+        cache of the similarities of pairs of terms that is shared with other comparisons (see megago.pair_cache).
+        Process pools should have been initialised with the same cache.
 
     Returns
     -------
     float
 
     """
+    best_match1, best_match2 = compute_best_matches(go_list1, go_list2, term_counts, highest_ic_anc, progress_listener,
+                                                    similarity_method, go_dag, execution, workers, chunk_size,
+                                                    tile_size, plan, executor, cancel_event, progress_tracker,
+                                                    backend, pair_cache)
+    return bma_from_best_matches(go_list1, go_list2, best_match1, best_match2)
 
-    unique_list1 = list(set(go_list1))
-    unique_list2 = list(set(go_list2))
 
-    # Store the results of the similarity method in this dictionary
-    sim_method_dict = dict()
+def compute_best_matches(go_list1, go_list2, term_counts, highest_ic_anc, progress_listener=None,
+                         similarity_method="rel", go_dag=None, execution=None, workers=None, chunk_size=None,
+                         tile_size=None, plan=None, executor=None, cancel_event=None, progress_tracker=None,
+                         backend=None, pair_cache=None):
+    """find the highest similarity of every term in go_list1 with any term of go_list2, and vice versa
 
-    amount_of_chunks = math.ceil(len(unique_list1) / CHUNK_SIZE)
+    See compute_bma_metric for a description of the parameters.
 
-    sim_func = None
-    if similarity_method == "lin":
-        sim_func = lin_metric
-    elif similarity_method == "rel":
-        sim_func = rel_metric
-    else:
-        raise AttributeError(f"similarity_method must be in ['lin', 'rel'] but is {similarity_method}")
+    Returns
+    -------
+    tuple
+        (best_match1, best_match2) dictionaries that map every unique term of go_list1 (resp. go_list2) onto its best
+        match. A term without any valid similarity value has a best match of 0.
+    """
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=PROCESSES) as executor:
-        chunks = []
-        for process in range(amount_of_chunks):
-            if process == amount_of_chunks - 1:
-                chunks.append((unique_list1[CHUNK_SIZE * process:], unique_list2, term_counts, GO_DAG_FILE_PATH, highest_ic_anc, sim_func))
-            else:
-                chunks.append((unique_list1[CHUNK_SIZE * process: CHUNK_SIZE * (process + 1)], unique_list2, term_counts, GO_DAG_FILE_PATH, highest_ic_anc, sim_func))
-        for result in executor.map(compute_similarity_method, chunks):
-            progress_listener(len(result))
-            sim_method_dict.update(result)
+    unique_list1 = list(set(go_list1))
+    unique_list2 = list(set(go_list2))
 
+    # Best match of every unique term from go_list1 and go_list2. These are updated in place as tiles are completed.
+    row_max = [0.0] * len(unique_list1)
+    col_max = [0.0] * len(unique_list2)
+
+    sim_func = SIMILARITY_METHODS.get(similarity_method)
+    if sim_func is None:
+        raise AttributeError(f"similarity_method must be in {list(SIMILARITY_METHODS)} but is {similarity_method}")
+
+    if plan is None:
+        plan = plan_execution(len(unique_list1), len(unique_list2), mode=execution, workers=workers,
+                              chunk_size=chunk_size, tile_size=tile_size, backend=backend)
+
+    context = None
+    if plan.mode != PROCESSES:
+        if go_dag is None:
+            from goatools.obo_parser import GODag
+
+            go_dag = GODag(GO_DAG_FILE_PATH, optional_attrs={'relationship'}, prt=open(os.devnull, 'w'))
+        context = (go_dag, term_counts, highest_ic_anc)
+
+    counters = None
+    if progress_tracker is not None and plan.mode != PROCESSES:
+        counters = progress_tracker.counters.array
+
+    def create_tasks():
+        for tile in plan.tiles(len(unique_list1), len(unique_list2)):
+            # Tasks are created lazily by map_bounded, so a slot is only taken once its task is submitted.
+            slot = progress_tracker.start_task() if progress_tracker is not None else -1
+            yield (tile, slot), (unique_list1[tile[0]:tile[1]], unique_list2[tile[2]:tile[3]], context, sim_func,
+                                 cancel_event if plan.mode != PROCESSES else None, counters, slot, plan.backend,
+                                 pair_cache if plan.mode != PROCESSES else None)
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = create_executor(plan, _init_worker, (
+            GO_DAG_FILE_PATH, term_counts, highest_ic_anc,
+            progress_tracker.counters.array if progress_tracker is not None else None, pair_cache
+        ))
+
+    try:
+        for (tile, slot), (tile_row_max, tile_col_max) in map_bounded(executor, _compute_similarity_task,
+                                                                        create_tasks(), plan.max_pending,
+                                                                        cancel_event):
+            row_start, row_end, col_start, col_end = tile
+            for i, value in enumerate(tile_row_max, row_start):
+                if value > row_max[i]:
+                    row_max[i] = value
+            for j, value in enumerate(tile_col_max, col_start):
+                if value > col_max[j]:
+                    col_max[j] = value
+            if progress_tracker is not None:
+                progress_tracker.finish_task(slot, (row_end - row_start) * (col_end - col_start))
+            elif progress_listener:
+                progress_listener((row_end - row_start) * (col_end - col_start))
+    finally:
+        if owns_executor:
+            executor.shutdown()
+
+    best_match1 = dict(zip(unique_list1, row_max))
+    best_match2 = dict(zip(unique_list2, col_max))
+    return best_match1, best_match2
+
+
+def bma_from_best_matches(go_list1, go_list2, best_match1, best_match2):
+    """compute the best match average from the best match of every term (see compute_best_matches)
+
+    Duplicate terms in go_list1 and go_list2 are counted. The result is NaN if exactly one of the lists is empty.
 
+    Returns
+    -------
+    float
+    """
     summation_set12 = 0.0
     summation_set21 = 0.0
 
     for id1 in go_list1:
-        max_value = 0.0
-        for id2 in go_list2:
-            key = (id1, id2) if id1 < id2 else (id2, id1)
-            value = sim_method_dict[key]
-            if value > max_value:
-                max_value = value
+        max_value = best_match1[id1]
         if len(go_list2) == 0:
             max_value = NAN_VALUE
         summation_set12 += max_value
     for id2 in go_list2:
-        max_value = 0.0
-        for id1 in go_list1:
-            key = (id1, id2) if id1 < id2 else (id2, id1)
-            value = sim_method_dict[key]
-            if value > max_value:
-                max_value = value
+        max_value = best_match2[id2]
         if len(go_list1) == 0:
             max_value = NAN_VALUE
         summation_set21 += max_value
@@ -0,0 +1,177 @@
+"""Operational metrics of services such as the MegaGO API, in the Prometheus text format (GET /metrics).
+
+Nothing is computed on the hot path of a comparison: jobs record three timestamps, sessions increment a few counters
+while they hold their lock anyway, and everything else (job counts, memory usage) is derived when the metrics are
+scraped. Rates such as the amount of compared pairs per second and the utilisation of the workers are left to
+Prometheus:
+
+    rate(megago_pairs_compared_total[1m])
+    rate(megago_job_run_seconds_sum[1m]) / megago_job_workers
+    rate(megago_result_cache_hits_total[5m])
+        / (rate(megago_result_cache_hits_total[5m]) + rate(megago_result_cache_misses_total[5m]))
+
+Sessions usually share one pair cache (see megago.pair_cache), whose statistics are therefore reported once instead of
+per release.
+"""
+
+import bisect
+import collections
+import math
+import os
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (in seconds) of the buckets of the queue wait and run time histograms.
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, math.inf)
+
+
+class Histogram(object):
+    """Distribution of observed values over a fixed set of buckets, like a Prometheus histogram.
+
+    Parameters
+    ----------
+    buckets : sequence
+        sorted upper bounds of the buckets, the last one should be math.inf
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[min(index, len(self._counts) - 1)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Returns (cumulative_counts, sum, count): the amount of observations that are less than or equal to each
+        bucket bound, the sum of all observations and their amount."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        for count in counts:
+            cumulative.append(count + (cumulative[-1] if cumulative else 0))
+        return cumulative, total, cumulative[-1]
+
+
+def resident_memory_bytes():
+    """Returns the resident set size of this process, or None if it cannot be determined (only Linux is supported)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+               for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsWriter(object):
+    """Builds a document in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lines = []
+
+    def metric(self, name, kind, description, samples):
+        """Add a metric family.
+
+        Parameters
+        ----------
+        name : str
+        kind : str
+            'counter', 'gauge' or 'histogram'
+        description : str
+        samples : iterable
+            (suffix, labels, value) tuples, in which labels is a sequence of (name, value) tuples
+        """
+        self._lines.append(f"# HELP {name} {description}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            self._lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name, description, histogram, labels=()):
+        cumulative, total, count = histogram.snapshot()
+        samples = [("_bucket", tuple(labels) + (("le", _format_value(bound)),), value)
+                   for bound, value in zip(histogram.buckets, cumulative)]
+        samples.append(("_sum", labels, total))
+        samples.append(("_count", labels, count))
+        self.metric(name, "histogram", description, samples)
+
+    def render(self):
+        return "\n".join(self._lines) + "\n"
+
+
+def render_metrics(job_queue=None, sessions=None):
+    """Returns the metrics of a job queue, of sessions and of this process in the Prometheus text format.
+
+    Parameters
+    ----------
+    job_queue : JobQueue, optional
+    sessions : dict, optional
+        maps a name (e.g. of a GO release, see megago.releases) onto a Session. The name becomes the release label.
+
+    Returns
+    -------
+    str
+    """
+    writer = MetricsWriter()
+
+    if job_queue is not None:
+        counts = job_queue.counts()
+        writer.metric("megago_jobs", "gauge", "Amount of jobs by state.",
+                      [("", (("state", state),), count) for state, count in counts.items()])
+        writer.metric("megago_job_workers", "gauge", "Maximum amount of jobs that are computed at the same time.",
+                      [("", (), job_queue.max_running)])
+        writer.metric("megago_job_workers_busy", "gauge", "Amount of jobs that are being computed.",
+                      [("", (), job_queue.busy)])
+        writer.histogram("megago_job_wait_seconds", "Time that jobs waited in the queue before they started.",
+                         job_queue.wait_time)
+        writer.histogram("megago_job_run_seconds", "Time that jobs took from their start until they were done.",
+                         job_queue.run_time)
+
+    if sessions:
+        statistics = [(name, session.statistics()) for name, session in sorted(sessions.items())]
+        for key, name, description in (
+                ("pairs_compared", "megago_pairs_compared_total", "Amount of compared pairs of GO-terms."),
+                ("cache_hits", "megago_result_cache_hits_total", "Comparisons that were taken from the result cache."),
+                ("cache_misses", "megago_result_cache_misses_total", "Comparisons that were not in the result cache.")):
+            writer.metric(name, "counter", description,
+                          [("", (("release", release),), values[key]) for release, values in statistics])
+        writer.metric("megago_result_cache_entries", "gauge", "Amount of results in the result cache.",
+                      [("", (("release", release),), values["cache_entries"]) for release, values in statistics])
+
+        pair_caches = {id(session.pair_cache): session.pair_cache for session in sessions.values()
+                       if session.pair_cache is not None}
+        if pair_caches:
+            totals = collections.Counter()
+            for pair_cache in pair_caches.values():
+                totals.update(pair_cache.statistics())
+            for key, name, kind, description in (
+                    ("hits", "megago_pair_cache_hits_total", "counter", "Pairs of GO-terms found in the pair cache."),
+                    ("misses", "megago_pair_cache_misses_total", "counter",
+                     "Pairs of GO-terms that were not in the pair cache."),
+                    ("entries", "megago_pair_cache_entries", "gauge", "Amount of pairs of GO-terms in the pair cache."),
+                    ("size", "megago_pair_cache_size_bytes", "gauge", "Memory size of the pair cache in bytes.")):
+                writer.metric(name, kind, description, [("", (), totals[key])])
+
+    memory = resident_memory_bytes()
+    if memory is not None:
+        writer.metric("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.", [("", (), memory)])
+
+    return writer.render()
@@ -0,0 +1,589 @@
+import hashlib
+import itertools
+import math
+import os
+import re
+
+import numpy as np
+
+from .constants import GO_DOMAINS
+
+GO_ID_PATTERN = re.compile(r"GO:(\d{7})$")
+
+
+def parse_go_id(go_id):
+    """Returns the number of a GO-identifier (e.g. 8150 for GO:0008150), or -1 if it's not a valid identifier."""
+    match = GO_ID_PATTERN.match(go_id)
+    return int(match.group(1)) if match else -1
+
+
+def format_go_id(number):
+    """Inverse of parse_go_id."""
+    return f"GO:{number:07d}"
+
+
+class TermTable(object):
+    """Integer indices for all terms of the Gene Ontology, together with dense arrays that describe these terms.
+
+    Every term is identified by its index in numbers, the sorted array of the numbers of all primary GO-identifiers.
+    Alternative identifiers are stored separately: alias_numbers is sorted and alias_targets contains the index of the
+    term that each of them refers to. GO-identifiers are only parsed at the boundaries (by index and indices), all other
+    lookups are array indexing operations.
+
+    Parameters
+    ----------
+    go_dag : GODag object
+        GODag object from the goatools package
+
+    Attributes
+    ----------
+    numbers : numpy.ndarray
+        int32 numbers of the primary identifiers, sorted
+    alias_numbers, alias_targets : numpy.ndarray
+        int32 numbers of the alternative identifiers (sorted) and the index of their term
+    namespaces : numpy.ndarray
+        int8 index into GO_DOMAINS of every term
+    depths : numpy.ndarray
+        int32 depth of every term
+    """
+
+    def __init__(self, go_dag):
+        terms = sorted({term.id: term for term in go_dag.values()}.values(), key=lambda term: parse_go_id(term.id))
+        self.numbers = np.array([parse_go_id(term.id) for term in terms], dtype=np.int32)
+
+        aliases = sorted((parse_go_id(alt_id), index) for index, term in enumerate(terms) for alt_id in term.alt_ids
+                         if parse_go_id(alt_id) >= 0)
+        self.alias_numbers = np.array([number for number, _ in aliases], dtype=np.int32)
+        self.alias_targets = np.array([index for _, index in aliases], dtype=np.int32)
+
+        self.namespaces = np.array([GO_DOMAINS.index(term.namespace) for term in terms], dtype=np.int8)
+        self.depths = np.array([term.depth for term in terms], dtype=np.int32)
+
+        # The is_a parents of every term, in compressed sparse row format.
+        parents = [self._lookup(parse_go_id(parent.id)) for term in terms for parent in term.parents]
+        self._parent_offsets = np.cumsum([0] + [len(term.parents) for term in terms], dtype=np.int64)
+        self._parent_indices = np.array(parents, dtype=np.int32)
+        self._ancestors = dict()
+        self._ancestor_sets = dict()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getstate__(self):
+        # The ancestors are cheap to recompute, and would otherwise be copied to every worker process.
+        state = self.__dict__.copy()
+        state["_ancestors"] = dict()
+        state["_ancestor_sets"] = dict()
+        return state
+
+    def fingerprint(self):
+        """Returns a digest (bytes) of the terms, namespaces and is_a structure of the ontology, which identifies the
+        ontology across processes (e.g. in a megago.pair_cache.PairCache)."""
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (self.numbers, self.namespaces, self.depths, self._parent_offsets, self._parent_indices):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.digest()
+
+    def _lookup(self, number):
+        position = int(np.searchsorted(self.numbers, number))
+        if position < len(self.numbers) and self.numbers[position] == number:
+            return position
+        position = int(np.searchsorted(self.alias_numbers, number))
+        if position < len(self.alias_numbers) and self.alias_numbers[position] == number:
+            return int(self.alias_targets[position])
+        return -1
+
+    def index(self, go_id):
+        """Returns the index of the term with the given (possibly alternative) identifier, or -1 if it's unknown."""
+        return self._lookup(parse_go_id(go_id))
+
+    def indices(self, go_ids):
+        """Returns the index of every given identifier as an int32 array (-1 for unknown identifiers)."""
+        numbers = np.fromiter((parse_go_id(go_id) for go_id in go_ids), dtype=np.int64)
+        output = np.full(len(numbers), -1, dtype=np.int32)
+        if len(self.numbers) > 0:
+            positions = np.minimum(np.searchsorted(self.numbers, numbers), len(self.numbers) - 1)
+            found = self.numbers[positions] == numbers
+            output[found] = positions[found]
+        if len(self.alias_numbers) > 0:
+            positions = np.minimum(np.searchsorted(self.alias_numbers, numbers), len(self.alias_numbers) - 1)
+            found = (output < 0) & (self.alias_numbers[positions] == numbers)
+            output[found] = self.alias_targets[positions[found]]
+        return output
+
+    def go_id(self, index):
+        """Returns the primary identifier of the term with the given index."""
+        return format_go_id(int(self.numbers[index]))
+
+    def is_alias(self, number):
+        position = int(np.searchsorted(self.alias_numbers, number))
+        return position < len(self.alias_numbers) and self.alias_numbers[position] == number
+
+    def ancestors(self, index):
+        """Returns the indices of the term itself and all of its (is_a) ancestors, deepest first. Ancestors with the
+        same depth are ordered by index.
+
+        Returns
+        -------
+        tuple
+        """
+        result = self._ancestors.get(index)
+        if result is None:
+            # Walk the DAG iteratively, to avoid hitting the recursion limit for deep terms.
+            stack = [index]
+            while stack:
+                current = stack[-1]
+                parents = self._parent_indices[self._parent_offsets[current]:self._parent_offsets[current + 1]]
+                missing = [int(parent) for parent in parents if int(parent) not in self._ancestors]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                stack.pop()
+                if current not in self._ancestors:
+                    closure = {current}
+                    for parent in parents:
+                        closure.update(self._ancestors[int(parent)])
+                    self._ancestors[current] = tuple(sorted(closure, key=lambda i: (-self.depths[i], i)))
+            result = self._ancestors[index]
+        return result
+
+    def deepest_common_ancestor(self, index1, index2):
+        """Returns the index of the deepest common ancestor of two terms of the same domain. Unlike the goatools
+        function, ties are broken deterministically (by the lowest GO-identifier)."""
+        ancestors2 = self._ancestor_sets.get(index2)
+        if ancestors2 is None:
+            ancestors2 = self._ancestor_sets[index2] = frozenset(self.ancestors(index2))
+        for ancestor in self.ancestors(index1):
+            if ancestor in ancestors2:
+                return ancestor
+        return -1
+
+    def _flat_ancestors(self, indices):
+        """Returns the ancestors of all given terms as one array, together with the amount of ancestors per term."""
+        ancestors = [self.ancestors(index) for index in indices]
+        lengths = np.fromiter((len(values) for values in ancestors), dtype=np.int64, count=len(ancestors))
+        return np.fromiter(itertools.chain.from_iterable(ancestors), dtype=np.int64, count=int(lengths.sum())), lengths
+
+    def deepest_common_ancestors(self, indices1, indices2):
+        """Vectorised deepest_common_ancestor for every pair of terms from indices1 and indices2 (with the same
+        tie-break).
+
+        The common ancestors of both lists are ranked by priority (deepest first, then lowest index). For every term
+        of indices2, a column holds the rank of each of its ancestors. The deepest common ancestor of a term of
+        indices1 with all terms of indices2 is then the minimum of the rows of its ancestors, which is computed by
+        numpy without holding the GIL.
+
+        Parameters
+        ----------
+        indices1, indices2 : sequence
+            valid term indices
+
+        Returns
+        -------
+        numpy.ndarray
+            len(indices1) x len(indices2) matrix with the index of the deepest common ancestor of every pair, or -1 if
+            two terms have no common ancestor (e.g. because they belong to different domains)
+        """
+        flat1, lengths1 = self._flat_ancestors(indices1)
+        flat2, lengths2 = self._flat_ancestors(indices2)
+        output = np.full((len(indices1), len(indices2)), -1, dtype=np.int64)
+        common = np.intersect1d(flat1, flat2)
+        if len(common) == 0:
+            return output
+
+        # Rank of every common ancestor, in the order of the ancestors tuples.
+        order = np.lexsort((common, -self.depths[common]))
+        ranks = np.empty(len(common), dtype=np.int64)
+        ranks[order] = np.arange(len(common))
+        by_rank = np.append(common[order], -1)
+
+        def rank_of(flat):
+            positions = np.minimum(np.searchsorted(common, flat), len(common) - 1)
+            return np.where(common[positions] == flat, ranks[positions], -1)
+
+        # Row len(common) is a sentinel that's never the minimum of an actual common ancestor.
+        dtype = np.int16 if len(common) < np.iinfo(np.int16).max else np.int32
+        ranks2 = rank_of(flat2)
+        columns = np.repeat(np.arange(len(indices2)), lengths2)
+        found = ranks2 >= 0
+        matrix = np.full((len(common) + 1, len(indices2)), len(common), dtype=dtype)
+        matrix[ranks2[found], columns[found]] = ranks2[found]
+
+        ranks1 = rank_of(flat1)
+        offsets = np.concatenate(([0], np.cumsum(lengths1)))
+        for row in range(len(indices1)):
+            rows = ranks1[offsets[row]:offsets[row + 1]]
+            rows = rows[rows >= 0]
+            if len(rows) > 0:
+                output[row] = by_rank[matrix[rows].min(axis=0)]
+        return output
+
+
+def obo_fingerprint(path):
+    """Identifies the contents of an OBO file, such that the TermArrays that have been derived from it can be
+    recognised (see TermArray.save)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TermArray(object):
+    """Read-only mapping from GO-identifiers onto values, stored as a dense array that's indexed by the term indices
+    of a TermTable. Alternative identifiers resolve to the value of their term. Unknown terms are not present.
+
+    Parameters
+    ----------
+    table : TermTable
+    values : numpy.ndarray
+        one value for every term of the table
+    """
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = np.asarray(values, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return (self.table.go_id(index) for index in range(len(self.table)))
+
+    def __contains__(self, go_id):
+        return self.table.index(go_id) >= 0
+
+    def __getitem__(self, go_id):
+        index = self.table.index(go_id)
+        if index < 0:
+            raise KeyError(go_id)
+        return self.values[index]
+
+    def get(self, go_id, default=None):
+        index = self.table.index(go_id)
+        return default if index < 0 else self.values[index]
+
+    def save(self, path, source=None):
+        """Write the values of all terms, together with the numbers of their (primary) identifiers, to an .npz file.
+
+        Parameters
+        ----------
+        path : str
+        source : str, optional
+            fingerprint of the OBO file from which the values have been derived (see obo_fingerprint)
+        """
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, numbers=self.table.numbers, values=self.values, source=np.array(source or ""))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, table, source=None):
+        """Read values that have been written by save. The values are aligned with the given table, which may only
+        contain a part of the terms (e.g. a slice of the ontology, see megago.partitions): terms that are missing from
+        the file get the value 0.
+
+        Raises
+        ------
+        ValueError
+            if source is given, but the values have been derived from another OBO file (or from an unknown one)
+        """
+        with np.load(path) as data:
+            stored = str(data["source"]) if "source" in data.files else ""
+            if source is not None and stored != source:
+                raise ValueError(f"{path} has been derived from another version of the Gene Ontology.")
+            return cls.from_numbers(table, data["numbers"], data["values"])
+
+    @classmethod
+    def from_numbers(cls, table, numbers, values):
+        """Align values of the terms with the given identifier numbers (sorted) with table."""
+        output = np.zeros(len(table))
+        if len(numbers) > 0:
+            positions = np.minimum(np.searchsorted(numbers, table.numbers), len(numbers) - 1)
+            found = numbers[positions] == table.numbers
+            output[found] = values[positions[found]]
+        return cls(table, output)
+
+    @classmethod
+    def from_dict(cls, table, values):
+        """Convert a dictionary from GO-identifiers onto values. Entries of alternative identifiers are ignored, since
+        these always have the same value as their primary identifier."""
+        items = sorted((parse_go_id(go_id), value) for go_id, value in values.items()
+                       if parse_go_id(go_id) >= 0 and not table.is_alias(parse_go_id(go_id)))
+        numbers = np.array([number for number, _ in items], dtype=np.int32)
+        return cls.from_numbers(table, numbers, np.array([value for _, value in items], dtype=np.float64))
+
+
+class AncestorIndex(object):
+    """Precomputed view on the Gene Ontology that answers ancestor, depth and information content queries without
+    walking the DAG over and over again. Results are computed lazily and remembered for every term that is looked up.
+
+    Alternative identifiers are resolved to the primary identifier of their term, just like the goatools functions
+    that are used by the metrics module.
+
+    Parameters
+    ----------
+    go_dag : GODag object
+        GODag object from the goatools package
+    term_counts : dict, optional
+        dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence.
+        Required for information content queries.
+    """
+
+    # Root term of each of the GO domains. The counts of these terms are the totals of each domain.
+    ROOTS = {
+        "biological_process": "GO:0008150",
+        "cellular_component": "GO:0005575",
+        "molecular_function": "GO:0003674"
+    }
+
+    def __init__(self, go_dag, term_counts=None):
+        self.go_dag = go_dag
+        self.term_counts = term_counts
+        self._ancestors = dict()
+        self._descendants = None
+        self._info_content = dict()
+
+    def __contains__(self, go_id):
+        return go_id in self.go_dag
+
+    def primary_id(self, go_id):
+        """Returns the primary identifier of a (possibly alternative) GO-identifier."""
+        return self.go_dag[go_id].id
+
+    def namespace(self, go_id):
+        return self.go_dag[go_id].namespace
+
+    def depth(self, go_id):
+        return self.go_dag[go_id].depth
+
+    def ancestors(self, go_id):
+        """Returns the primary identifiers of the term itself and of all of its (is_a) ancestors.
+
+        Returns
+        -------
+        frozenset
+        """
+        term = self.go_dag[go_id]
+        result = self._ancestors.get(term.id)
+        if result is None:
+            # Walk the DAG iteratively, to avoid hitting the recursion limit for deep terms.
+            stack = [term]
+            while stack:
+                current = stack[-1]
+                missing = [parent for parent in current.parents if parent.id not in self._ancestors]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                stack.pop()
+                if current.id not in self._ancestors:
+                    closure = {current.id}
+                    for parent in current.parents:
+                        closure |= self._ancestors[parent.id]
+                    self._ancestors[current.id] = frozenset(closure)
+            result = self._ancestors[term.id]
+        return result
+
+    def descendants(self, go_id):
+        """Returns the primary identifiers of all terms that have the given term as an ancestor (including itself).
+
+        Returns
+        -------
+        frozenset
+        """
+        if self._descendants is None:
+            descendants = dict()
+            for term_id in set(term.id for term in self.go_dag.values()):
+                for ancestor in self.ancestors(term_id):
+                    descendants.setdefault(ancestor, set()).add(term_id)
+            self._descendants = {term_id: frozenset(values) for term_id, values in descendants.items()}
+        return self._descendants.get(self.primary_id(go_id), frozenset())
+
+    def is_ancestor(self, ancestor, go_id):
+        """Returns True if ancestor is a (strict) ancestor of go_id."""
+        primary = self.primary_id(ancestor)
+        return primary != self.primary_id(go_id) and primary in self.ancestors(go_id)
+
+    def frequency(self, go_id):
+        """Relative frequency of a term in its namespace (see metrics.get_frequency)."""
+        root = self.ROOTS[self.namespace(go_id)]
+        return float(self.term_counts.get(go_id, 0)) / self.term_counts.get(root)
+
+    def info_content(self, go_id):
+        """Information content of a term (see metrics.get_info_content)."""
+        result = self._info_content.get(go_id)
+        if result is None:
+            freq = self.frequency(go_id)
+            result = 0 if freq == 0 else 0.0 - math.log(freq)
+            self._info_content[go_id] = result
+        return result
+
+    def split_per_domain(self, go_terms):
+        """Divide the given terms over the GO-domains. Terms that are not present in the ontology are ignored.
+
+        Returns
+        -------
+        dict
+            maps every domain in GO_DOMAINS onto a list of terms
+        """
+        output = {domain: [] for domain in GO_DOMAINS}
+        for go_term in go_terms:
+            if go_term in self.go_dag:
+                output[self.namespace(go_term)].append(go_term)
+        return output
+
+
+class WangIndex(object):
+    """Precomputed semantic contributions of terms, as defined by the graph based similarity measure of Wang et al.:
+    Wang, J.Z., Du, Z., Payattakool, R., Yu, P.S., Chen, C.F. A new method to measure the semantic similarity of GO
+    terms. Bioinformatics 23, 1274-1281 (2007) doi:10.1093/bioinformatics/btm087
+
+    The semantic contribution of an ancestor t to a term A is the highest product of edge weights over all paths from A
+    to t (1 for A itself). The contributions of every term are computed once and stored sparsely (only its ancestors).
+    Comparing two terms then only requires summing the contributions of their common ancestors.
+
+    Parameters
+    ----------
+    go_dag : GODag object
+        GODag object from the goatools package. part_of relations are only taken into account if the DAG has been
+        loaded with optional_attrs={"relationship"}.
+    """
+
+    # Weight of every type of edge that is followed from a term to its parents.
+    EDGE_WEIGHTS = {
+        "is_a": 0.8,
+        "part_of": 0.6
+    }
+    # Amount of terms per block that are compared with each other at once by similarity_matrix.
+    BLOCK_SIZE = 512
+
+    def __init__(self, go_dag):
+        self.go_dag = go_dag
+        self._contributions = dict()
+        self._sparse = dict()
+        # Integer identifier of every term, used to represent contributions as sparse vectors.
+        self._term_ids = {go_id: i for i, go_id in enumerate(sorted(set(term.id for term in go_dag.values())))}
+
+    def _parents(self, term):
+        """Returns (parent, weight) tuples for all is_a and part_of parents of a term."""
+        parents = [(parent, self.EDGE_WEIGHTS["is_a"]) for parent in term.parents]
+        relationship = getattr(term, "relationship", None) or {}
+        parents.extend((parent, self.EDGE_WEIGHTS["part_of"]) for parent in relationship.get("part_of", ()))
+        return parents
+
+    def contributions(self, go_id):
+        """Returns the semantic contribution of every ancestor of a term (including itself).
+
+        Returns
+        -------
+        dict
+            maps primary identifiers onto their contribution
+        """
+        term = self.go_dag[go_id]
+        result = self._contributions.get(term.id)
+        if result is None:
+            # Walk the DAG iteratively, to avoid hitting the recursion limit for deep terms.
+            stack = [term]
+            while stack:
+                current = stack[-1]
+                parents = self._parents(current)
+                missing = [parent for parent, _ in parents if parent.id not in self._contributions]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                stack.pop()
+                if current.id not in self._contributions:
+                    values = {current.id: 1.0}
+                    for parent, weight in parents:
+                        for ancestor, value in self._contributions[parent.id].items():
+                            if weight * value > values.get(ancestor, 0.0):
+                                values[ancestor] = weight * value
+                    self._contributions[current.id] = values
+            result = self._contributions[term.id]
+        return result
+
+    def semantic_value(self, go_id):
+        """Sum of the semantic contributions of all ancestors of a term."""
+        return self._sparse_vector(go_id)[2]
+
+    def similarity(self, go_id1, go_id2):
+        """Wang similarity of two terms. NaN if one of them is missing from the DAG or if they belong to another
+        domain (just like lin_metric and rel_metric).
+
+        Returns
+        -------
+        float
+        """
+        if go_id1 not in self.go_dag or go_id2 not in self.go_dag:
+            return math.nan
+        if self.go_dag[go_id1].namespace != self.go_dag[go_id2].namespace:
+            return math.nan
+        contributions1 = self.contributions(go_id1)
+        contributions2 = self.contributions(go_id2)
+        if len(contributions1) > len(contributions2):
+            contributions1, contributions2 = contributions2, contributions1
+        common = 0.0
+        for ancestor, value in contributions1.items():
+            other = contributions2.get(ancestor)
+            if other is not None:
+                common += value + other
+        return common / (self.semantic_value(go_id1) + self.semantic_value(go_id2))
+
+    def _sparse_vector(self, go_id):
+        """Returns (sorted integer ids of the ancestors, their contributions, semantic value) of a term."""
+        primary = self.go_dag[go_id].id
+        result = self._sparse.get(primary)
+        if result is None:
+            items = sorted((self._term_ids[ancestor], value) for ancestor, value in self.contributions(primary).items())
+            ids = np.fromiter((item[0] for item in items), dtype=np.int64, count=len(items))
+            values = np.fromiter((item[1] for item in items), dtype=np.float64, count=len(items))
+            result = self._sparse[primary] = (ids, values, float(values.sum()))
+        return result
+
+    def similarity_matrix(self, terms1, terms2):
+        """Wang similarity of every term in terms1 with every term in terms2, computed with dense matrix products over
+        blocks of terms. Every block only uses the ancestors of its rows as columns, which keeps the matrices small.
+
+        Returns
+        -------
+        numpy.ndarray
+            len(terms1) * len(terms2) matrix, NaN for pairs that are not comparable (see similarity)
+        """
+        output = np.full((len(terms1), len(terms2)), np.nan)
+        rows = [i for i, term in enumerate(terms1) if term in self.go_dag]
+        cols = [j for j, term in enumerate(terms2) if term in self.go_dag]
+        if not rows or not cols:
+            return output
+
+        row_vectors = [self._sparse_vector(terms1[i]) for i in rows]
+        col_vectors = [self._sparse_vector(terms2[j]) for j in cols]
+        row_namespaces = np.array([self.go_dag[terms1[i]].namespace for i in rows])
+        col_namespaces = np.array([self.go_dag[terms2[j]].namespace for j in cols])
+
+        for row_start in range(0, len(rows), self.BLOCK_SIZE):
+            block_rows = row_vectors[row_start:row_start + self.BLOCK_SIZE]
+            keys = np.unique(np.concatenate([ids for ids, _, _ in block_rows]))
+            a = np.zeros((len(block_rows), len(keys)))
+            for r, (ids, values, _) in enumerate(block_rows):
+                a[r, np.searchsorted(keys, ids)] = values
+            a_present = (a > 0).astype(np.float64)
+            a_values = np.array([value for _, _, value in block_rows])
+
+            for col_start in range(0, len(cols), self.BLOCK_SIZE):
+                block_cols = col_vectors[col_start:col_start + self.BLOCK_SIZE]
+                b = np.zeros((len(block_cols), len(keys)))
+                for c, (ids, values, _) in enumerate(block_cols):
+                    positions = np.searchsorted(keys, ids)
+                    found = positions < len(keys)
+                    found[found] = keys[positions[found]] == ids[found]
+                    b[c, positions[found]] = values[found]
+                b_values = np.array([value for _, _, value in block_cols])
+
+                common = a @ (b > 0).T + a_present @ b.T
+                block = common / (a_values[:, None] + b_values[None, :])
+                same_namespace = row_namespaces[row_start:row_start + len(block_rows), None] == \
+                    col_namespaces[None, col_start:col_start + len(block_cols)]
+                block[~same_namespace] = np.nan
+                output[np.ix_(rows[row_start:row_start + len(block_rows)],
+                              cols[col_start:col_start + len(block_cols)])] = block
+        return output
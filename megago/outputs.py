@@ -0,0 +1,193 @@
+"""Writers that stream the results of an all-vs-all comparison to disk as soon as every pair has been compared.
+
+The format of a writer is determined by the extension of its path:
+
+* .csv: a long-form table with one row per pair of samples and domain.
+* .parquet: the same table in the Parquet format (requires the optional pyarrow package).
+* .npy: one memory-mapped N x N matrix per domain, stored in <path without extension>_<domain>.npy. Pairs that have not
+  been compared (yet) are NaN.
+
+Written data is flushed regularly, such that the results of an interrupted run are not lost. Only the results of the
+selected GO-domains are written if a run is limited to some domains (megago --domains).
+"""
+
+import abc
+import csv
+import os
+
+import numpy as np
+
+from .constants import GO_DOMAINS
+
+LONG_FORM_COLUMNS = ["SAMPLE_1", "SAMPLE_2", "DOMAIN", "SIMILARITY"]
+SIGNIFICANCE_COLUMNS = ["P_VALUE", "CI_LOW", "CI_HIGH"]
+OUTPUT_FORMATS = [".csv", ".parquet", ".npy"]
+# Amount of pairs that are buffered by writers that write in batches (Parquet row groups, flushes of matrices).
+WRITE_BATCH_SIZE = 1000
+
+
+class ResultWriter(abc.ABC):
+    """Base class of all writers. Writers can be used as context managers, which closes them afterwards."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @abc.abstractmethod
+    def write(self, i, j, similarities, significance=None):
+        """Write the results of the comparison of sample i and j.
+
+        Parameters
+        ----------
+        i, j : int
+            indices of the compared samples
+        similarities : tuple
+            the similarity of every domain in GO_DOMAINS
+        significance : tuple, optional
+            a SignificanceResult for every domain
+        """
+
+    def close(self):
+        pass
+
+
+class LongFormCsvWriter(ResultWriter):
+    def __init__(self, path, sample_names, significance=False, domains=None):
+        self.sample_names = sample_names
+        self.significance = significance
+        self.domains = domains or GO_DOMAINS
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(LONG_FORM_COLUMNS + (SIGNIFICANCE_COLUMNS if significance else []))
+
+    def write(self, i, j, similarities, significance=None):
+        for index, domain in enumerate(GO_DOMAINS):
+            if domain not in self.domains:
+                continue
+            row = [self.sample_names[i], self.sample_names[j], domain, similarities[index]]
+            if self.significance:
+                result = significance[index]
+                row.extend([result.p_value, result.ci_low, result.ci_high])
+            self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(ResultWriter):
+    def __init__(self, path, sample_names, significance=False, domains=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet files requires the pyarrow package (pip install pyarrow).")
+
+        self._pyarrow = pyarrow
+        self.sample_names = sample_names
+        self.significance = significance
+        self.domains = domains or GO_DOMAINS
+        fields = [
+            pyarrow.field(LONG_FORM_COLUMNS[0], pyarrow.string()),
+            pyarrow.field(LONG_FORM_COLUMNS[1], pyarrow.string()),
+            pyarrow.field(LONG_FORM_COLUMNS[2], pyarrow.string()),
+            pyarrow.field(LONG_FORM_COLUMNS[3], pyarrow.float64())
+        ]
+        if significance:
+            fields.extend(pyarrow.field(column, pyarrow.float64()) for column in SIGNIFICANCE_COLUMNS)
+        self._schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        self._rows = []
+
+    def write(self, i, j, similarities, significance=None):
+        for index, domain in enumerate(GO_DOMAINS):
+            if domain not in self.domains:
+                continue
+            row = [self.sample_names[i], self.sample_names[j], domain, similarities[index]]
+            if self.significance:
+                result = significance[index]
+                row.extend([result.p_value, result.ci_low, result.ci_high])
+            self._rows.append(row)
+        if len(self._rows) >= WRITE_BATCH_SIZE * len(self.domains):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows as a new row group."""
+        if self._rows:
+            columns = [list(column) for column in zip(*self._rows)]
+            self._writer.write_table(self._pyarrow.Table.from_arrays(columns, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+class NpyMatrixWriter(ResultWriter):
+    def __init__(self, path, sample_names, significance=False, domains=None):
+        stem = os.path.splitext(path)[0]
+        size = len(sample_names)
+        # Position in GO_DOMAINS of the domain of every matrix.
+        self._domain_indices = [GO_DOMAINS.index(domain) for domain in domains or GO_DOMAINS]
+        self.paths = [f"{stem}_{GO_DOMAINS[index]}.npy" for index in self._domain_indices]
+        self._matrices = []
+        for matrix_path in self.paths:
+            matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float64, shape=(size, size))
+            matrix[:] = np.nan
+            np.fill_diagonal(matrix, 1)
+            self._matrices.append(matrix)
+        self._pending = 0
+
+    def write(self, i, j, similarities, significance=None):
+        for matrix, index in zip(self._matrices, self._domain_indices):
+            value = similarities[index]
+            matrix[i, j] = value
+            matrix[j, i] = value
+        self._pending += 1
+        if self._pending >= WRITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for matrix in self._matrices:
+            matrix.flush()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._matrices = []
+
+
+def open_writer(path, sample_names, significance=False, domains=None):
+    """Open the writer that corresponds with the extension of path (see OUTPUT_FORMATS).
+
+    Parameters
+    ----------
+    path : str
+    sample_names : list
+        the names of all samples, in the order of their indices
+    significance : bool
+        whether p-values and confidence intervals should be written as well (if supported by the format)
+    domains : list, optional
+        the GO-domains whose results are written, all domains if not given
+
+    Returns
+    -------
+    ResultWriter
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return LongFormCsvWriter(path, sample_names, significance, domains)
+    if extension == ".parquet":
+        return ParquetWriter(path, sample_names, significance, domains)
+    if extension == ".npy":
+        return NpyMatrixWriter(path, sample_names, significance, domains)
+    raise ValueError(f"The extension of {path} should be one of {OUTPUT_FORMATS}")
+
+
+def pair_file_name(path, i, j):
+    """Returns the path of the file for the pair of samples i and j, e.g. plot.png -> plot_0_1.png."""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}_{i}_{j}{extension}"
+
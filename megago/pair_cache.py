@@ -0,0 +1,198 @@
+"""Bounded cache of the similarity of pairs of GO-terms, shared by all comparisons of a process.
+
+Successive comparisons (e.g. the analyses of different users of the API) share most of their GO-terms, so most of the
+pairs of terms that a comparison needs have already been compared before. A PairCache remembers these similarities in
+a fixed amount of memory:
+
+* The cache is a two-way set associative hash table: every pair of terms hashes onto a bucket of two slots. Storing a
+  pair in a full bucket evicts one of both pairs at random. A complete row or tile of pairs is looked up and stored at
+  once with numpy.
+* The key of a pair consists of the indices of both terms (in ascending order, since lin and rel are symmetric), mixed
+  with a context that identifies the metric, the ontology and the corpus (see PairCache.context). Sessions of different
+  GO releases can therefore share one cache. Keys are 64-bit hashes, so two different pairs are only confused with a
+  probability of about 2^-64.
+* The table lives in shared memory, such that it can be handed to the worker processes of a process pool when these
+  are started (like megago.progress.ProgressCounters). No locks are taken: every slot holds the hash of its key, the
+  value and a check word (hash XOR value). A slot that's read while another thread or process is overwriting it fails
+  the check, and is treated as a miss.
+
+Only the Python kernel uses the cache (see megago.metrics.cached_index_similarities). A cached pair is fetched from
+memory that doesn't fit in the CPU caches, which takes about as long as the numpy kernel needs to compute it.
+"""
+
+import ctypes
+import hashlib
+import itertools
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+
+ENV_PAIR_CACHE_SIZE = "MEGAGO_PAIR_CACHE_SIZE"
+# Size (in MiB) of the pair cache that's shared by all sessions of a process, if the MEGAGO_PAIR_CACHE_SIZE environment
+# variable is not set. The cache is disabled if the size is 0.
+DEFAULT_PAIR_CACHE_SIZE = 0
+MIB = 1 << 20
+# Every slot holds three 64-bit words: the hash of the key, the value and the check word.
+SLOT_BYTES = 24
+
+_SHARED_PAIR_CACHE = None
+_SHARED_PAIR_CACHE_LOCK = threading.Lock()
+_SHARED_PAIR_CACHE_CREATED = False
+
+
+def _mix(keys):
+    """Finalizer of splitmix64, which turns every uint64 of keys into a well distributed hash."""
+    with np.errstate(over="ignore"):
+        keys = keys + np.uint64(0x9E3779B97F4A7C15)
+        keys = (keys ^ (keys >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        keys = (keys ^ (keys >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return keys ^ (keys >> np.uint64(31))
+
+
+class PairCache(object):
+    """Shared-memory cache of the similarity of pairs of terms, identified by their index in a TermTable.
+
+    Parameters
+    ----------
+    size : int
+        memory size of the cache in bytes. The amount of slots is rounded down to a power of 2 (at least 2).
+
+    Attributes
+    ----------
+    slots : int
+        the amount of pairs that fit in the cache
+    """
+
+    def __init__(self, size):
+        if size < 2 * SLOT_BYTES:
+            raise ValueError(f"The size of a pair cache should be at least {2 * SLOT_BYTES} bytes, but is {size}.")
+        self.slots = 1 << ((size // SLOT_BYTES).bit_length() - 1)
+        self._entries = multiprocessing.RawArray(ctypes.c_uint64, 3 * self.slots)
+        # Amount of hits and misses, shared with the worker processes as well.
+        self._counts = multiprocessing.Array(ctypes.c_int64, 2)
+        self._attach()
+
+    def _attach(self):
+        self._table = np.frombuffer(self._entries, dtype=np.uint64).reshape(self.slots // 2, 2, 3)
+        self._mask = np.uint64(self.slots // 2 - 1)
+        # Seeds the choice of the evicted slots.
+        self._stores = itertools.count()
+
+    def __getstate__(self):
+        # Only the shared memory is sent to a worker process, which attaches its own numpy view.
+        return {"slots": self.slots, "_entries": self._entries, "_counts": self._counts}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    @property
+    def size(self):
+        """Memory size of the cache in bytes."""
+        return self.slots * SLOT_BYTES
+
+    @staticmethod
+    def context(name, fingerprint):
+        """Returns the context of the pairs of a metric and corpus.
+
+        Parameters
+        ----------
+        name : str
+            name of the metric
+        fingerprint : bytes
+            identifies the ontology and corpus (see megago.metrics.CorpusTables.fingerprint)
+
+        Returns
+        -------
+        int
+        """
+        return int.from_bytes(hashlib.blake2b(name.encode("utf-8") + fingerprint, digest_size=8).digest(), "little")
+
+    def _hashes(self, context, indices1, indices2):
+        indices1 = np.asarray(indices1, dtype=np.int64)
+        indices2 = np.asarray(indices2, dtype=np.int64)
+        low = np.minimum(indices1, indices2).astype(np.uint64)
+        high = np.maximum(indices1, indices2).astype(np.uint64)
+        # An empty slot has hash 0, which is never the hash of a key. The bucket is selected by the lowest bits.
+        return np.atleast_1d(_mix((low << np.uint64(32) | high) ^ np.uint64(context)) | np.uint64(1 << 63))
+
+    def get(self, context, indices1, indices2):
+        """Look up the similarity of the pairs of terms (indices1[k], indices2[k]). Both arrays are broadcast against
+        each other, and should only contain valid term indices.
+
+        Returns
+        -------
+        tuple
+            (values, found) arrays, in which values is NaN for the pairs that were not found
+        """
+        hashes = self._hashes(context, indices1, indices2)
+        entries = self._table[hashes & self._mask]
+        matches = (entries[..., 0] == hashes[..., None]) & (entries[..., 2] == hashes[..., None] ^ entries[..., 1])
+        values = np.ascontiguousarray(entries[..., 1]).view(np.float64)
+        values = np.where(matches[..., 0], values[..., 0], np.where(matches[..., 1], values[..., 1], np.nan))
+        found = matches.any(axis=-1)
+        hits = int(np.count_nonzero(found))
+        with self._counts.get_lock():
+            self._counts[0] += hits
+            self._counts[1] += found.size - hits
+        return values, found
+
+    def put(self, context, indices1, indices2, values):
+        """Store the similarity values[k] of the pairs of terms (indices1[k], indices2[k]). All arrays are broadcast
+        against each other."""
+        hashes = self._hashes(context, indices1, indices2)
+        values = np.ascontiguousarray(np.broadcast_to(np.asarray(values, dtype=np.float64), hashes.shape))
+        bits = values.view(np.uint64).ravel()
+        hashes = hashes.ravel()
+        random = _mix(hashes ^ np.uint64(next(self._stores))) >> np.uint64(63)
+        remaining = np.arange(len(hashes))
+        # Pairs that hash onto the same bucket are stored in separate rounds, so that they see each other.
+        while len(remaining) > 0:
+            _, first = np.unique(hashes[remaining] & self._mask, return_index=True)
+            selected = remaining[first]
+            remaining = np.delete(remaining, first)
+            buckets = hashes[selected] & self._mask
+            occupants = self._table[buckets, :, 0]
+            # A pair replaces itself or takes an empty slot, or else evicts a random slot of its bucket.
+            ways = random[selected].astype(np.intp)
+            ways = np.where(occupants[:, 1] == 0, 1, ways)
+            ways = np.where(occupants[:, 0] == 0, 0, ways)
+            ways = np.where(occupants[:, 1] == hashes[selected], 1, ways)
+            ways = np.where(occupants[:, 0] == hashes[selected], 0, ways)
+            self._table[buckets, ways] = np.stack([hashes[selected], bits[selected], hashes[selected] ^ bits[selected]],
+                                                  axis=-1)
+
+    def clear(self):
+        self._table[:] = 0
+
+    def statistics(self):
+        """Returns a dictionary with the amount of hits and misses (of all processes that use this cache), the amount of
+        cached pairs and the memory size of the cache in bytes."""
+        with self._counts.get_lock():
+            hits, misses = self._counts[0], self._counts[1]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": int(np.count_nonzero(self._table[..., 0])),
+            "size": self.size
+        }
+
+
+def shared_pair_cache(default=DEFAULT_PAIR_CACHE_SIZE):
+    """Returns the pair cache that's shared by all sessions of this process, which is created the first time it's
+    requested. Its size (in MiB) is read from the MEGAGO_PAIR_CACHE_SIZE environment variable, or is the given default.
+
+    Returns
+    -------
+    PairCache
+        or None if the size is 0
+    """
+    global _SHARED_PAIR_CACHE, _SHARED_PAIR_CACHE_CREATED
+    with _SHARED_PAIR_CACHE_LOCK:
+        if not _SHARED_PAIR_CACHE_CREATED:
+            size = int(os.environ.get(ENV_PAIR_CACHE_SIZE) or default) * MIB
+            _SHARED_PAIR_CACHE = PairCache(size) if size > 0 else None
+            _SHARED_PAIR_CACHE_CREATED = True
+        return _SHARED_PAIR_CACHE
@@ -0,0 +1,168 @@
+"""Selections of GO-domains, and slices of the Gene Ontology that only contain the terms of these domains.
+
+A comparison that's limited to some domains (e.g. megago --domains biological_process) skips all work for the other
+domains. A session that's limited to some domains also loads only a slice of the ontology. The slice is written once per
+source file and selection to CACHE_DIR/partitions and contains:
+
+* the terms of the selected domains, and all of their is_a and part_of ancestors (which may belong to another domain).
+  The deepest common ancestors and the semantic values of the Wang metric therefore don't change.
+* all other relationships of these terms whose target is part of the slice, and all [Typedef] stanzas.
+
+The corpus tables (see megago.ontology.TermArray) are aligned with the terms of the slice when they're loaded, so only the
+values of these terms are kept in memory as well.
+"""
+
+import collections
+import hashlib
+import os
+
+from .constants import CACHE_DIR, GO_DOMAINS
+
+# Directory in which the slices of the Gene Ontology are stored.
+PARTITIONS_DIR = os.path.join(CACHE_DIR, "partitions")
+
+# Short names of the GO-domains that can be used instead of their full names.
+DOMAIN_ALIASES = {
+    "bp": "biological_process",
+    "cc": "cellular_component",
+    "mf": "molecular_function"
+}
+_ALIASES_BY_DOMAIN = {domain: alias for alias, domain in DOMAIN_ALIASES.items()}
+
+# Relationships that are followed to find the ancestors of a term, next to is_a (see megago.ontology.WangIndex).
+ANCESTOR_RELATIONSHIPS = ("part_of",)
+
+
+def parse_domains(value):
+    """Parse a selection of GO-domains.
+
+    Parameters
+    ----------
+    value : str or list
+        a comma separated string or a list with the names of GO-domains, or their aliases (bp, cc and mf)
+
+    Returns
+    -------
+    list
+        the selected domains, in the order of GO_DOMAINS
+    """
+    names = value.split(",") if isinstance(value, str) else list(value)
+    selected = set()
+    for name in names:
+        name = name.strip().lower()
+        domain = DOMAIN_ALIASES.get(name, name)
+        if domain not in GO_DOMAINS:
+            raise ValueError(f"Unknown GO-domain {name!r}, expected one of {GO_DOMAINS + list(DOMAIN_ALIASES)}")
+        selected.add(domain)
+    if not selected:
+        raise ValueError("At least one GO-domain should be selected.")
+    return [domain for domain in GO_DOMAINS if domain in selected]
+
+
+def _read_stanzas(path):
+    """Yields (header, lines) for the header of an OBO file (with header None) and every stanza in it."""
+    header = None
+    lines = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith("["):
+                yield header, lines
+                header = line.strip()
+                lines = []
+            lines.append(line)
+    yield header, lines
+
+
+def _tag_value(line):
+    """Returns the tag and value of an OBO line, without trailing comments."""
+    tag, _, value = line.partition(":")
+    return tag.strip(), value.split("!")[0].strip()
+
+
+def _term_id(lines):
+    for line in lines:
+        tag, value = _tag_value(line)
+        if tag == "id":
+            return value
+    return None
+
+
+def _select_terms(path, domains):
+    """Returns the identifiers of the terms of the given domains and all of their is_a and part_of ancestors."""
+    namespaces = dict()
+    parents = collections.defaultdict(list)
+    for header, lines in _read_stanzas(path):
+        if header != "[Term]":
+            continue
+        term_id = _term_id(lines)
+        for line in lines:
+            tag, value = _tag_value(line)
+            if tag == "namespace":
+                namespaces[term_id] = value
+            elif tag == "is_a":
+                parents[term_id].append(value)
+            elif tag == "relationship":
+                relationship, _, target = value.partition(" ")
+                if relationship in ANCESTOR_RELATIONSHIPS:
+                    parents[term_id].append(target.strip())
+
+    selected = {term_id for term_id, namespace in namespaces.items() if namespace in domains}
+    stack = list(selected)
+    while stack:
+        for parent in parents.get(stack.pop(), ()):
+            if parent not in selected:
+                selected.add(parent)
+                stack.append(parent)
+    return selected
+
+
+def _keep_line(line, selected):
+    tag, value = _tag_value(line)
+    if tag == "is_a":
+        return value in selected
+    if tag in ("relationship", "intersection_of"):
+        return value.split()[-1] in selected
+    return True
+
+
+def partition_obo(path, domains, directory=PARTITIONS_DIR):
+    """Returns the path of the slice of an OBO file for the given domains, which is written if it doesn't exist yet.
+
+    Parameters
+    ----------
+    path : str
+        the complete ontology
+    domains : list
+        the selected GO-domains. path itself is returned if all domains are selected.
+    directory : str
+        directory in which the slices are stored
+
+    Returns
+    -------
+    str
+    """
+    domains = parse_domains(domains)
+    if len(domains) == len(GO_DOMAINS):
+        return path
+
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}\n{stat.st_size}\n{stat.st_mtime_ns}\n{','.join(domains)}"
+                       .encode("utf-8")).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    output = os.path.join(directory, f"{stem}.{'-'.join(_ALIASES_BY_DOMAIN[domain] for domain in domains)}.{key}.obo")
+    if os.path.isfile(output):
+        return output
+
+    selected = _select_terms(path, domains)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{output}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        for header, lines in _read_stanzas(path):
+            if header == "[Term]":
+                if _term_id(lines) not in selected:
+                    continue
+                lines = [line for line in lines if _keep_line(line, selected)]
+            f.writelines(lines)
+    os.replace(temp_path, output)
+    return output
+
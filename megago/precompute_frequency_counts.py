@@ -1,45 +1,91 @@
-import json
-import os
-
-from goatools.anno.idtogos_reader import IdToGosReader
-from goatools.obo_parser import GODag
-from goatools.semantic import TermCounts
-from progress.bar import IncrementalBar
-
-from .constants import FREQUENCY_COUNTS_FILE_PATH, UNIPROT_ASSOCIATIONS_FILE_PATH, GO_DAG_FILE_PATH
-
-
-def _precompute_term_frequencies():
-    print("Start precomputations of term frequencies...")
-    go_freq_dict = dict()
-    go_dag = GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
-
-    associations = IdToGosReader(UNIPROT_ASSOCIATIONS_FILE_PATH, godag=go_dag).get_id2gos('all')
-    term_counts = TermCounts(go_dag, associations)
-
-    for i in go_dag.values():
-        go_freq_dict[i.id] = term_counts.get_count(i.id)
-        for alt_id in i.alt_ids:
-            go_freq_dict[alt_id] = term_counts.get_count(i.id)
-    # write frequency dict to JSON file
-    with open(FREQUENCY_COUNTS_FILE_PATH, 'w') as json_file:
-        json.dump(go_freq_dict, json_file)
-
-
-def get_frequency_counts():
-    """ This function precomputes the term frequency counts if these are outdated or not present. If they are present and
-    valid, it will directly return the frequency counts.
-
-    Returns
-    -------
-    A dictionary that maps each GO-term onto it's frequency counts.
-    """
-    if not os.path.isfile(FREQUENCY_COUNTS_FILE_PATH):
-        _precompute_term_frequencies()
-
-    frequency_dict = json.load(open(FREQUENCY_COUNTS_FILE_PATH))
-    return frequency_dict
-
-
-if __name__ == "__main__":
-    get_frequency_counts()
+import json
+import logging
+import os
+
+import numpy as np
+
+from .constants import CACHED_FREQUENCY_COUNTS_FILE_PATH, FREQUENCY_COUNTS_FILE_PATH, \
+    LEGACY_FREQUENCY_COUNTS_FILE_PATH, UNIPROT_ASSOCIATIONS_FILE_PATH, GO_DAG_FILE_PATH
+from .ontology import TermArray, TermTable, obo_fingerprint
+
+
+def _default_term_table():
+    from goatools.obo_parser import GODag
+
+    return TermTable(GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w')))
+
+
+def _precompute_term_frequencies(term_table, path, source):
+    from goatools.anno.idtogos_reader import IdToGosReader
+    from goatools.obo_parser import GODag
+    from goatools.semantic import TermCounts
+
+    print("Start precomputations of term frequencies...")
+    go_dag = GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
+
+    associations = IdToGosReader(UNIPROT_ASSOCIATIONS_FILE_PATH, godag=go_dag).get_id2gos('all')
+    term_counts = TermCounts(go_dag, associations)
+
+    # Alternative identifiers are resolved by the TermTable, so only the count of every primary identifier is stored.
+    counts = np.array([term_counts.get_count(term_table.go_id(index)) for index in range(len(term_table))])
+    TermArray(term_table, counts).save(path, source)
+
+
+def _convert_legacy_file(legacy_path, path, term_table, source):
+    """Convert a JSON dictionary of a previous release to the compact format of TermArray."""
+    with open(legacy_path) as json_file:
+        TermArray.from_dict(term_table, json.load(json_file)).save(path, source)
+
+
+def _load_resource(paths, term_table, source):
+    """Returns the TermArray of the first of paths that exists and has been derived from the OBO file with the given
+    fingerprint, or None if there is no such file."""
+    for path in paths:
+        if os.path.isfile(path):
+            try:
+                return TermArray.load(path, term_table, source)
+            except ValueError:
+                logging.info("%s has been derived from another version of %s and is not used", path, GO_DAG_FILE_PATH)
+    return None
+
+
+def get_frequency_counts(term_table=None):
+    """ This function precomputes the term frequency counts if these are outdated or not present. If they are present and
+    valid, it will directly return the frequency counts.
+
+    The counts are only used if they have been derived from the installed GO DAG (a package build may place them next to
+    it, see FREQUENCY_COUNTS_FILE_PATH). Otherwise, e.g. on first use or after go-basic.obo has been updated, they are
+    converted from the JSON file of previous releases, or computed from the associations, and stored in the cache
+    directory.
+
+    Parameters
+    ----------
+    term_table : TermTable, optional
+        the terms for which the counts are returned. Derived from the default GO DAG if not given.
+
+    Returns
+    -------
+    A TermArray that maps each GO-term onto it's frequency counts.
+    """
+    if term_table is None:
+        term_table = _default_term_table()
+
+    source = obo_fingerprint(GO_DAG_FILE_PATH)
+    paths = (FREQUENCY_COUNTS_FILE_PATH, CACHED_FREQUENCY_COUNTS_FILE_PATH)
+    counts = _load_resource(paths, term_table, source)
+    if counts is None:
+        # The file covers all terms of the default GO DAG, also if term_table only contains a slice of it (see
+        # megago.partitions). The counts are aligned with term_table when they're loaded.
+        full_table = _default_term_table()
+        os.makedirs(os.path.dirname(CACHED_FREQUENCY_COUNTS_FILE_PATH), exist_ok=True)
+        if os.path.isfile(LEGACY_FREQUENCY_COUNTS_FILE_PATH):
+            _convert_legacy_file(LEGACY_FREQUENCY_COUNTS_FILE_PATH, CACHED_FREQUENCY_COUNTS_FILE_PATH, full_table,
+                                 source)
+        else:
+            _precompute_term_frequencies(full_table, CACHED_FREQUENCY_COUNTS_FILE_PATH, source)
+        counts = TermArray.load(CACHED_FREQUENCY_COUNTS_FILE_PATH, term_table, source)
+    return counts
+
+
+if __name__ == "__main__":
+    get_frequency_counts()
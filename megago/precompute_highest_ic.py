@@ -3,65 +3,134 @@
 # each other.
 
 import math
-import json
 import os
-import concurrent.futures
 
-from goatools.obo_parser import GODag
-from progress.bar import IncrementalBar
-
-from .constants import GO_DAG_FILE_PATH, HIGHEST_IC_FILE_PATH
-from .precompute_frequency_counts import get_frequency_counts
+from .checkpoint import Checkpoint
+from .constants import CACHED_FREQUENCY_COUNTS_FILE_PATH, CACHED_HIGHEST_IC_FILE_PATH, FREQUENCY_COUNTS_FILE_PATH, \
+    GO_DAG_FILE_PATH, HIGHEST_IC_CHECKPOINT_FILE_PATH, HIGHEST_IC_FILE_PATH, LEGACY_HIGHEST_IC_FILE_PATH
+from .execution import PROCESSES, plan_execution, create_executor, map_bounded
+from .ontology import TermArray, TermTable, obo_fingerprint
+from .precompute_frequency_counts import _convert_legacy_file, _load_resource, get_frequency_counts
 from .metrics import get_ic_of_most_informative_ancestor
 
-# How large should the chunks be in which the list of terms for which ic needs to be computed should be divided?
-CHUNK_SIZE = 500
+# Estimated time (in seconds) that is required to find the most informative ancestor of one GO-term. This is used by
+# the execution planner to decide how the terms are divided over the workers.
+TERM_COST = 5e-3
+
+# The GO DAG and term counts used by the worker processes, initialised once per worker by _init_worker.
+_WORKER_CONTEXT = None
+
+
+def _load_go_dag():
+    # goatools is only imported once the values have to be computed, which is rarely the case.
+    from goatools.obo_parser import GODag
+
+    return GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
 
-# How many processes can be used simultaneously at maximum? (Set to none for default)
-PROCESSES = None
 
+def _init_worker():
+    global _WORKER_CONTEXT
+    _WORKER_CONTEXT = (_load_go_dag(), get_frequency_counts())
 
-def _do_compute_highest_inc(terms):
-    term_counts = get_frequency_counts()
-    go_dag = GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
+
+def _do_compute_highest_inc(params):
+    (terms, context) = params
+    if context is None:
+        context = _WORKER_CONTEXT
+    go_dag, term_counts = context
     return {term: get_ic_of_most_informative_ancestor(term, term_counts, go_dag) for term in terms}
 
 
-def compute_highest_inc_parallel(terms):
-    """ Compare all values from the given terms set in parallel by using up to PROCESSES processes simultaneously.
+def _input_fingerprint():
+    """Identifies the GO DAG and frequency counts that the precomputed values are derived from."""
+    return repr([obo_fingerprint(GO_DAG_FILE_PATH)] +
+                [(path, os.path.getmtime(path), os.path.getsize(path))
+                 for path in (FREQUENCY_COUNTS_FILE_PATH, CACHED_FREQUENCY_COUNTS_FILE_PATH) if os.path.isfile(path)])
+
+
+def compute_highest_inc_parallel(terms, term_table, execution=None, workers=None, chunk_size=None, checkpoint=None,
+                                 path=CACHED_HIGHEST_IC_FILE_PATH, source=None):
+    """ Compute the information content of the most informative ancestor of all given terms. The execution planner
+    decides how the terms are divided over the available CPUs, unless this is overridden by the optional arguments.
     Params
     ------
     terms: A list with GO-terms for which the information content should be precomputed.
+    term_table: The TermTable that contains all terms.
+    execution: One of 'serial', 'threads' or 'processes' (optional).
+    workers: The amount of threads or processes that should be used (optional).
+    chunk_size: The amount of terms that are processed per task (optional).
+    checkpoint: A Checkpoint in which the result of every chunk is stored as soon as it's completed (optional). Terms
+                whose result is already present in the checkpoint are not computed again.
+    path: The file in which the values are stored (optional).
+    source: The fingerprint of the GO DAG from which the values are derived (optional, see TermArray.save).
     """
+    from progress.bar import IncrementalBar
+
     print("Start precomputations of the highest_inc_anc for all GO-terms.")
 
-    term_len = len(terms)
     highest_ic_anc = dict()
+    if checkpoint is not None:
+        highest_ic_anc.update(checkpoint.items())
+        terms = [term for term in terms if term not in highest_ic_anc]
+        if highest_ic_anc:
+            print(f"Resuming from checkpoint, {len(highest_ic_anc)} terms have already been processed.")
+
+    term_len = len(terms)
+
+    plan = plan_execution(term_len, item_cost=TERM_COST, mode=execution, workers=workers, chunk_size=chunk_size)
+    amount_of_chunks = math.ceil(term_len / plan.chunk_size)
 
-    amount_of_chunks = math.ceil(term_len / CHUNK_SIZE)
+    context = None
+    if plan.mode != PROCESSES:
+        context = (_load_go_dag(), get_frequency_counts(term_table))
 
     # Effectively compute the comparisons
-    with concurrent.futures.ProcessPoolExecutor(max_workers=PROCESSES) as executor:
+    with create_executor(plan, _init_worker) as executor:
         bar = IncrementalBar('Processing', max=amount_of_chunks, suffix='%(percent)d%% - Elapsed: %(elapsed)ds - Remaining: %(eta)ds')
-        for result in executor.map(_do_compute_highest_inc, (terms[i:i + CHUNK_SIZE] for i in range(0, term_len, CHUNK_SIZE))):
+        chunks = ((i, (terms[i:i + plan.chunk_size], context)) for i in range(0, term_len, plan.chunk_size))
+        for _, result in map_bounded(executor, _do_compute_highest_inc, chunks, plan.max_pending):
             bar.next()
             highest_ic_anc.update(result)
+            if checkpoint is not None:
+                checkpoint.put_many(result.items())
         bar.finish()
 
-    with open(HIGHEST_IC_FILE_PATH, 'w') as json_file:
-        json.dump(highest_ic_anc, json_file)
-
-
-def get_highest_ic():
-    if not os.path.isfile(HIGHEST_IC_FILE_PATH):
-        go_dag = GODag(GO_DAG_FILE_PATH, prt=open(os.devnull, 'w'))
-        compute_highest_inc_parallel(list(go_dag.keys()))
-
-    ic_file = open(HIGHEST_IC_FILE_PATH, 'r')
-    highest_ic_anc = json.load(ic_file)
-    ic_file.close()
-
-    return highest_ic_anc
+    TermArray.from_dict(term_table, highest_ic_anc).save(path, source)
+
+
+def get_highest_ic(term_table=None):
+    """Returns a TermArray with the information content of the most informative ancestor of every term. Stored values
+    are only used if they have been derived from the installed GO DAG. Otherwise the values are converted from the JSON
+    file of previous releases or precomputed, and stored in the cache directory."""
+    if term_table is None:
+        term_table = TermTable(_load_go_dag())
+
+    source = obo_fingerprint(GO_DAG_FILE_PATH)
+    highest_ic_anc = _load_resource((HIGHEST_IC_FILE_PATH, CACHED_HIGHEST_IC_FILE_PATH), term_table, source)
+    if highest_ic_anc is not None:
+        return highest_ic_anc
+
+    # The file covers all terms of the default GO DAG, also if term_table only contains a slice of it (see
+    # megago.partitions). The values are aligned with term_table when they're loaded.
+    full_table = TermTable(_load_go_dag())
+    os.makedirs(os.path.dirname(CACHED_HIGHEST_IC_FILE_PATH), exist_ok=True)
+    if os.path.isfile(LEGACY_HIGHEST_IC_FILE_PATH):
+        _convert_legacy_file(LEGACY_HIGHEST_IC_FILE_PATH, CACHED_HIGHEST_IC_FILE_PATH, full_table, source)
+    else:
+        fingerprint = _input_fingerprint()
+        try:
+            checkpoint = Checkpoint(HIGHEST_IC_CHECKPOINT_FILE_PATH, fingerprint)
+        except ValueError:
+            # The checkpoint was created for another GO DAG or other frequency counts.
+            checkpoint = Checkpoint(HIGHEST_IC_CHECKPOINT_FILE_PATH, fingerprint, resume=False)
+        with checkpoint:
+            compute_highest_inc_parallel([full_table.go_id(index) for index in range(len(full_table))], full_table,
+                                         checkpoint=checkpoint, source=source)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(HIGHEST_IC_CHECKPOINT_FILE_PATH + suffix):
+                os.remove(HIGHEST_IC_CHECKPOINT_FILE_PATH + suffix)
+
+    return TermArray.load(CACHED_HIGHEST_IC_FILE_PATH, term_table, source)
 
 
 if __name__ == "__main__":
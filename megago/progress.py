@@ -0,0 +1,190 @@
+"""Progress of comparisons, measured inside the workers that compute the similarities.
+
+Every task that's in flight owns one slot of a shared-memory array of counters. The worker that executes a task writes
+the amount of pairs it has compared to its slot after every row. This is a plain write to shared memory: no messages
+are sent, and no locks are needed since every slot has only one owner. A reporter thread samples the counters at a
+fixed rate and passes the progress of the complete comparison (all GO-domains) to a listener.
+
+A task that has been cancelled or has failed may still be running in a worker process when its slot is released and
+handed to the next task. Every counter is therefore tagged with the generation of the task that wrote it (the amount of
+times its slot has been acquired), and values with the tag of another task are ignored.
+"""
+
+import collections
+import ctypes
+import multiprocessing
+import threading
+import time
+
+# Maximum amount of tasks of one session that can report their progress while they are in flight. Tasks that do not
+# receive a slot only report their progress once they have been completed.
+PROGRESS_SLOTS = 1024
+# Interval (in seconds) at which the progress is reported.
+REPORT_INTERVAL = 0.2
+# Weight of the most recent rate measurement in the estimate of the remaining time.
+ETA_SMOOTHING = 0.2
+# A counter holds the amount of compared pairs in its lowest COUNT_BITS bits and the generation of its task above these.
+COUNT_BITS = 40
+GENERATION_BITS = 63 - COUNT_BITS
+# A token identifies a task: the generation of its slot above the lowest SLOT_BITS bits, which hold the slot itself.
+SLOT_BITS = 16
+
+
+def _split_token(token):
+    """Returns (slot, generation) of a token."""
+    return token & ((1 << SLOT_BITS) - 1), token >> SLOT_BITS
+
+
+def write_progress(counters, token, pairs):
+    """Record in shared-memory counters that the task with the given token has compared pairs pairs so far. Called by
+    the workers, nothing is recorded if token is negative (the task has no slot)."""
+    if token >= 0:
+        slot, generation = _split_token(token)
+        counters[slot] = (generation << COUNT_BITS) | pairs
+
+
+class ProgressCounters(object):
+    """Shared-memory counters that can be handed to worker processes when they are started (e.g. as an argument of the
+    initializer of a process pool).
+
+    Attributes
+    ----------
+    array : multiprocessing.RawArray
+        the amount of compared pairs of every slot
+    """
+
+    def __init__(self, slots=PROGRESS_SLOTS):
+        if slots > 1 << SLOT_BITS:
+            raise ValueError(f"At most {1 << SLOT_BITS} progress slots are supported, but {slots} were requested.")
+        self.array = multiprocessing.RawArray(ctypes.c_int64, slots)
+        self._free = collections.deque(range(slots))
+        self._generations = [0] * slots
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns the token of a free slot whose counter has been reset (see write_progress), or -1 if all slots are
+        in use."""
+        with self._lock:
+            if not self._free:
+                return -1
+            slot = self._free.popleft()
+            generation = self._generations[slot] = (self._generations[slot] + 1) % (1 << GENERATION_BITS)
+        self.array[slot] = generation << COUNT_BITS
+        return (generation << SLOT_BITS) | slot
+
+    def release(self, token):
+        if token >= 0:
+            with self._lock:
+                self._free.append(_split_token(token)[0])
+
+    def read(self, token):
+        """Returns the amount of pairs that the task with the given token has compared so far. Values that have been
+        written by a previous owner of its slot are not counted."""
+        slot, generation = _split_token(token)
+        value = self.array[slot]
+        return value & ((1 << COUNT_BITS) - 1) if value >> COUNT_BITS == generation else 0
+
+
+class EtaEstimator(object):
+    """Estimates the remaining time of a computation from its progress, using an exponentially smoothed rate."""
+
+    def __init__(self, smoothing=ETA_SMOOTHING):
+        self.smoothing = smoothing
+        self._rate = None
+        self._previous = None
+
+    def update(self, fraction, now=None):
+        """Record the progress (between 0 and 1) at time now.
+
+        Returns
+        -------
+        float
+            the estimated remaining time in seconds, or None if there's no estimate yet
+        """
+        now = time.monotonic() if now is None else now
+        if self._previous is not None and now > self._previous[0]:
+            rate = (fraction - self._previous[1]) / (now - self._previous[0])
+            self._rate = rate if self._rate is None else self.smoothing * rate + (1 - self.smoothing) * self._rate
+        self._previous = (now, fraction)
+        if fraction >= 1:
+            return 0.0
+        if not self._rate or self._rate <= 0:
+            return None
+        return (1 - fraction) / self._rate
+
+
+class ProgressTracker(object):
+    """Progress of one comparison, which may consist of many tasks. Reports are only sent while the tracker is used as
+    a context manager:
+
+        with ProgressTracker(counters, total, listener) as tracker:
+            ...
+
+    Parameters
+    ----------
+    counters : ProgressCounters
+        the counters that are shared with the workers
+    total : int
+        the amount of pairs that will be compared
+    listener : function (number) => void
+        is called with the progress (between 0 and 1) every interval seconds
+    interval : float
+    """
+
+    def __init__(self, counters, total, listener, interval=REPORT_INTERVAL):
+        self.counters = counters
+        self.total = total
+        self.listener = listener
+        self.interval = interval
+        self._completed = 0
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._report, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        with self._lock:
+            # Slots of tasks that have been cancelled or have failed. Their workers may still be writing to them, but
+            # these writes are tagged with the token of the task and are ignored by the next owner of the slot.
+            for token in self._in_flight:
+                self.counters.release(token)
+            self._in_flight.clear()
+
+    def start_task(self):
+        """Returns the token of the slot that a new task should report its progress in (-1 if no slot is available)."""
+        token = self.counters.acquire()
+        if token >= 0:
+            with self._lock:
+                self._in_flight.add(token)
+        return token
+
+    def finish_task(self, token, pairs):
+        """Record that the task with the given token has compared all of its pairs."""
+        with self._lock:
+            self._in_flight.discard(token)
+            self._completed += pairs
+        self.counters.release(token)
+
+    def add(self, pairs):
+        """Record pairs that have been compared without a task (e.g. results that were cached)."""
+        with self._lock:
+            self._completed += pairs
+
+    def done(self):
+        """Returns the amount of pairs that have been compared so far."""
+        with self._lock:
+            return self._completed + sum(self.counters.read(token) for token in self._in_flight)
+
+    def fraction(self):
+        return min(1.0, self.done() / self.total) if self.total > 0 else 1.0
+
+    def _report(self):
+        while not self._stopped.wait(self.interval):
+            self.listener(self.fraction())
@@ -0,0 +1,191 @@
+"""Functional similarity of gene products (megago --proteins PROTEIN_TABLE).
+
+A protein is annotated with only a handful of GO-terms, so comparing two proteins with compare() is dominated by the
+fixed cost of a comparison (splitting the terms per domain, planning, submitting tasks) instead of by the metric. Many
+proteins are therefore compared in one batch:
+
+1. The terms of all proteins are divided over the GO-domains, and the similarity matrix over the union of the terms of
+   each domain is computed once (see megago.significance.compute_similarity_matrix). All pairs of proteins share this
+   matrix.
+2. The terms of every protein are stored as a row of a padded index array. The best match averages of a block of
+   proteins are then computed at once by selecting similarities from the matrix and reducing them with numpy. Blocks
+   are scored by a pool of threads, since numpy releases the GIL while doing so.
+
+The best match average of two proteins is the same as that of compare(): duplicate terms are counted, terms that are
+not present in the ontology are ignored, the similarity is 0 if both proteins have no terms in a domain and NaN if only
+one of them has.
+"""
+
+import concurrent.futures
+
+import numpy as np
+
+from .constants import GO_DOMAINS
+from .execution import available_cpus, plan_execution
+from .significance import compute_similarity_matrix
+
+# Maximum amount of similarities that are selected from the similarity matrix at once by one thread.
+BLOCK_ELEMENTS = 1 << 22
+
+
+def read_protein_pairs(path, proteins):
+    """Read the pairs of proteins that should be compared from a tab separated file with two protein identifiers per
+    line. Empty lines and lines that start with # are ignored.
+
+    Parameters
+    ----------
+    path : str
+    proteins : list
+        identifiers of all proteins, in the order of their indices
+
+    Returns
+    -------
+    list
+        (i, j) tuples with the indices of the proteins of every pair
+    """
+    indices = {protein: i for i, protein in enumerate(proteins)}
+    pairs = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 2:
+                raise ValueError(f"{path}, line {line_number}: expected 'PROTEIN_1<TAB>PROTEIN_2', but found {line!r}")
+            for protein in fields:
+                if protein not in indices:
+                    raise ValueError(f"{path}, line {line_number}: unknown protein {protein}")
+            pairs.append((indices[fields[0]], indices[fields[1]]))
+    return pairs
+
+
+def _pad_domains(proteins, table):
+    """Divide the terms of every protein over the GO-domains.
+
+    Returns
+    -------
+    list
+        a (terms, padded) tuple for every domain: the sorted primary identifiers of all terms of that domain, and a
+        len(proteins) x max_terms array with the position in terms of every term of each protein. Rows are padded with
+        len(terms).
+    """
+    lengths = np.fromiter((len(terms) for terms in proteins), dtype=np.int64, count=len(proteins))
+    flat = table.indices([term for terms in proteins for term in terms]).astype(np.int64)
+    owners = np.repeat(np.arange(len(proteins)), lengths)
+    known = flat >= 0
+    flat = flat[known]
+    owners = owners[known]
+    namespaces = table.namespaces[flat]
+
+    output = []
+    for domain in range(len(GO_DOMAINS)):
+        in_domain = namespaces == domain
+        indices = flat[in_domain]
+        rows = owners[in_domain]
+        union, positions = np.unique(indices, return_inverse=True)
+        counts = np.bincount(rows, minlength=len(proteins))
+        padded = np.full((len(proteins), int(counts.max(initial=0))), len(union), dtype=np.intp)
+        # Position of every term within the row of its protein (owners are in ascending order).
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        padded[rows, np.arange(len(rows)) - starts[rows]] = positions
+        output.append(([table.go_id(index) for index in union], padded))
+    return output
+
+
+def _best_match_average(total, length1, length2):
+    """Divide the summed best matches of pairs of proteins by their amount of terms, with the same special cases as
+    megago.metrics.bma_from_best_matches."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bma = total / (length1 + length2)
+    bma = np.where((length1 == 0) != (length2 == 0), np.nan, bma)
+    return np.where((length1 == 0) & (length2 == 0), 0.0, bma)
+
+
+def _pairs_block(matrix, rows, columns, size):
+    """Best match average of the pairs of proteins with the padded term positions rows[k] and columns[k].
+
+    matrix has an extra row and column of -1 for the padding, which is never the best match of a term (all actual
+    similarities are at least 0). Padded terms are not counted.
+    """
+    similarities = matrix[rows[:, :, None], columns[:, None, :]]
+    valid1 = rows < size
+    valid2 = columns < size
+    total = np.where(valid1, similarities.max(axis=2, initial=-1.0), 0.0).sum(axis=1) + \
+        np.where(valid2, similarities.max(axis=1, initial=-1.0), 0.0).sum(axis=1)
+    return _best_match_average(total, valid1.sum(axis=1), valid2.sum(axis=1))
+
+
+def _domain_similarities(matrix, padded, pairs, workers):
+    size = len(matrix)
+    extended = np.full((size + 1, size + 1), -1.0)
+    extended[:size, :size] = matrix
+    width = max(1, padded.shape[1])
+    lengths = (padded < size).sum(axis=1)
+
+    if pairs is None:
+        # All-vs-all: instead of selecting the width x width similarities of every pair of proteins, the best match of
+        # every term with every protein is computed first. sums[p, q] is then the sum of the best matches of the terms
+        # of p with protein q, which only takes width additions per pair. Every block holds a range of columns.
+        amount = len(padded)
+        block = max(1, BLOCK_ELEMENTS // (width * max(size + 1, amount)))
+        sums = np.empty((amount, amount))
+
+        def score(start):
+            best = extended[:, padded[start:start + block]].max(axis=2, initial=-1.0)
+            best[size] = 0.0
+            sums[:, start:start + block] = best[padded].sum(axis=1)
+    else:
+        amount = len(pairs)
+        block = max(1, BLOCK_ELEMENTS // (width * width))
+        pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+        output = np.empty(amount)
+
+        def score(start):
+            selected = pairs[start:start + block]
+            output[start:start + block] = _pairs_block(extended, padded[selected[:, 0]], padded[selected[:, 1]], size)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() propagates the exceptions of the blocks.
+        list(executor.map(score, range(0, amount, block)))
+
+    if pairs is None:
+        return _best_match_average(sums + sums.T, lengths[:, None], lengths[None, :])
+    return output
+
+
+def compare_proteins(proteins, session, pairs=None, domains=None):
+    """Compute the similarity of many proteins (or other gene products) for each of the GO-domains.
+
+    Parameters
+    ----------
+    proteins : list
+        the GO-terms of every protein
+    session : Session
+        the session whose ontology, corpus tables, similarity method and execution settings are used
+    pairs : list, optional
+        (i, j) tuples with the indices of the proteins that should be compared. All proteins are compared with each
+        other if not given.
+    domains : list, optional
+        the GO-domains that should be compared, all domains if not given
+
+    Returns
+    -------
+    tuple
+        A tuple with 3 arrays, for biological process, cellular component and molecular function respectively. These
+        are len(proteins) x len(proteins) similarity matrices, or contain the similarity of every pair in pairs. The
+        arrays of the domains that are not compared only contain NaN.
+    """
+    workers = session.workers or available_cpus()
+    output = []
+    for domain, (terms, padded) in zip(GO_DOMAINS, _pad_domains(proteins, session.term_table)):
+        if domains is not None and domain not in domains:
+            output.append(np.full((len(proteins), len(proteins)) if pairs is None else len(pairs), np.nan))
+            continue
+        plan = plan_execution(len(terms), len(terms), mode=session._execution_mode(), workers=session.workers,
+                              chunk_size=session.chunk_size, tile_size=session.tile_size, backend=session.backend)
+        matrix = compute_similarity_matrix(terms, session.term_counts, session.highest_ic_anc,
+                                           session.similarity_method, session.go_dag, plan,
+                                           session._get_executor(plan), session.pair_cache)
+        output.append(_domain_similarities(matrix, padded, pairs, workers))
+    return tuple(output)
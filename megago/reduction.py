@@ -0,0 +1,191 @@
+"""Shrink samples before they are compared, by removing GO-terms that add little information to the best match average.
+
+Two reductions are supported:
+
+* leaves: a term is removed if a more specific term (one of its descendants) is present in the same sample.
+* slim: every term is replaced by the most specific terms of a GO slim that are ancestors of it. Terms without an
+  ancestor in the GO slim are removed.
+
+The cost of a comparison grows with the product of the amount of unique terms in both samples, so that even a modest
+reduction can save a lot of time for large samples. Since the reduced samples no longer contain the same terms, the
+similarity of the reduced samples differs from the similarity of the original samples. estimate_effect estimates this
+difference from a random subset of the original terms.
+"""
+
+import math
+import random
+import re
+
+LEAVES = "leaves"
+SLIM = "slim"
+REDUCTION_MODES = [LEAVES, SLIM]
+
+# Amount of terms per sample for which the best match is computed to estimate the effect of a reduction.
+ESTIMATE_SAMPLE_SIZE = 100
+
+
+class TermReduction(object):
+    """The result of reducing one sample.
+
+    Attributes
+    ----------
+    mode : str
+        'leaves' or 'slim'
+    original : list
+        the GO-terms of the sample before it was reduced
+    terms : list
+        the GO-terms of the reduced sample. Duplicates are kept, such that terms that occur more than once still weigh
+        more in the best match average.
+    removed : int
+        the amount of terms from the original sample that are not present in the reduced sample
+    """
+
+    def __init__(self, mode, original, terms, removed):
+        self.mode = mode
+        self.original = original
+        self.terms = terms
+        self.removed = removed
+
+    def __repr__(self):
+        return (f"TermReduction(mode={self.mode!r}, original={len(set(self.original))} unique terms, "
+                f"reduced={len(set(self.terms))} unique terms, removed={self.removed})")
+
+
+def reduce_leaves(go_terms, ancestor_index):
+    """Remove all terms of which a descendant is present in the same sample. Terms that are not present in the ontology
+    are left untouched.
+
+    Parameters
+    ----------
+    go_terms : list
+        all GO-terms present in the sample
+    ancestor_index : AncestorIndex
+        see megago.ontology
+
+    Returns
+    -------
+    TermReduction
+    """
+    present = set(term for term in go_terms if term in ancestor_index)
+    covered = set()
+    for term in present:
+        primary = ancestor_index.primary_id(term)
+        covered.update(ancestor for ancestor in ancestor_index.ancestors(term) if ancestor != primary)
+
+    terms = [term for term in go_terms if term not in present or ancestor_index.primary_id(term) not in covered]
+    return TermReduction(LEAVES, go_terms, terms, len(go_terms) - len(terms))
+
+
+def reduce_to_slim(go_terms, ancestor_index, slim_terms):
+    """Replace every term by the most specific terms of a GO slim that are one of its ancestors (or the term itself).
+    This corresponds to the "direct ancestors" that are reported by the map2slim tool of goatools. Terms that do not
+    have an ancestor in the GO slim are removed.
+
+    Parameters
+    ----------
+    go_terms : list
+        all GO-terms present in the sample
+    ancestor_index : AncestorIndex
+        see megago.ontology
+    slim_terms : iterable
+        the GO-terms of the GO slim
+
+    Returns
+    -------
+    TermReduction
+    """
+    slim = set(ancestor_index.primary_id(term) for term in slim_terms if term in ancestor_index)
+
+    mapping = dict()
+    for term in set(go_terms):
+        if term not in ancestor_index:
+            mapping[term] = []
+            continue
+        candidates = ancestor_index.ancestors(term) & slim
+        # Only keep the candidates that are not an ancestor of another candidate.
+        redundant = set()
+        for candidate in candidates:
+            redundant.update(ancestor for ancestor in ancestor_index.ancestors(candidate) if ancestor != candidate)
+        mapping[term] = sorted(candidates - redundant)
+
+    terms = [slim_term for term in go_terms for slim_term in mapping[term]]
+    removed = sum(1 for term in go_terms if term not in ancestor_index or ancestor_index.primary_id(term) not in slim)
+    return TermReduction(SLIM, go_terms, terms, removed)
+
+
+def reduce_terms(go_terms, ancestor_index, mode, slim_terms=None):
+    """Reduce a sample with one of the REDUCTION_MODES (see reduce_leaves and reduce_to_slim).
+
+    Returns
+    -------
+    TermReduction
+    """
+    if mode == LEAVES:
+        return reduce_leaves(go_terms, ancestor_index)
+    if mode == SLIM:
+        if slim_terms is None:
+            raise ValueError("A GO slim is required to reduce terms with the slim mode.")
+        return reduce_to_slim(go_terms, ancestor_index, slim_terms)
+    raise ValueError(f"mode must be in {REDUCTION_MODES} but is {mode}")
+
+
+def read_slim(path):
+    """Read the terms of a GO slim. This can either be an OBO-file (e.g. goslim_generic.obo), of which the identifiers
+    of all terms are used, or a file with GO-terms separated by white space.
+
+    Returns
+    -------
+    list
+    """
+    with open(path) as f:
+        content = f.read()
+    if path.endswith(".obo"):
+        return re.findall(r"^id:\s*(GO:\d{7})", content, re.MULTILINE)
+    return re.findall(r"GO:\d{7}", content)
+
+
+def estimate_effect(reduction_1, reduction_2, reduced_score, best_matches, sample_size=ESTIMATE_SAMPLE_SIZE, seed=0):
+    """Estimate how much the best match average of two reduced samples differs from that of the original samples.
+
+    The best match average of the original samples is the mean of the best match of every term. It is estimated by
+    computing the best match of at most sample_size randomly chosen terms per sample (against all terms of the other
+    original sample), which costs O(sample_size * (n + m)) comparisons instead of O(n * m).
+
+    Parameters
+    ----------
+    reduction_1 : TermReduction
+        reduction of the first sample (one GO-domain)
+    reduction_2 : TermReduction
+        reduction of the second sample (same GO-domain)
+    reduced_score : float
+        the best match average of the reduced samples
+    best_matches : function (list, list) => list
+        returns the highest similarity of each term in the first list with any term of the second list
+    sample_size : int
+        maximum amount of terms per sample for which the best match is computed
+    seed : int
+        seed of the random number generator, such that the estimate is reproducible
+
+    Returns
+    -------
+    tuple
+        (estimated best match average of the original samples, estimated difference between the original and the
+        reduced best match average). Both are NaN if one of the original samples is empty.
+    """
+    original_1 = reduction_1.original
+    original_2 = reduction_2.original
+    if not original_1 or not original_2:
+        return math.nan, math.nan
+
+    rng = random.Random(seed)
+
+    def mean_best_match(terms, others):
+        subset = terms if len(terms) <= sample_size else rng.sample(terms, sample_size)
+        unique = list(set(subset))
+        best = dict(zip(unique, best_matches(unique, list(set(others)))))
+        return sum(best[term] for term in subset) / len(subset)
+
+    total = len(original_1) + len(original_2)
+    estimate = (len(original_1) * mean_best_match(original_1, original_2) +
+                len(original_2) * mean_best_match(original_2, original_1)) / total
+    return estimate, estimate - reduced_score
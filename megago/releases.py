@@ -0,0 +1,185 @@
+"""Registry of Gene Ontology releases that are loaded side by side.
+
+A release consists of a GO DAG and the corpus tables that have been derived from it (see megago.ontology.TermArray).
+Every release lives in its own directory:
+
+    <directory>/go-basic.obo
+    <directory>/frequency_counts_uniprot.npz  (or the .json file of previous releases)
+    <directory>/highest_ic_uniprot.npz        (or the .json file of previous releases)
+
+The .npz files record the fingerprint of the go-basic.obo file they have been derived from (see TermArray.save), and a
+release whose files have been derived from another version of its ontology is refused.
+
+Jobs acquire a release for as long as they need it. Registering a release under a name that's already taken, or
+changing the default release, happens atomically: new jobs immediately use the new release, while running jobs finish
+on the release they started with. A release that has been replaced is unloaded as soon as its last job has finished.
+"""
+
+import contextlib
+import json
+import os
+import threading
+
+from .constants import FREQUENCY_COUNTS_FILE_PATH, GO_DAG_FILE_PATH, HIGHEST_IC_FILE_PATH
+from .ontology import TermArray, TermTable, obo_fingerprint
+from .partitions import partition_obo
+from .precompute_frequency_counts import get_frequency_counts
+from .precompute_highest_ic import get_highest_ic
+from .session import Session
+
+GO_DAG_FILE_NAME = os.path.basename(GO_DAG_FILE_PATH)
+FREQUENCY_COUNTS_FILE_NAME = os.path.basename(FREQUENCY_COUNTS_FILE_PATH)
+HIGHEST_IC_FILE_NAME = os.path.basename(HIGHEST_IC_FILE_PATH)
+
+
+def _load_term_array(path, table, source):
+    """Read a TermArray that has been derived from the OBO file with the given fingerprint (a ValueError is raised
+    otherwise), or convert the JSON dictionary of a previous release."""
+    if os.path.isfile(path):
+        return TermArray.load(path, table, source)
+    legacy_path = os.path.splitext(path)[0] + ".json"
+    if os.path.isfile(legacy_path):
+        with open(legacy_path) as json_file:
+            return TermArray.from_dict(table, json.load(json_file))
+    raise FileNotFoundError(f"Neither {path} nor {legacy_path} exists.")
+
+
+class Release(object):
+    """A GO release that's ready to be used: its ontology and corpus tables are loaded in a Session.
+
+    Parameters
+    ----------
+    name : str
+    session : Session
+        the session that computes all similarities of this release. It's closed when the release is unloaded.
+    """
+
+    def __init__(self, name, session):
+        self.name = name
+        self.session = session
+        # Amount of jobs that are using this release, and whether it has been replaced by another release.
+        self._jobs = 0
+        self._retired = False
+
+    def __repr__(self):
+        return f"Release(name={self.name!r}, jobs={self._jobs}, retired={self._retired})"
+
+    @property
+    def go_dag(self):
+        return self.session.go_dag
+
+    @property
+    def data_version(self):
+        """The data-version of the ontology (e.g. releases/2021-02-01), if it has one."""
+        return getattr(self.go_dag, "data_version", None)
+
+    @classmethod
+    def load(cls, name, directory=None, domains=None):
+        """Load the release that's stored in directory, or the release that's bundled with MegaGO if no directory is
+        given. Only the slice of the ontology with the given GO-domains is loaded if domains is given (see
+        megago.partitions)."""
+        from goatools.obo_parser import GODag
+
+        if directory is None:
+            go_dag_path = partition_obo(GO_DAG_FILE_PATH, domains) if domains else GO_DAG_FILE_PATH
+            go_dag = GODag(go_dag_path, optional_attrs={'relationship'}, prt=open(os.devnull, 'w'))
+            table = TermTable(go_dag)
+            term_counts = get_frequency_counts(table)
+            highest_ic_anc = get_highest_ic(table)
+        else:
+            go_dag_path = os.path.join(directory, GO_DAG_FILE_NAME)
+            source = obo_fingerprint(go_dag_path)
+            if domains:
+                go_dag_path = partition_obo(go_dag_path, domains)
+            go_dag = GODag(go_dag_path, optional_attrs={'relationship'}, prt=open(os.devnull, 'w'))
+            table = TermTable(go_dag)
+            term_counts = _load_term_array(os.path.join(directory, FREQUENCY_COUNTS_FILE_NAME), table, source)
+            highest_ic_anc = _load_term_array(os.path.join(directory, HIGHEST_IC_FILE_NAME), table, source)
+
+        session = Session(go_dag=go_dag, term_counts=term_counts, highest_ic_anc=highest_ic_anc, domains=domains,
+                          go_dag_path=go_dag_path)
+        return cls(name, session)
+
+
+class ReleaseRegistry(object):
+    """All releases that are currently loaded, one of which is the default release."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._releases = dict()
+        self._default = None
+
+    @property
+    def default(self):
+        """Name of the default release."""
+        return self._default
+
+    def names(self):
+        with self._lock:
+            return sorted(self._releases)
+
+    def sessions(self):
+        """Returns a dictionary with the session of every release, by name."""
+        with self._lock:
+            return {name: release.session for name, release in self._releases.items()}
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._releases
+
+    def register(self, release, default=False):
+        """Make a (loaded) release available. A release that's registered under the same name is replaced. The first
+        release that's registered becomes the default release."""
+        with self._lock:
+            previous = self._releases.get(release.name)
+            self._releases[release.name] = release
+            if default or self._default is None:
+                self._default = release.name
+            if previous is not None and previous is not release:
+                self._retire(previous)
+
+    def set_default(self, name):
+        with self._lock:
+            if name not in self._releases:
+                raise KeyError(name)
+            self._default = name
+
+    def unregister(self, name):
+        """Remove a release. It's unloaded as soon as all jobs that are using it have finished."""
+        with self._lock:
+            if name == self._default:
+                raise ValueError("The default release cannot be removed.")
+            self._retire(self._releases.pop(name))
+
+    def _retire(self, release):
+        release._retired = True
+        if release._jobs == 0:
+            release.session.close()
+
+    @contextlib.contextmanager
+    def acquire(self, name=None):
+        """Use a release (the default release if name is None) for the duration of the with block:
+
+            with registry.acquire(name) as release:
+                release.session.compare(sample1, sample2)
+
+        Raises a KeyError if no release with the given name exists.
+        """
+        with self._lock:
+            release = self._releases[name if name is not None else self._default]
+            release._jobs += 1
+        try:
+            yield release
+        finally:
+            with self._lock:
+                release._jobs -= 1
+                if release._retired and release._jobs == 0:
+                    release.session.close()
+
+    def close(self):
+        """Unload all releases."""
+        with self._lock:
+            for release in self._releases.values():
+                self._retire(release)
+            self._releases.clear()
+            self._default = None
@@ -0,0 +1,593 @@
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+
+from .constants import GO_DAG_FILE_PATH, GO_DOMAINS, NAN_VALUE
+from .clustering import DEFAULT_THRESHOLD, GREEDY, cluster_terms
+from .execution import ENV_EXECUTION, PROCESSES, THREADS, SerialExecutor, available_cpus, plan_execution
+from .metrics import SIMILARITY_METHODS, compute_bma_metric, compute_best_matches, compute_similarity_method, \
+    get_corpus_tables, _init_worker
+from .ontology import AncestorIndex, TermTable
+from .pair_cache import shared_pair_cache
+from .partitions import parse_domains, partition_obo
+from .precompute_frequency_counts import get_frequency_counts
+from .precompute_highest_ic import get_highest_ic
+from .progress import ProgressCounters, ProgressTracker
+from .proteins import compare_proteins
+from .reduction import estimate_effect, reduce_terms
+from .significance import DEFAULT_BOOTSTRAPS, DEFAULT_CONFIDENCE, DEFAULT_PERMUTATIONS, SignificanceResult, \
+    assess_significance, compute_similarity_matrix
+
+# How many similarity values (one per domain and pair of samples) should be remembered by a session?
+RESULT_CACHE_SIZE = 1024
+
+_DEFAULT_SESSION = None
+
+
+def get_default_go_dag(domains=None):
+    """Returns the Gene Ontology that's bundled with MegaGO, or its slice with only the given domains (see
+    megago.partitions)."""
+    from goatools.obo_parser import GODag
+
+    path = partition_obo(GO_DAG_FILE_PATH, domains) if domains else GO_DAG_FILE_PATH
+    return GODag(path, optional_attrs={'relationship'}, prt=open(os.devnull, 'w'))
+
+
+def split_per_domain(go_terms, go_dag, domains=None):
+    """ Split a list of go_terms into three different lists that correspond to the GO-domains.
+
+    Parameters
+    ----------
+    go_terms : a list of strings
+        a list of GO terms that need to be divided over the different GO-domains.
+    go_dag : a graph that represents the Gene Ontology
+    domains : list, optional
+        the selected GO-domains. The lists of the other domains are empty. Terms that are not present in go_dag are
+        only logged at the debug level if given, since go_dag might be a slice that only contains the selected domains.
+
+    Returns
+    -------
+    biological_process, cellular_component, molecular_function
+        Three different lists with respectively the GO-terms that belong to the biological process, cellular component
+        and molecular function domains.
+    """
+    output = {domain: [] for domain in GO_DOMAINS}
+
+    for go_term in go_terms:
+        if go_term in go_dag:
+            ns = go_dag[go_term].namespace
+            output[ns].append(go_term)
+        elif domains is None:
+            logging.warning(f"{go_term} was not found in the Gene Ontology parsed by this script.")
+        else:
+            logging.debug(f"{go_term} was not found in the selected GO-domains of the Gene Ontology.")
+
+    return [output[domain] if domains is None or domain in domains else [] for domain in GO_DOMAINS]
+
+
+def _fingerprint(go_list):
+    """Returns a digest that identifies a multiset of GO-terms, independent of the order of the terms."""
+    return hashlib.sha1("\n".join(sorted(go_list)).encode("utf-8")).hexdigest()
+
+
+class Session(object):
+    """A MegaGO session keeps the Gene Ontology, the corpus tables, the worker pools and caches in memory, such that
+    they can be reused by many comparisons. This is much faster than calling run_comparison in a loop when processing a
+    lot of samples.
+
+    A session can be used by multiple threads at the same time (e.g. to compare several pairs of samples concurrently).
+    It should be closed when it is no longer needed, either by calling close() or by using it as a context
+    manager:
+
+        with Session() as session:
+            for sample1, sample2 in pairs:
+                print(session.compare(sample1, sample2))
+
+    Parameters
+    ----------
+    go_dag : GODag object, optional
+        GODag object from the goatools package. Loaded from go_dag_path, or the default Gene Ontology, if not given.
+    go_dag_path : str, optional
+        the OBO file of go_dag, from which worker processes load the GO DAG. A session that's given a go_dag without its
+        file cannot use worker processes, and runs its comparisons on threads instead.
+    similarity_method : str
+        'lin', 'rel' or 'wang'
+    execution : str, optional
+        one of 'serial', 'threads' or 'processes'. Chosen by the execution planner for every comparison if not given.
+    workers : int, optional
+        maximum amount of threads or processes that are used. Defaults to the amount of available CPUs.
+    chunk_size : int, optional
+        amount of GO-terms that are processed per task. Chosen by the execution planner if not given.
+    tile_size : int, optional
+        maximum amount of GO-terms from the second sample that are compared per task.
+    reduction : str, optional
+        'leaves' or 'slim'. If given, both samples are reduced before they are compared (see megago.reduction).
+    slim_terms : list, optional
+        the GO-terms of the GO slim that's used by the 'slim' reduction
+    term_counts, highest_ic_anc : TermArray, optional
+        the corpus tables that belong to go_dag (see megago.releases). The default tables are loaded if not given.
+    backend : str, optional
+        'python' or 'numpy' (see megago.execution.BACKENDS). Defaults to the MEGAGO_BACKEND environment variable, or
+        'python' if it's not set.
+    pair_cache : PairCache, optional
+        cache of the similarities of pairs of terms (see megago.pair_cache). Defaults to the pair cache that's shared by
+        all sessions of this process, which is only enabled if the MEGAGO_PAIR_CACHE_SIZE environment variable is set.
+    domains : list, optional
+        the GO-domains that can be compared (see megago.partitions.parse_domains), all domains if not given. Only the
+        slice of the default Gene Ontology with these domains is loaded if go_dag is not given.
+    """
+
+    def __init__(self, go_dag=None, similarity_method="lin", execution=None, workers=None, chunk_size=None,
+                 tile_size=None, reduction=None, slim_terms=None, term_counts=None, highest_ic_anc=None, backend=None,
+                 pair_cache=None, domains=None, go_dag_path=None):
+        from goatools.obo_parser import GODag
+
+        self.domains = parse_domains(domains) if domains else list(GO_DOMAINS)
+        # File from which worker processes load the GO DAG (they only receive the corpus tables), None if unknown.
+        self.go_dag_path = go_dag_path
+        if go_dag is None:
+            self.go_dag_path = partition_obo(go_dag_path or GO_DAG_FILE_PATH, self.domains)
+            go_dag = GODag(self.go_dag_path, optional_attrs={'relationship'}, prt=open(os.devnull, 'w'))
+        self.go_dag = go_dag
+        if term_counts is not None and highest_ic_anc is not None:
+            self.term_table = term_counts.table
+            self.term_counts = term_counts
+            self.highest_ic_anc = highest_ic_anc
+        else:
+            self.term_table = TermTable(self.go_dag)
+            self.term_counts = get_frequency_counts(self.term_table)
+            self.highest_ic_anc = get_highest_ic(self.term_table)
+        self.similarity_method = similarity_method
+        self.execution = execution
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.backend = backend
+        self.reduction = reduction
+        self.slim_terms = slim_terms
+        self.pair_cache = pair_cache if pair_cache is not None else shared_pair_cache()
+
+        # Counters in which running tasks report their progress, shared with the worker processes.
+        self.progress_counters = ProgressCounters()
+
+        self._ancestor_index = None
+        # Protects the executors and the result cache against concurrent comparisons.
+        self._lock = threading.RLock()
+        self._executors = dict()
+        self._results = collections.OrderedDict()
+        # Operational statistics (see statistics), which are updated while the lock is held anyway.
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._pairs_compared = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down all worker pools that have been started by this session."""
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown()
+            self._executors.clear()
+            self._results.clear()
+            self._closed = True
+
+    def fingerprint(self):
+        """Returns a hexadecimal digest of the ontology and corpus of this session, which identifies the results it
+        computes (e.g. in a checkpoint or a reference library) across GO releases and frequency count updates."""
+        return get_corpus_tables(self.term_counts, self.highest_ic_anc).fingerprint.hex()
+
+    @property
+    def ancestor_index(self):
+        """AncestorIndex for the ontology and corpus of this session (created on first use)."""
+        if self._ancestor_index is None:
+            self._ancestor_index = AncestorIndex(self.go_dag, self.term_counts)
+        return self._ancestor_index
+
+    def _get_executor(self, plan):
+        """Returns the (persistent) executor of this session that can run the given plan."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("This session has already been closed.")
+
+            if plan.mode not in self._executors:
+                workers = self.workers or available_cpus()
+                if plan.mode == PROCESSES:
+                    if self.go_dag_path is None:
+                        raise ValueError("Worker processes load the GO DAG from its file, which has not been given "
+                                         "(see go_dag_path).")
+                    self._executors[plan.mode] = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=workers,
+                        initializer=_init_worker,
+                        initargs=(self.go_dag_path, self.term_counts, self.highest_ic_anc,
+                                  self.progress_counters.array, self.pair_cache)
+                    )
+                elif plan.mode == THREADS:
+                    self._executors[plan.mode] = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+                else:
+                    self._executors[plan.mode] = SerialExecutor()
+            return self._executors[plan.mode]
+
+    def _execution_mode(self, execution=None):
+        """Returns the execution mode with which a comparison is planned. Sessions without the file of their GO DAG
+        run comparisons on threads if the planner would otherwise be free to choose processes."""
+        mode = execution or self.execution
+        if self.go_dag_path is not None or mode not in (None, PROCESSES):
+            return mode
+        if mode == PROCESSES:
+            raise ValueError("Worker processes load the GO DAG from its file, which has not been given (see "
+                             "go_dag_path).")
+        environment = os.environ.get(ENV_EXECUTION) or None
+        return environment if environment not in (None, PROCESSES) else THREADS
+
+    def _cache_result(self, key, value, comparisons=0):
+        with self._lock:
+            self._pairs_compared += comparisons
+            self._results[key] = value
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+
+    def _cached_result(self, key):
+        """Returns the cached result for key (or None), and marks it as recently used."""
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self._cache_hits += 1
+            else:
+                self._cache_misses += 1
+            return result
+
+    def statistics(self):
+        """Returns a dictionary with the amount of compared pairs of terms, result cache hits and misses, and cached
+        results of this session (see megago.monitoring). The statistics of the pair cache are included as well if the
+        session has one ("pair_cache_hits", "pair_cache_misses", "pair_cache_entries" and "pair_cache_size"), these
+        are shared with all other sessions that use the same pair cache."""
+        with self._lock:
+            output = {
+                "pairs_compared": self._pairs_compared,
+                "cache_hits": self._cache_hits,
+                "cache_misses": self._cache_misses,
+                "cache_entries": len(self._results)
+            }
+        if self.pair_cache is not None:
+            output.update({"pair_cache_" + key: value for key, value in self.pair_cache.statistics().items()})
+        return output
+
+    def _select_domains(self, domains=None):
+        """Returns the domains that should be compared, which should have been loaded by this session, or None if all
+        domains should be compared."""
+        if not domains:
+            return None if len(self.domains) == len(GO_DOMAINS) else self.domains
+        domains = parse_domains(domains)
+        missing = [domain for domain in domains if domain not in self.domains]
+        if missing:
+            raise ValueError(f"The GO-domains {missing} have not been loaded by this session.")
+        return domains if len(domains) < len(GO_DOMAINS) else None
+
+    def split_per_domain(self, go_terms, domains=None):
+        """ Split a list of GO-terms over the GO-domains (see split_per_domain). The lists of the domains that are not
+        selected (by domains, or by the domains of this session) are empty."""
+        return split_per_domain(go_terms, self.go_dag, self._select_domains(domains))
+
+    def compare_domain(self, go_list_1, go_list_2, progress_listener=None, execution=None, workers=None,
+                       chunk_size=None, tile_size=None, cancel_event=None, progress_tracker=None, backend=None):
+        """ Compute the best match average similarity of two lists of GO-terms that belong to the same domain.
+
+        Parameters
+        ----------
+        go_list_1 : a list with GO-identifiers as strings
+        go_list_2 : a list with GO-identifiers as strings
+        progress_listener: function (number) => void
+            is called with the amount of comparisons that have been performed since the previous call
+        execution, workers, chunk_size, tile_size : optional
+            override the execution settings of this session for this comparison only
+        cancel_event : threading.Event, optional
+            cancels the comparison once it's set (see megago.metrics.compute_bma_metric)
+        backend : str, optional
+            overrides the backend of this session for this comparison only
+        progress_tracker : ProgressTracker, optional
+            records the progress of the comparison while it's running, instead of progress_listener. Its counters
+            should be the progress_counters of this session.
+
+        Returns
+        -------
+        float
+        """
+        key = (self.similarity_method, _fingerprint(go_list_1), _fingerprint(go_list_2))
+        cached = self._cached_result(key)
+        if cached is not None:
+            comparisons = len(set(go_list_1)) * len(set(go_list_2))
+            if progress_tracker is not None:
+                progress_tracker.add(comparisons)
+            elif progress_listener:
+                progress_listener(comparisons)
+            return cached
+
+        # The execution planner is calibrated for this machine the first time it may choose processes.
+        plan = plan_execution(len(set(go_list_1)), len(set(go_list_2)), mode=self._execution_mode(execution),
+                              workers=workers or self.workers, chunk_size=chunk_size or self.chunk_size,
+                              tile_size=tile_size or self.tile_size, backend=backend or self.backend,
+                              resources=(self.go_dag, self.term_counts, self.highest_ic_anc))
+
+        result = compute_bma_metric(
+            go_list_1,
+            go_list_2,
+            self.term_counts,
+            self.highest_ic_anc,
+            progress_listener,
+            similarity_method=self.similarity_method,
+            go_dag=self.go_dag,
+            plan=plan,
+            executor=self._get_executor(plan),
+            cancel_event=cancel_event,
+            progress_tracker=progress_tracker,
+            pair_cache=self.pair_cache
+        )
+        self._cache_result(key, result, len(set(go_list_1)) * len(set(go_list_2)))
+        return result
+
+    def reduce(self, go_terms, reduction=None, slim_terms=None):
+        """ Reduce a sample with the given reduction mode and GO slim (or the reduction and GO slim of this session).
+
+        Returns
+        -------
+        TermReduction
+        """
+        return reduce_terms(go_terms, self.ancestor_index, reduction or self.reduction, slim_terms or self.slim_terms)
+
+    def reduction_report(self, go_list_1, go_list_2, scores=None, reduction=None, slim_terms=None):
+        """ Report how many terms are removed from both samples by a reduction, and estimate how much the similarity of
+        the reduced samples differs from the similarity of the original samples.
+
+        Parameters
+        ----------
+        go_list_1 : a list with GO-identifiers as strings
+        go_list_2 : a list with GO-identifiers as strings
+        scores : tuple, optional
+            the result of compare() for the reduced samples. Computed if not given.
+        reduction : str, optional
+            'leaves' or 'slim', defaults to the reduction of this session
+        slim_terms : list, optional
+            the GO slim of the 'slim' reduction, defaults to the GO slim of this session
+
+        Returns
+        -------
+        list
+            one dictionary per GO-domain with the amount of unique terms of both samples before ("terms_1", "terms_2")
+            and after ("reduced_1", "reduced_2") the reduction, the amount of removed terms ("removed_1", "removed_2"),
+            the estimated similarity of the original samples ("estimate") and the estimated difference with the
+            similarity of the reduced samples ("effect").
+        """
+        reduction = reduction or self.reduction
+        if scores is None:
+            scores = self.compare(go_list_1, go_list_2, reduction=reduction, slim_terms=slim_terms)
+
+        sim_func = SIMILARITY_METHODS[self.similarity_method]
+
+        def best_matches(terms, others):
+            return compute_similarity_method(terms, others, self.go_dag, self.term_counts, self.highest_ic_anc,
+                                             sim_func)[0]
+
+        output = list()
+        for terms_1, terms_2, score in zip(self.split_per_domain(go_list_1), self.split_per_domain(go_list_2), scores):
+            reduction_1 = self.reduce(terms_1, reduction, slim_terms)
+            reduction_2 = self.reduce(terms_2, reduction, slim_terms)
+            estimate, effect = estimate_effect(reduction_1, reduction_2, score, best_matches)
+            output.append({
+                "terms_1": len(set(terms_1)),
+                "terms_2": len(set(terms_2)),
+                "reduced_1": len(set(reduction_1.terms)),
+                "reduced_2": len(set(reduction_2.terms)),
+                "removed_1": reduction_1.removed,
+                "removed_2": reduction_2.removed,
+                "estimate": estimate,
+                "effect": effect
+            })
+        return output
+
+    def best_matches(self, go_list_1, go_list_2, execution=None, workers=None, chunk_size=None, tile_size=None,
+                     backend=None):
+        """ Find the best match of every term of two lists of GO-terms that belong to the same domain (see
+        megago.metrics.compute_best_matches). The best matches of multiple parts of a list can be merged by taking the
+        maximum of every term, which allows a comparison to be divided over several machines.
+
+        Returns
+        -------
+        tuple
+            (best_match_1, best_match_2) dictionaries that map every unique term onto its best match
+        """
+        plan = plan_execution(len(set(go_list_1)), len(set(go_list_2)), mode=self._execution_mode(execution),
+                              workers=workers or self.workers, chunk_size=chunk_size or self.chunk_size,
+                              tile_size=tile_size or self.tile_size, backend=backend or self.backend)
+        return compute_best_matches(go_list_1, go_list_2, self.term_counts, self.highest_ic_anc,
+                                    similarity_method=self.similarity_method, go_dag=self.go_dag, plan=plan,
+                                    executor=self._get_executor(plan), pair_cache=self.pair_cache)
+
+    def compare(self, go_list_1, go_list_2, progress=None, execution=None, workers=None, chunk_size=None,
+                tile_size=None, reduction=None, cancel_event=None, backend=None, domains=None, slim_terms=None):
+        """ Compute the similarity of two samples for each of the GO-domains.
+
+        Parameters
+        ----------
+        go_list_1 : a list with GO-identifiers as strings
+            All GO-terms present in the first sample.
+        go_list_2 : a list with GO-identifiers as strings
+            All GO-terms present in the second sample.
+        progress : function (number) => void
+            is called with the current progress value (a floating point value between 0 and 1). The progress of the
+            running tasks is sampled every megago.progress.REPORT_INTERVAL seconds, and 1 is reported at the end.
+        execution, workers, chunk_size, tile_size : optional
+            override the execution settings of this session for this comparison only
+        reduction : str, optional
+            'leaves' or 'slim', overrides the reduction of this session for this comparison only
+        cancel_event : threading.Event, optional
+            cancels the comparison once it's set. A concurrent.futures.CancelledError is raised in that case.
+        backend : str, optional
+            'python' or 'numpy', overrides the backend of this session for this comparison only
+        domains : list, optional
+            the GO-domains that should be compared, a subset of the domains of this session. Defaults to all domains of
+            this session.
+        slim_terms : list, optional
+            the GO slim of the 'slim' reduction, overrides the GO slim of this session for this comparison only
+
+        Returns
+        -------
+        tuple
+            A tuple with 3 values. These correspond to the similarity scores of biological process, cellular component
+            and molecular function respectively. The score of a domain that's not compared is NaN.
+        """
+        selected = self._select_domains(domains)
+        split_per_domain_1 = self.split_per_domain(go_list_1, selected)
+        split_per_domain_2 = self.split_per_domain(go_list_2, selected)
+
+        reduction = reduction or self.reduction
+        if reduction:
+            split_per_domain_1 = [self.reduce(terms, reduction, slim_terms).terms for terms in split_per_domain_1]
+            split_per_domain_2 = [self.reduce(terms, reduction, slim_terms).terms for terms in split_per_domain_2]
+
+        # Terms are only compared with terms of the same domain.
+        total_comparisons = sum(len(set(terms_1)) * len(set(terms_2))
+                                for terms_1, terms_2 in zip(split_per_domain_1, split_per_domain_2))
+        tracker = ProgressTracker(self.progress_counters, total_comparisons, progress) if progress else None
+
+        output = list()
+        with tracker if tracker is not None else contextlib.nullcontext():
+            for i, domain in enumerate(GO_DOMAINS):
+                if selected is not None and domain not in selected:
+                    output.append(NAN_VALUE)
+                    continue
+                output.append(self.compare_domain(split_per_domain_1[i], split_per_domain_2[i], None, execution,
+                                                  workers, chunk_size, tile_size, cancel_event, tracker, backend))
+
+        if progress:
+            progress(1)
+
+        return tuple(output)
+
+    def significance(self, go_list_1, go_list_2, permutations=DEFAULT_PERMUTATIONS, bootstraps=DEFAULT_BOOTSTRAPS,
+                     confidence=DEFAULT_CONFIDENCE, seed=None, reduction=None, domains=None, slim_terms=None):
+        """ Compute the similarity of two samples for each of the GO-domains, together with a permutation p-value and a
+        bootstrap confidence interval (see megago.significance). The similarity matrix over the union of the terms of
+        both samples is computed only once per domain and is reused by all permuted and bootstrapped samples.
+
+        Parameters
+        ----------
+        go_list_1 : a list with GO-identifiers as strings
+            All GO-terms present in the first sample.
+        go_list_2 : a list with GO-identifiers as strings
+            All GO-terms present in the second sample.
+        permutations : int
+            amount of permutations that are used to compute the p-values
+        bootstraps : int
+            amount of bootstrapped samples that are used to compute the confidence intervals
+        confidence : float
+            confidence level of the intervals
+        seed : int, optional
+            seed of the random number generators
+        reduction : str, optional
+            'leaves' or 'slim', overrides the reduction of this session
+        domains : list, optional
+            the GO-domains that should be compared (see compare)
+        slim_terms : list, optional
+            the GO slim of the 'slim' reduction, overrides the GO slim of this session
+
+        Returns
+        -------
+        tuple
+            A tuple with 3 SignificanceResult objects, for biological process, cellular component and molecular function
+            respectively. The similarity of a domain that's not compared is NaN.
+        """
+        reduction = reduction or self.reduction
+        selected = self._select_domains(domains)
+        output = list()
+        for domain, terms_1, terms_2 in zip(GO_DOMAINS, self.split_per_domain(go_list_1, selected),
+                                            self.split_per_domain(go_list_2, selected)):
+            if selected is not None and domain not in selected:
+                output.append(SignificanceResult(NAN_VALUE))
+                continue
+            if reduction:
+                terms_1 = self.reduce(terms_1, reduction, slim_terms).terms
+                terms_2 = self.reduce(terms_2, reduction, slim_terms).terms
+
+            union = sorted(set(terms_1) | set(terms_2))
+            plan = plan_execution(len(union), len(union), mode=self._execution_mode(), workers=self.workers,
+                                  chunk_size=self.chunk_size, tile_size=self.tile_size, backend=self.backend)
+            matrix = compute_similarity_matrix(union, self.term_counts, self.highest_ic_anc, self.similarity_method,
+                                               self.go_dag, plan, self._get_executor(plan), self.pair_cache)
+            index = {term: i for i, term in enumerate(union)}
+            output.append(assess_significance(matrix, [index[term] for term in terms_1],
+                                              [index[term] for term in terms_2], permutations, bootstraps,
+                                              confidence, seed, self.workers))
+        return tuple(output)
+
+    def cluster(self, go_terms, threshold=DEFAULT_THRESHOLD, method=GREEDY):
+        """ Summarise a sample by clustering its redundant GO-terms (see megago.clustering.cluster_terms).
+
+        Returns
+        -------
+        dict
+            maps every domain onto a list of Cluster objects, most frequent clusters first
+        """
+        return cluster_terms(go_terms, self, threshold, method)
+
+    def compare_proteins(self, proteins, pairs=None, domains=None):
+        """ Compare many proteins (or other gene products with a few GO-terms each) in one batch, sharing the term
+        similarities between all pairs (see megago.proteins.compare_proteins).
+
+        Returns
+        -------
+        tuple
+            A tuple with 3 arrays, for biological process, cellular component and molecular function respectively: a
+            len(proteins) x len(proteins) similarity matrix, or the similarity of every pair in pairs if given. The
+            similarities of a domain that's not compared (see compare) are NaN.
+        """
+        return compare_proteins(proteins, self, pairs, self._select_domains(domains))
+
+    def compare_many(self, pairs, progress=None):
+        """ Compare multiple pairs of samples, reusing the worker pools and caches of this session.
+
+        Parameters
+        ----------
+        pairs : iterable
+            iterable with (go_list_1, go_list_2) tuples
+        progress : function (index, number) => void
+            is called with the index of the pair that is being compared and the progress of this comparison
+
+        Returns
+        -------
+        generator
+            yields the result of compare() for each of the given pairs, in the same order
+        """
+        for index, (go_list_1, go_list_2) in enumerate(pairs):
+            listener = None
+            if progress:
+                listener = lambda value, index=index: progress(index, value)
+            yield self.compare(go_list_1, go_list_2, listener)
+
+
+def get_default_session(go_dag=None, domains=None):
+    """Returns the session that's used by run_comparison. A new default session is started if the given go_dag differs
+    from the one that's used by the current default session, or if the current default session has not loaded all
+    given domains.
+
+    Returns
+    -------
+    Session
+    """
+    global _DEFAULT_SESSION
+    domains = parse_domains(domains) if domains else list(GO_DOMAINS)
+    if _DEFAULT_SESSION is None or (go_dag is not None and _DEFAULT_SESSION.go_dag is not go_dag) or \
+            not set(domains) <= set(_DEFAULT_SESSION.domains):
+        if _DEFAULT_SESSION is not None:
+            _DEFAULT_SESSION.close()
+        _DEFAULT_SESSION = Session(go_dag, domains=domains)
+    return _DEFAULT_SESSION
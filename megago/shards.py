@@ -0,0 +1,324 @@
+"""Divide an all-vs-all comparison over multiple machines that only share a directory.
+
+    megago plan --shards N --directory DIR [options] SAMPLES
+        splits the comparison into N shards and writes DIR/plan.json
+    megago run-shard --directory DIR K
+        computes shard K (0 <= K < N) and writes DIR/shard-K.json
+    megago merge --directory DIR
+        combines the results of all shards and prints the similarities of all pairs of samples
+
+Every pair of samples is compared per GO-domain. The planner divides each of these comparisons into units of work that
+contain a block of the (unique) terms of the first sample. A unit computes the best match of each of its rows, and of
+every term of the second sample with these rows. Merging the units of a comparison is then a matter of taking the
+maximum of the best matches of every term, which yields exactly the same similarity as comparing both samples at once.
+Units are assigned to shards such that the estimated amount of work per shard is balanced. The plan only depends on its
+input, so the same command always produces the same shards.
+
+All files are written atomically and shards are independent of each other. They can be computed on any batch system, in
+any order, and a shard that has been computed already is skipped when it's started again. The plan records the
+ontology and corpus it was created with, and a shard is refused on a machine that uses another GO release.
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import math
+import os
+import sys
+
+from .constants import GO_DOMAINS
+from .execution import EXECUTION_MODES
+from .metrics import SIMILARITY_METHODS, bma_from_best_matches
+from .reduction import REDUCTION_MODES, SLIM, read_slim
+
+PLAN = "plan"
+RUN_SHARD = "run-shard"
+MERGE = "merge"
+SHARD_COMMANDS = [PLAN, RUN_SHARD, MERGE]
+
+# Version of the plan and shard file format.
+SHARD_FORMAT_VERSION = 2
+# Every shard should receive at least this amount of units (if the comparison is large enough), which limits the
+# imbalance between shards.
+MIN_UNITS_PER_SHARD = 4
+
+
+def _write_json(path, data):
+    """Write data to a temporary file first, such that an interrupted write never leaves an incomplete file behind."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != SHARD_FORMAT_VERSION:
+        raise ValueError(f"{path} has an unsupported format version.")
+    return data
+
+
+def plan_path(directory):
+    return os.path.join(directory, "plan.json")
+
+
+def shard_path(directory, shard):
+    return os.path.join(directory, f"shard-{shard}.json")
+
+
+def plan_shards(samples, shards):
+    """Divide the comparison of all pairs of samples into units of work and assign these to shards.
+
+    Parameters
+    ----------
+    samples : list
+        for every sample, a list with the GO-terms of each domain (in the order of GO_DOMAINS)
+    shards : int
+        amount of shards
+
+    Returns
+    -------
+    list
+        for every shard, a list with [i, j, domain, row_start, row_end] units. Such a unit compares the unique terms
+        row_start:row_end (sorted) of the given domain of sample i with all terms of that domain of sample j.
+    """
+    comparisons = []
+    for i in range(len(samples)):
+        for j in range(i + 1, len(samples)):
+            for domain in range(len(GO_DOMAINS)):
+                rows = len(set(samples[i][domain]))
+                cols = len(set(samples[j][domain]))
+                if rows > 0 and cols > 0:
+                    comparisons.append((i, j, domain, rows, cols))
+
+    total_cost = sum(rows * cols for _, _, _, rows, cols in comparisons)
+    unit_cost = max(1, math.ceil(total_cost / (shards * MIN_UNITS_PER_SHARD)))
+
+    units = []
+    for i, j, domain, rows, cols in comparisons:
+        block = max(1, unit_cost // cols)
+        for row_start in range(0, rows, block):
+            row_end = min(row_start + block, rows)
+            units.append(((row_end - row_start) * cols, [i, j, domain, row_start, row_end]))
+
+    # Longest processing time first: assign the most expensive unit to the shard with the least work so far.
+    units.sort(key=lambda unit: (-unit[0], unit[1]))
+    loads = [(0, shard) for shard in range(shards)]
+    output = [[] for _ in range(shards)]
+    for cost, unit in units:
+        load, shard = heapq.heappop(loads)
+        output[shard].append(unit)
+        heapq.heappush(loads, (load + cost, shard))
+    return output
+
+
+def write_plan(directory, samples, sample_names, shards, session):
+    """Divide the comparison of all pairs of samples over the given amount of shards and write the plan to directory.
+
+    The samples are split per domain (and reduced with the reduction of the session, if any) before planning. The plan
+    records the similarity method and the fingerprint of the ontology and corpus of the session, such that every shard
+    is computed with the same GO release (see compute_shard).
+    """
+    if len(sample_names) != len(samples):
+        sample_names = ["Sample " + str(i) for i in range(len(samples))]
+
+    per_domain = []
+    for terms in samples:
+        domains = session.split_per_domain(terms)
+        if session.reduction:
+            domains = [session.reduce(domain_terms).terms for domain_terms in domains]
+        per_domain.append(domains)
+
+    os.makedirs(directory, exist_ok=True)
+    units = plan_shards(per_domain, shards)
+    _write_json(plan_path(directory), {
+        "version": SHARD_FORMAT_VERSION,
+        "similarity_method": session.similarity_method,
+        "fingerprint": session.fingerprint(),
+        "names": sample_names,
+        "samples": per_domain,
+        "shards": units
+    })
+    logging.info("Divided %d units of work over %d shards", sum(len(shard) for shard in units), len(units))
+
+
+def create_plan(options):
+    from .megago import load_samples
+    from .session import Session
+
+    samples, sample_names = load_samples(options)
+    slim_terms = read_slim(options.goslim) if options.reduce == SLIM else None
+    with Session(similarity_method=options.similarity_method, reduction=options.reduce,
+                 slim_terms=slim_terms) as session:
+        write_plan(options.directory, samples, sample_names, options.shards, session)
+
+
+def compute_shard(directory, shard, session, force=False):
+    """Compute the units of work of one shard of the plan in directory and write their best matches.
+
+    A shard that has been computed already is skipped, unless force is set. Raises a ValueError if the session uses
+    another similarity method, or another ontology or corpus than the session that created the plan: merging best
+    matches of different GO releases would silently yield a meaningless result.
+    """
+    plan = _read_json(plan_path(directory))
+    if not 0 <= shard < len(plan["shards"]):
+        raise ValueError(f"shard should be between 0 and {len(plan['shards']) - 1}, but is {shard}")
+    if session.similarity_method != plan["similarity_method"]:
+        raise ValueError(f"The plan uses the {plan['similarity_method']} similarity method, but the session uses "
+                         f"{session.similarity_method}.")
+    if session.fingerprint() != plan["fingerprint"]:
+        raise ValueError("The plan has been created with another GO release or other frequency counts than this "
+                         "machine uses, so its shards cannot be computed here.")
+
+    output_path = shard_path(directory, shard)
+    if os.path.isfile(output_path) and not force:
+        logging.info("Shard %d has already been computed", shard)
+        return
+
+    samples = plan["samples"]
+    results = []
+    for unit in plan["shards"][shard]:
+        i, j, domain, row_start, row_end = unit
+        rows = sorted(set(samples[i][domain]))[row_start:row_end]
+        best_rows, best_cols = session.best_matches(rows, samples[j][domain])
+        results.append({"unit": unit, "rows": best_rows, "cols": best_cols})
+
+    _write_json(output_path, {"version": SHARD_FORMAT_VERSION, "shard": shard, "results": results})
+
+
+def run_shard(options):
+    from .session import Session
+
+    plan = _read_json(plan_path(options.directory))
+    if os.path.isfile(shard_path(options.directory, options.shard)) and not options.force:
+        # Don't load the ontology for nothing.
+        logging.info("Shard %d has already been computed", options.shard)
+        return
+    with Session(similarity_method=plan["similarity_method"], execution=options.execution, workers=options.workers,
+                 chunk_size=options.chunk_size, tile_size=options.tile_size) as session:
+        compute_shard(options.directory, options.shard, session, force=options.force)
+
+
+def merge_shards(directory):
+    """Combine the results of all shards.
+
+    Returns
+    -------
+    tuple
+        (results, names): a dictionary that maps every pair of sample indices (i, j) with i < j onto the similarities
+        of the three domains, and the names of the samples.
+    """
+    plan = _read_json(plan_path(directory))
+    missing = [shard for shard in range(len(plan["shards"])) if not os.path.isfile(shard_path(directory, shard))]
+    if missing:
+        raise ValueError(f"The following shards have not been computed yet: {', '.join(map(str, missing))}")
+
+    samples = plan["samples"]
+    best_matches = dict()
+    for shard in range(len(plan["shards"])):
+        for result in _read_json(shard_path(directory, shard))["results"]:
+            i, j, domain, _, _ = result["unit"]
+            best_rows, best_cols = best_matches.setdefault((i, j, domain), (dict(), dict()))
+            best_rows.update(result["rows"])
+            for term, value in result["cols"].items():
+                if value > best_cols.get(term, 0.0):
+                    best_cols[term] = value
+
+    results = dict()
+    for i in range(len(samples)):
+        for j in range(i + 1, len(samples)):
+            values = []
+            for domain in range(len(GO_DOMAINS)):
+                best_rows, best_cols = best_matches.get((i, j, domain), (dict(), dict()))
+                terms_1 = samples[i][domain]
+                terms_2 = samples[j][domain]
+                best_rows = {term: best_rows.get(term, 0.0) for term in terms_1}
+                best_cols = {term: best_cols.get(term, 0.0) for term in terms_2}
+                values.append(bma_from_best_matches(terms_1, terms_2, best_rows, best_cols))
+            results[(i, j)] = tuple(values)
+    return results, plan["names"]
+
+
+def merge(options):
+    from .heatmap import generate_heatmap
+    from .megago import HEADER
+
+    results, names = merge_shards(options.directory)
+    for (i, j), values in sorted(results.items()):
+        print(f"Results for sample {i} and {j}")
+        print(HEADER)
+        for domain, value in zip(GO_DOMAINS, values):
+            print(f"{domain},{value}")
+
+    for index, domain in enumerate(GO_DOMAINS):
+        rows = [["SAMPLE"] + names]
+        for i, name in enumerate(names):
+            row = [name]
+            for j in range(len(names)):
+                row.append(1 if i == j else results[(min(i, j), max(i, j))][index])
+            rows.append(row)
+        temp_path = os.path.join(options.directory, f"similarity_{domain}.csv.tmp")
+        with open(temp_path, 'w') as f:
+            f.write("\n".join(",".join(str(value) for value in row) for row in rows) + "\n")
+        os.replace(temp_path, os.path.join(options.directory, f"similarity_{domain}.csv"))
+
+    if options.heatmap:
+        generate_heatmap(results, names)
+
+
+def parse_args(argv):
+    from .importers import INPUT_FORMATS
+
+    parser = argparse.ArgumentParser(prog="megago", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log', metavar='LOG_FILE', type=str, help='record program progress in LOG_FILE')
+    parser.add_argument('--verbose', '-v', action='count', default=0)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser(PLAN, help="Divide the comparison of all samples into shards")
+    plan_parser.add_argument('--directory', required=True, help="Directory that is shared by all shards")
+    plan_parser.add_argument('--shards', type=int, required=True, help="Amount of shards")
+    plan_parser.add_argument('--similarity-method', choices=list(SIMILARITY_METHODS), default="lin")
+    plan_parser.add_argument('--reduce', choices=REDUCTION_MODES, default=None)
+    plan_parser.add_argument('--goslim', metavar='GOSLIM_FILE', default=None)
+    plan_parser.add_argument('--input-format', choices=list(INPUT_FORMATS), default="terms")
+    plan_parser.add_argument('--mapping', metavar='MAPPING_FILE', default=None)
+    plan_parser.add_argument('--weighted', action='store_true')
+    plan_parser.add_argument('samples', metavar='SAMPLES', nargs='+', help='Samples that should be compared')
+
+    shard_parser = subparsers.add_parser(RUN_SHARD, help="Compute one shard")
+    shard_parser.add_argument('--directory', required=True, help="Directory that is shared by all shards")
+    shard_parser.add_argument('--force', action='store_true', help="Recompute the shard if it has already been computed")
+    shard_parser.add_argument('--execution', choices=EXECUTION_MODES, default=None)
+    shard_parser.add_argument('--workers', type=int, default=None)
+    shard_parser.add_argument('--chunk-size', type=int, default=None)
+    shard_parser.add_argument('--tile-size', type=int, default=None)
+    shard_parser.add_argument('shard', type=int, help="Index of the shard that should be computed")
+
+    merge_parser = subparsers.add_parser(MERGE, help="Combine the results of all shards")
+    merge_parser.add_argument('--directory', required=True, help="Directory that is shared by all shards")
+    merge_parser.add_argument('--heatmap', action='store_true',
+                              help="Generate an interactive heatmap for the compared samples")
+
+    options = parser.parse_args(argv)
+    if options.command == PLAN:
+        if options.shards < 1:
+            parser.error("--shards should be at least 1")
+        if options.reduce == SLIM and options.goslim is None:
+            parser.error("--reduce slim requires a GO slim (--goslim)")
+    return options
+
+
+def main(argv=None):
+    from .megago import init_logging
+
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    init_logging(options.log, options.verbose)
+    if options.command == PLAN:
+        create_plan(options)
+    elif options.command == RUN_SHARD:
+        run_shard(options)
+    else:
+        merge(options)
@@ -0,0 +1,264 @@
+"""Significance of the similarity of two samples.
+
+The best match average of two samples only depends on the similarities of the pairs of terms that occur in either
+sample. The similarity matrix over the union of both samples is therefore computed once, after which every permuted or
+bootstrapped sample is scored by selecting rows and columns of this matrix and reducing them with numpy.
+
+* Permutation test: the terms of both samples are pooled and randomly divided over two samples of the original sizes.
+  The p-value is the fraction of permutations with a similarity that is at least as high as the observed one (counting
+  the observed samples as one of the permutations). A low p-value means that both samples are more similar than two
+  random samples of their terms, i.e. that their terms are matched more closely than chance would explain.
+* Bootstrap: the terms of each sample are resampled with replacement, which gives a confidence interval for the
+  similarity.
+
+The matrix holds 8 bytes per pair of unique terms. Samples whose matrix would exceed MEGAGO_MAX_MATRIX_SIZE MiB are
+refused, instead of exhausting the memory of the machine.
+"""
+
+import concurrent.futures
+import os
+
+import numpy as np
+
+from . import metrics
+from .constants import GO_DAG_FILE_PATH
+from .execution import NUMPY, PROCESSES, available_cpus, create_executor, map_bounded, plan_execution
+from .pair_cache import MIB
+
+DEFAULT_PERMUTATIONS = 1000
+DEFAULT_BOOTSTRAPS = 1000
+DEFAULT_CONFIDENCE = 0.95
+# Amount of permuted or bootstrapped samples that are scored per task.
+RESAMPLE_BATCH_SIZE = 50
+# Largest similarity matrix (in MiB) that compute_similarity_matrix allocates, if the MEGAGO_MAX_MATRIX_SIZE environment
+# variable is not set. The default allows a union of about 16000 unique terms.
+ENV_MAX_MATRIX_SIZE = "MEGAGO_MAX_MATRIX_SIZE"
+DEFAULT_MAX_MATRIX_SIZE = 2048
+
+
+class SignificanceResult(object):
+    """Similarity of two samples in one GO-domain, together with its significance.
+
+    Attributes
+    ----------
+    similarity : float
+        the best match average of both samples
+    p_value : float
+        fraction of the permuted samples (plus one, for the observed samples) with a similarity that is higher than or
+        equal to the observed similarity. NaN if no permutations have been performed.
+    ci_low, ci_high : float
+        bounds of the bootstrap confidence interval. NaN if no bootstraps have been performed.
+    """
+
+    def __init__(self, similarity, p_value=np.nan, ci_low=np.nan, ci_high=np.nan):
+        self.similarity = similarity
+        self.p_value = p_value
+        self.ci_low = ci_low
+        self.ci_high = ci_high
+
+    def __repr__(self):
+        return f"SignificanceResult(similarity={self.similarity}, p_value={self.p_value}, ci_low={self.ci_low}, " \
+               f"ci_high={self.ci_high})"
+
+
+def _compute_matrix_task(params):
+    """Compute all similarities of one tile of the similarity matrix (see metrics._compute_similarity_task)."""
+    (go_list1, go_list2, context, similarity_method, backend, pair_cache) = params
+    if context is None:
+        context = metrics._WORKER_CONTEXT
+        pair_cache = metrics._WORKER_PAIR_CACHE
+    go_dag, term_counts, highest_ic_anc = context
+    if similarity_method is metrics.wang_metric:
+        return metrics.get_wang_index(go_dag).similarity_matrix(go_list1, go_list2)
+    matrix_metric = metrics.INDEX_MATRIX_METRICS.get(similarity_method)
+    if backend == NUMPY and matrix_metric is not None and metrics._use_term_tables(term_counts, highest_ic_anc):
+        tables = metrics.get_corpus_tables(term_counts, highest_ic_anc)
+        return matrix_metric(tables.table.indices(go_list1), tables.table.indices(go_list2), tables)
+    if pair_cache is not None and similarity_method in metrics.INDEX_METRICS and \
+            metrics._use_term_tables(term_counts, highest_ic_anc):
+        tables = metrics.get_corpus_tables(term_counts, highest_ic_anc)
+        return metrics.cached_index_similarities(tables.table.indices(go_list1), tables.table.indices(go_list2),
+                                                 tables, similarity_method, pair_cache)
+    return [
+        [similarity_method(id1, id2, go_dag, term_counts, highest_ic_anc) for id2 in go_list2]
+        for id1 in go_list1
+    ]
+
+
+def compute_similarity_matrix(terms, term_counts, highest_ic_anc, similarity_method="lin", go_dag=None, plan=None,
+                              executor=None, pair_cache=None, max_size=None):
+    """compute the similarity of every pair of the given terms
+
+    Only the tiles on and above the diagonal are computed, the other half of the matrix is filled in by symmetry. NaN
+    values (e.g. terms that are not present in the GO DAG) are replaced by 0, which is how compute_bma_metric treats
+    them when looking for the best match. The matrix is the only array of its size that's allocated.
+
+    Parameters
+    ----------
+    terms : list
+        unique GO-terms
+    term_counts : dict
+        dictionary: key: GO terms, values: number of occurrences of GO term and its children in body of evidence
+    highest_ic_anc : dict
+        dictionary: key: GO terms, values: information content of the ancestor with the highest information content
+    similarity_method : string
+        'lin', 'rel' or 'wang'
+    go_dag : GODag object, optional
+        GODag object from the goatools package, required when the computation is not executed by a process pool.
+    plan : ExecutionPlan, optional
+        the plan that should be followed. Chosen by the execution planner if not given.
+    executor : concurrent.futures.Executor, optional
+        an executor that matches the mode of the given plan (see compute_bma_metric).
+    pair_cache : PairCache, optional
+        cache of the similarities of pairs of terms that is shared with other comparisons (see megago.pair_cache)
+    max_size : float, optional
+        largest matrix (in MiB) that may be allocated. A ValueError is raised for a larger amount of terms. Defaults to
+        the MEGAGO_MAX_MATRIX_SIZE environment variable, or DEFAULT_MAX_MATRIX_SIZE.
+
+    Returns
+    -------
+    numpy.ndarray
+        len(terms) * len(terms) matrix
+    """
+    sim_func = metrics.SIMILARITY_METHODS.get(similarity_method)
+    if sim_func is None:
+        raise AttributeError(f"similarity_method must be in {list(metrics.SIMILARITY_METHODS)} but is "
+                             f"{similarity_method}")
+
+    size = len(terms)
+    if max_size is None:
+        max_size = float(os.environ.get(ENV_MAX_MATRIX_SIZE) or DEFAULT_MAX_MATRIX_SIZE)
+    required = size * size * np.dtype(np.float64).itemsize
+    if required > max_size * MIB:
+        raise ValueError(f"The similarity matrix of {size} unique terms requires {required / MIB:.0f} MiB, which "
+                         f"exceeds the limit of {max_size:.0f} MiB (see {ENV_MAX_MATRIX_SIZE}).")
+    matrix = np.zeros((size, size))
+    if size == 0:
+        return matrix
+
+    if plan is None:
+        plan = plan_execution(size, size)
+
+    context = None
+    if plan.mode != PROCESSES:
+        context = (go_dag, term_counts, highest_ic_anc)
+
+    tasks = (
+        (tile, (terms[tile[0]:tile[1]], terms[tile[2]:tile[3]], context, sim_func, plan.backend,
+                pair_cache if plan.mode != PROCESSES else None))
+        for tile in plan.tiles(size, size) if tile[3] > tile[0]
+    )
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = create_executor(plan, metrics._init_worker, (GO_DAG_FILE_PATH, term_counts, highest_ic_anc, None,
+                                                                pair_cache))
+    try:
+        for (row_start, row_end, col_start, col_end), values in map_bounded(executor, _compute_matrix_task, tasks,
+                                                                            plan.max_pending):
+            # All similarity metrics are symmetric, the transposed tile fills in the lower half of the matrix.
+            values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+            matrix[row_start:row_end, col_start:col_end] = values
+            matrix[col_start:col_end, row_start:row_end] = values.T
+    finally:
+        if owns_executor:
+            executor.shutdown()
+    return matrix
+
+
+def bma_from_matrix(matrix, indices1, indices2):
+    """Best match average of two samples, given as arrays with the index of each of their terms in the matrix.
+    Duplicate terms are counted, just like in compute_bma_metric.
+
+    Returns
+    -------
+    float
+        NaN if one of the samples is empty (and the other is not)
+    """
+    if len(indices1) + len(indices2) == 0:
+        return 0.0
+    if len(indices1) == 0 or len(indices2) == 0:
+        return np.nan
+    unique1, counts1 = np.unique(indices1, return_counts=True)
+    unique2, counts2 = np.unique(indices2, return_counts=True)
+    sub_matrix = matrix[np.ix_(unique1, unique2)]
+    total = counts1 @ sub_matrix.max(axis=1) + counts2 @ sub_matrix.max(axis=0)
+    return float(total / (len(indices1) + len(indices2)))
+
+
+def _permutation_batch(matrix, pooled, size1, amount, seed):
+    rng = np.random.default_rng(seed)
+    output = np.empty(amount)
+    for i in range(amount):
+        permuted = rng.permutation(pooled)
+        output[i] = bma_from_matrix(matrix, permuted[:size1], permuted[size1:])
+    return output
+
+
+def _bootstrap_batch(matrix, indices1, indices2, amount, seed):
+    rng = np.random.default_rng(seed)
+    output = np.empty(amount)
+    for i in range(amount):
+        output[i] = bma_from_matrix(matrix, rng.choice(indices1, len(indices1)), rng.choice(indices2, len(indices2)))
+    return output
+
+
+def _run_batches(function, args, amount, seed_sequence, workers):
+    """Divide amount resamples over batches that are scored by a pool of threads. numpy releases the GIL while
+    selecting and reducing sub-matrices, such that the batches are processed in parallel without copying the matrix to
+    other processes. Every batch has its own independent random number generator."""
+    sizes = [min(RESAMPLE_BATCH_SIZE, amount - start) for start in range(0, amount, RESAMPLE_BATCH_SIZE)]
+    seeds = seed_sequence.spawn(len(sizes))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda item: function(*args, item[0], item[1]), zip(sizes, seeds))
+        return np.concatenate(list(results)) if sizes else np.empty(0)
+
+
+def assess_significance(matrix, indices1, indices2, permutations=DEFAULT_PERMUTATIONS, bootstraps=DEFAULT_BOOTSTRAPS,
+                      confidence=DEFAULT_CONFIDENCE, seed=None, workers=None):
+    """Compute the similarity of two samples and its significance.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        similarity matrix that contains (at least) all terms of both samples (see compute_similarity_matrix)
+    indices1 : list
+        the index in the matrix of every term of the first sample (duplicates are counted)
+    indices2 : list
+        the index in the matrix of every term of the second sample
+    permutations : int
+        amount of permuted samples that are used to compute the p-value
+    bootstraps : int
+        amount of bootstrapped samples that are used to compute the confidence interval
+    confidence : float
+        confidence level of the interval (e.g. 0.95)
+    seed : int, optional
+        seed for the random number generators, such that results are reproducible
+    workers : int, optional
+        amount of threads that score resampled samples (defaults to the amount of available CPUs)
+
+    Returns
+    -------
+    SignificanceResult
+    """
+    indices1 = np.asarray(indices1, dtype=np.intp)
+    indices2 = np.asarray(indices2, dtype=np.intp)
+    result = SignificanceResult(bma_from_matrix(matrix, indices1, indices2))
+    if len(indices1) == 0 or len(indices2) == 0:
+        return result
+
+    workers = workers or available_cpus()
+    permutation_seeds, bootstrap_seeds = np.random.SeedSequence(seed).spawn(2)
+
+    if permutations > 0:
+        pooled = np.concatenate([indices1, indices2])
+        scores = _run_batches(_permutation_batch, (matrix, pooled, len(indices1)), permutations, permutation_seeds,
+                              workers)
+        result.p_value = (1 + np.count_nonzero(scores >= result.similarity)) / (1 + permutations)
+
+    if bootstraps > 0:
+        scores = _run_batches(_bootstrap_batch, (matrix, indices1, indices2), bootstraps, bootstrap_seeds, workers)
+        alpha = (1 - confidence) / 2
+        result.ci_low, result.ci_high = np.quantile(scores, [alpha, 1 - alpha])
+
+    return result
@@ -0,0 +1,430 @@
+"""Validate fast engines against the goatools reference implementation (python -m megago.validation).
+
+The original implementations of lin_metric, rel_metric, compute_bma_metric and get_ic_of_most_informative_ancestor
+look up every term in the GO DAG of goatools and in dictionaries. They are used as an oracle: an engine has to reproduce
+their values before it's used in production. The harness compares an engine with the oracle on
+
+* the samples in the given files (by default the bundled data/ samples and functional_tests/testdata). Consecutive
+  samples of a directory are compared with each other, files with a set1 and set2 column (such as
+  example_input_compare_goa.csv) contribute one pair per row, and
+* pairs of random sets of terms,
+
+and reports for the similarities of term pairs, the best match averages and the highest_ic values the maximum absolute
+and relative deviation, the values that do not match, and the time that both paths took. Large samples are subsampled,
+since the oracle compares terms one pair at a time.
+
+goatools picks an arbitrary deepest common ancestor if several common ancestors have the same depth (it depends on the
+iteration order of a set, i.e. on PYTHONHASHSEED), whereas TermTable breaks such ties by the lowest GO-identifier. The
+deviation of a term pair is therefore reported as a tie instead of a mismatch if the value of the engine equals the
+value of the oracle for one of the tied ancestors. The best match averages of a pair of samples whose only deviating
+term pairs are ties are reported as ties as well.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from .constants import GO_DOMAINS
+from .execution import NUMPY, PYTHON
+from .importers import GO_TERM_REGEX
+from .metrics import INDEX_MATRIX_METRICS, SIMILARITY_METHODS, compute_bma_metric, get_corpus_tables, \
+    get_ic_of_most_informative_ancestor, get_info_content, get_frequency, wang_metric
+
+DEFAULT_TOLERANCE = 1e-9
+# Maximum amount of (unique) terms of a sample that are compared, larger samples are subsampled.
+DEFAULT_MAX_TERMS = 100
+DEFAULT_RANDOM_PAIRS = 10
+# Files from which samples are read, all other files of a source directory are ignored.
+SAMPLE_EXTENSIONS = (".csv", ".tsv", ".txt", ".tab", ".tabular", ".mpa")
+
+TERM_PAIRS = "term pairs"
+BEST_MATCH_AVERAGE = "best match average"
+HIGHEST_IC = "highest_ic"
+
+
+class Engine(object):
+    """An implementation of the similarity computations. Engines that should be validated derive from this class and
+    override the methods that they implement differently.
+
+    Parameters
+    ----------
+    go_dag : GODag object
+    term_counts, highest_ic_anc : TermArray
+        the corpus tables that belong to go_dag
+    similarity_method : str
+        'lin' or 'rel'
+    """
+
+    name = None
+    # Backend of compute_bma_metric (see megago.execution.BACKENDS).
+    backend = PYTHON
+
+    def __init__(self, go_dag, term_counts, highest_ic_anc, similarity_method="lin"):
+        if SIMILARITY_METHODS.get(similarity_method) in (None, wang_metric):
+            raise ValueError(f"Only the lin and rel metric can be validated, not {similarity_method}")
+        self.go_dag = go_dag
+        self.term_counts = term_counts
+        self.highest_ic_anc = highest_ic_anc
+        self.similarity_method = similarity_method
+
+    def similarities(self, terms1, terms2):
+        """Returns the len(terms1) x len(terms2) matrix with the similarity of every pair of terms."""
+        sim_func = SIMILARITY_METHODS[self.similarity_method]
+        return np.array([[sim_func(term1, term2, self.go_dag, self.term_counts, self.highest_ic_anc)
+                          for term2 in terms2] for term1 in terms1], dtype=float).reshape(len(terms1), len(terms2))
+
+    def bma(self, terms1, terms2):
+        """Returns the best match average of two lists of terms of the same domain."""
+        return compute_bma_metric(terms1, terms2, self.term_counts, self.highest_ic_anc,
+                                  similarity_method=self.similarity_method, go_dag=self.go_dag, execution="serial",
+                                  backend=self.backend)
+
+    def highest_ic(self, terms):
+        """Returns the information content of the most informative ancestor of every term."""
+        return np.array([self.highest_ic_anc.get(term, math.nan) for term in terms], dtype=float)
+
+
+class GoatoolsEngine(Engine):
+    """The oracle: the corpus tables are converted to dictionaries, which makes all metrics take the goatools path."""
+
+    name = "goatools"
+
+    def __init__(self, go_dag, term_counts, highest_ic_anc, similarity_method="lin"):
+        super().__init__(go_dag, {term: term_counts.get(term, 0) for term in go_dag},
+                         {term: highest_ic_anc.get(term, 0) for term in go_dag}, similarity_method)
+
+    def highest_ic(self, terms):
+        return np.array([get_ic_of_most_informative_ancestor(term, self.term_counts, self.go_dag)
+                         if term in self.go_dag else math.nan for term in terms], dtype=float)
+
+    def tied_values(self, term1, term2):
+        """Returns the similarity of two terms of the same domain for every common ancestor with the highest depth,
+        i.e. every value that the oracle could have returned."""
+        ancestors = []
+        for term in (term1, term2):
+            record = self.go_dag[term]
+            ancestors.append(record.get_all_parents() | {record.item_id})
+        common = ancestors[0] & ancestors[1]
+        depth = max(self.go_dag[ancestor].depth for ancestor in common)
+
+        info_content = []
+        for term in (term1, term2):
+            value = get_info_content(term, self.term_counts, self.go_dag)
+            info_content.append(value if value != 0 else self.highest_ic_anc[term])
+        if sum(info_content) == 0:
+            return [0]
+
+        values = []
+        for ancestor in common:
+            if self.go_dag[ancestor].depth == depth:
+                numerator = 2 * get_info_content(ancestor, self.term_counts, self.go_dag)
+                if self.similarity_method == "rel":
+                    numerator *= 1 - get_frequency(ancestor, self.term_counts, self.go_dag)
+                values.append(numerator / sum(info_content))
+        return values
+
+
+class PythonEngine(Engine):
+    """The term table engine with Python loops (see megago.execution.BACKENDS)."""
+
+    name = PYTHON
+
+
+class NumpyEngine(Engine):
+    """The term table engine with the vectorised kernels."""
+
+    name = NUMPY
+    backend = NUMPY
+
+    def similarities(self, terms1, terms2):
+        table = self.term_counts.table
+        matrix_metric = INDEX_MATRIX_METRICS[SIMILARITY_METHODS[self.similarity_method]]
+        return matrix_metric(table.indices(terms1), table.indices(terms2),
+                             get_corpus_tables(self.term_counts, self.highest_ic_anc))
+
+
+ENGINES = {
+    PYTHON: PythonEngine,
+    NUMPY: NumpyEngine
+}
+
+
+class CheckResult(object):
+    """Deviations of an engine from the oracle for one kind of value.
+
+    Attributes
+    ----------
+    name : str
+    compared : int
+        amount of compared values
+    max_absolute, max_relative : float
+        the largest deviation of all values that are not ties. A value that's NaN for only one of both paths is a
+        mismatch, but does not count for these maxima.
+    ties : list
+        (key, expected, actual) tuples of the values that deviate because of a tie (see the description of this module)
+    mismatches : list
+        (key, expected, actual) tuples of all other values that deviate more than the tolerance
+    oracle_seconds, engine_seconds : float
+        time that both paths took
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.compared = 0
+        self.max_absolute = 0.0
+        self.max_relative = 0.0
+        self.ties = []
+        self.mismatches = []
+        self.oracle_seconds = 0.0
+        self.engine_seconds = 0.0
+
+    def add(self, key, expected, actual, tolerance, accepted=()):
+        """Compare one value. Returns whether it deviates (as a tie or as a mismatch).
+
+        Parameters
+        ----------
+        accepted : collection
+            values that are reported as a tie instead of a mismatch
+        """
+        self.compared += 1
+        expected = float(expected)
+        actual = float(actual)
+        if math.isnan(expected) or math.isnan(actual):
+            if math.isnan(expected) and math.isnan(actual):
+                return False
+            self.mismatches.append((key, expected, actual))
+            return True
+
+        absolute = abs(expected - actual)
+        if absolute <= tolerance:
+            return False
+        if any(abs(value - actual) <= tolerance for value in accepted):
+            self.ties.append((key, expected, actual))
+            return True
+        self.max_absolute = max(self.max_absolute, absolute)
+        self.max_relative = max(self.max_relative, absolute / abs(expected) if expected != 0 else math.inf)
+        self.mismatches.append((key, expected, actual))
+        return True
+
+
+def _split_per_domain(terms, go_dag):
+    """Like megago.session.split_per_domain, without warnings for terms that are not present in go_dag."""
+    return [[term for term in terms if term in go_dag and go_dag[term].namespace == domain] for domain in GO_DOMAINS]
+
+
+def validate(engine, oracle, pairs, tolerance=DEFAULT_TOLERANCE):
+    """Compare an engine with the oracle.
+
+    Parameters
+    ----------
+    engine : Engine
+    oracle : GoatoolsEngine
+    pairs : iterable
+        (name, terms1, terms2) tuples
+    tolerance : float
+        maximum absolute deviation of a value that matches
+
+    Returns
+    -------
+    list
+        a CheckResult for the similarities of the term pairs, for the best match averages and for the highest_ic values
+    """
+    term_pairs = CheckResult(TERM_PAIRS)
+    averages = CheckResult(BEST_MATCH_AVERAGE)
+    highest_ic = CheckResult(HIGHEST_IC)
+    validated_terms = set()
+
+    def timed(check, function, *args):
+        start = time.perf_counter()
+        oracle_value = getattr(oracle, function)(*args)
+        middle = time.perf_counter()
+        engine_value = getattr(engine, function)(*args)
+        check.oracle_seconds += middle - start
+        check.engine_seconds += time.perf_counter() - middle
+        return oracle_value, engine_value
+
+    for name, terms1, terms2 in pairs:
+        unique1 = sorted(set(terms1))
+        unique2 = sorted(set(terms2))
+        expected, actual = timed(term_pairs, "similarities", unique1, unique2)
+        # Domains in which a term pair deviates because of a tie, or because of a mismatch.
+        tied_domains = set()
+        mismatching_domains = set()
+        for i, term1 in enumerate(unique1):
+            for j, term2 in enumerate(unique2):
+                accepted = ()
+                # The tied values are only computed for values that deviate, which is rare.
+                if abs(expected[i, j] - actual[i, j]) > tolerance:
+                    accepted = oracle.tied_values(term1, term2)
+                ties = len(term_pairs.ties)
+                if term_pairs.add((name, term1, term2), expected[i, j], actual[i, j], tolerance, accepted):
+                    domain = oracle.go_dag[term1].namespace if term1 in oracle.go_dag else None
+                    (tied_domains if len(term_pairs.ties) > ties else mismatching_domains).add(domain)
+
+        for domain, domain_terms1, domain_terms2 in zip(GO_DOMAINS, _split_per_domain(terms1, oracle.go_dag),
+                                                        _split_per_domain(terms2, oracle.go_dag)):
+            expected, actual = timed(averages, "bma", domain_terms1, domain_terms2)
+            # A best match average can only be accepted as a tie if it deviates because of tied term pairs.
+            accepted = (actual,) if domain in tied_domains and domain not in mismatching_domains else ()
+            averages.add((name, domain), expected, actual, tolerance, accepted)
+
+        terms = sorted(term for term in set(unique1) | set(unique2) if term not in validated_terms)
+        validated_terms.update(terms)
+        expected, actual = timed(highest_ic, "highest_ic", terms)
+        for term, expected_value, actual_value in zip(terms, expected, actual):
+            highest_ic.add(term, expected_value, actual_value, tolerance)
+
+    return [term_pairs, averages, highest_ic]
+
+
+def _subsample(terms, max_terms, rng):
+    terms = sorted(set(terms))
+    if len(terms) > max_terms:
+        terms = sorted(rng.choice(terms, max_terms, replace=False).tolist())
+    return terms
+
+
+def _read_terms(path):
+    with open(path, errors="replace") as f:
+        return GO_TERM_REGEX.findall(f.read())
+
+
+def _read_set_pairs(path):
+    """Returns the (name, set1, set2) tuples of a file with an ID, set1 and set2 column, or None if path is not such a
+    file. The terms of a set are separated by ;."""
+    with open(path, errors="replace") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+        if "set1" not in header or "set2" not in header:
+            return None
+        columns = [header.index(column) for column in ("set1", "set2")]
+        output = []
+        for line_number, line in enumerate(f, 2):
+            fields = line.rstrip("\r\n").split(",")
+            if len(fields) > max(columns):
+                name = f"{path}:{fields[0] if 'ID' in header else line_number}"
+                output.append((name, *[[term for term in fields[column].split(";") if term] for column in columns]))
+        return output
+
+
+def read_validation_pairs(paths, max_terms=DEFAULT_MAX_TERMS, seed=0):
+    """Read the pairs of samples that are validated from files and directories (see the description of this module).
+
+    Returns
+    -------
+    list
+        (name, terms1, terms2) tuples
+    """
+    rng = np.random.default_rng(seed)
+    output = []
+    for path in paths:
+        if os.path.isdir(path):
+            directories = [(directory, sorted(files)) for directory, _, files in sorted(os.walk(path))]
+        else:
+            directories = [(os.path.dirname(path), [os.path.basename(path)])]
+
+        for directory, files in directories:
+            samples = []
+            for file_name in files:
+                file_path = os.path.join(directory, file_name)
+                if not file_name.lower().endswith(SAMPLE_EXTENSIONS):
+                    continue
+                set_pairs = _read_set_pairs(file_path)
+                if set_pairs is not None:
+                    output.extend(set_pairs)
+                    continue
+                terms = _read_terms(file_path)
+                if terms:
+                    samples.append((file_path, _subsample(terms, max_terms, rng)))
+            for (name1, terms1), (name2, terms2) in zip(samples, samples[1:]):
+                output.append((f"{name1} vs {name2}", terms1, terms2))
+    return output
+
+
+def random_pairs(go_dag, amount=DEFAULT_RANDOM_PAIRS, max_terms=DEFAULT_MAX_TERMS, seed=0):
+    """Returns amount pairs of random sets of terms of go_dag (including alternative identifiers). The first set of
+    every pair contains an unknown identifier as well.
+
+    Returns
+    -------
+    list
+        (name, terms1, terms2) tuples
+    """
+    rng = np.random.default_rng(seed)
+    terms = sorted(go_dag)
+    output = []
+    for index in range(amount):
+        sizes = rng.integers(1, min(max_terms, len(terms)) + 1, 2)
+        terms1 = rng.choice(terms, sizes[0], replace=False).tolist() + ["GO:0000000"]
+        terms2 = rng.choice(terms, sizes[1], replace=False).tolist()
+        output.append((f"random {index}", terms1, terms2))
+    return output
+
+
+def default_sources():
+    """The bundled samples and test data of a source checkout (these are not installed with the package)."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = [os.path.join(root, "data"), os.path.join(root, "functional_tests", "testdata")]
+    return [path for path in paths if os.path.isdir(path)]
+
+
+def format_report(results, engine_name, show=10):
+    """Returns a human readable report of the results of validate, with at most show ties and mismatches per check."""
+    lines = [f"{'CHECK':<20}{'COMPARED':>10}{'MAX_ABS':>12}{'MAX_REL':>12}{'TIES':>8}{'MISMATCHES':>12}"
+             f"{'GOATOOLS (s)':>14}{engine_name.upper() + ' (s)':>14}{'SPEEDUP':>10}"]
+    for result in results:
+        speedup = result.oracle_seconds / result.engine_seconds if result.engine_seconds > 0 else math.inf
+        lines.append(f"{result.name:<20}{result.compared:>10}{result.max_absolute:>12.3g}{result.max_relative:>12.3g}"
+                     f"{len(result.ties):>8}{len(result.mismatches):>12}{result.oracle_seconds:>14.3f}"
+                     f"{result.engine_seconds:>14.3f}{speedup:>9.1f}x")
+    for result in results:
+        for label, values in (("mismatches", result.mismatches), ("ties", result.ties)):
+            if values and show > 0:
+                lines.append(f"\n{result.name} {label} (expected, actual):")
+                lines.extend(f"  {key}: {expected!r}, {actual!r}" for key, expected, actual in values[:show])
+                if len(values) > show:
+                    lines.append(f"  ... and {len(values) - show} more")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate an engine against the goatools reference implementation.")
+    parser.add_argument('--engine', choices=list(ENGINES), default=NUMPY,
+                        help="Engine that's validated (default: %(default)s)")
+    parser.add_argument('--similarity-method', choices=["lin", "rel"], default="lin",
+                        help="Metric that's validated (default: %(default)s)")
+    parser.add_argument('--random', type=int, default=DEFAULT_RANDOM_PAIRS,
+                        help="Amount of pairs of random sets of terms (default: %(default)s)")
+    parser.add_argument('--max-terms', type=int, default=DEFAULT_MAX_TERMS,
+                        help="Samples with more terms are subsampled (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for the subsamples and random sets (default: %(default)s)")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Maximum absolute deviation of a matching value (default: %(default)s)")
+    parser.add_argument('--show', type=int, default=10,
+                        help="Amount of ties and mismatches that are listed per check (default: %(default)s)")
+    parser.add_argument('paths', metavar='PATH', nargs='*',
+                        help="Files or directories with samples. Defaults to data/ and functional_tests/testdata of "
+                             "the source checkout.")
+    options = parser.parse_args()
+
+    from .session import Session
+
+    with Session(similarity_method=options.similarity_method) as session:
+        arguments = (session.go_dag, session.term_counts, session.highest_ic_anc, options.similarity_method)
+        oracle = GoatoolsEngine(*arguments)
+        engine = ENGINES[options.engine](*arguments)
+        pairs = read_validation_pairs(options.paths or default_sources(), options.max_terms, options.seed)
+        pairs.extend(random_pairs(session.go_dag, options.random, options.max_terms, options.seed))
+        results = validate(engine, oracle, pairs, options.tolerance)
+
+    print(format_report(results, engine.name, options.show))
+    # A non-zero exit status makes the validation usable as a gate in CI.
+    sys.exit(1 if any(result.mismatches for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
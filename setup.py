@@ -37,6 +37,7 @@ setup(
     install_requires=[
         "goatools",
         "seaborn",
-        "progress"
+        "progress",
+        "numpy"
     ],
 )
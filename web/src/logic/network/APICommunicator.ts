@@ -15,9 +15,20 @@ export default class APICommunicator {
 
     public static async getProgress(id: string): Promise<number> {
         const result = await axios.post(`${APICommunicator.BASE_URL}/progress/${id}`);
+        if (result.data.state === "cancelled" || result.data.state === "failed") {
+            throw new Error(`Analysis ${id} has been ${result.data.state}.`);
+        }
         return parseFloat(result.data.progress);
     }
 
+    /**
+     * Stop an analysis whose results are no longer needed. The request is sent with a beacon, such that it's also
+     * delivered while the page is being closed.
+     */
+    public static cancel(id: string): void {
+        navigator.sendBeacon(`${APICommunicator.BASE_URL}/cancel/${id}`);
+    }
+
     public static async getResults(id: string): Promise<SimilarityResponse> {
         const result = await axios.post(`${APICommunicator.BASE_URL}/result/${id}`);
         return result.data;
@@ -25,6 +25,15 @@ export interface GoState {
     error: boolean;
 }
 
+// Identifier of the analysis that is currently being computed by the API (if any).
+let currentAnalysis: string | undefined = undefined;
+
+window.addEventListener("unload", () => {
+    if (currentAnalysis) {
+        APICommunicator.cancel(currentAnalysis);
+    }
+});
+
 const state: GoState = {
     goList1: [],
     goList2: [],
@@ -112,15 +121,28 @@ const actions: ActionTree<GoState, any> = {
     async analyse(store: ActionContext<GoState, any>) {
         store.commit("SET_ERROR", false);
 
+        // The results of a previous analysis that's still running are no longer needed.
+        if (currentAnalysis) {
+            APICommunicator.cancel(currentAnalysis);
+        }
+
         const id: string = await APICommunicator.computeSimilarities(
             store.getters.goList1,
             store.getters.goList2
         );
+        currentAnalysis = id;
 
         await new Promise<void>(resolve => {
             // Keep requesting a progress update, until the current progress is 1. After that we can safely request the
             // computed results and continue...
             const interval = setInterval(async() => {
+                if (currentAnalysis !== id) {
+                    // This analysis has been replaced by a new one.
+                    clearInterval(interval);
+                    resolve();
+                    return;
+                }
+
                 try {
                     const progress = await APICommunicator.getProgress(id);
                     store.commit("UPDATE_PROGRESS", progress);
@@ -133,6 +155,7 @@ const actions: ActionTree<GoState, any> = {
                         ]);
                         store.commit("UPDATE_INVALID_TERMS", data.invalid);
 
+                        currentAnalysis = undefined;
                         clearInterval(interval);
                         resolve();
                     }